@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import base64
 import os
 import json
 
@@ -46,8 +45,11 @@ def index():
     if "attributes" not in msg:
         raise Exception("Missing pubsub attributes")
 
+    shared.record_request()
+
     try:
-        event = process_argocd_event(msg)
+        with shared.timed("process", "argocd"):
+            event = process_argocd_event(msg)
 
         # [Do not edit below]
         shared.insert_row_into_bigquery(event)
@@ -60,12 +62,21 @@ def index():
                 "json_payload": envelope
             }
         print(json.dumps(entry))
+        return shared.handle_error(e, envelope, "argocd", event)
 
     return "", 204
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Serves this worker's metrics in the Prometheus text format.
+    """
+    return shared.metrics_response()
+
+
 def process_argocd_event(msg):
-    metadata = json.loads(base64.b64decode(msg["data"]).decode("utf-8").strip())
+    metadata = shared.message_document(msg, "argocd")
 
     # Unique hash for the event
     signature = shared.create_unique_id(msg)
@@ -73,8 +84,9 @@ def process_argocd_event(msg):
     argocd_event = {
         "event_type": "deployment",  # Event type, eg "push", "pull_reqest", etc
         "id": metadata["id"],  # Object ID, eg pull request ID
-        "metadata": json.dumps(metadata),  # The body of the msg
-        "time_created": metadata["time"],  # The timestamp of with the event
+        "metadata": metadata.dumps(),  # The body of the msg
+        "time_created": shared.normalize_timestamp(
+            metadata["time"], "argocd"),  # The timestamp of with the event
         "signature": signature,  # The unique event signature
         "msg_id": msg["message_id"],  # The pubsub message id
         "source": "argocd",  # The name of the source, eg "github"
@@ -71,7 +71,7 @@ def test_argocd_event_processed(client):
         "event_type": "deployment",
         "id": "foo",
         "metadata": '{"foo": "bar", "id": "foo", "time": 0}',
-        "time_created": 0,
+        "time_created": "1970-01-01T00:00:00.000000Z",
         "signature": "a424b5326ac45bde4c42c9b74dc878e56623d84f",
         "msg_id": "foobar",
         "source": "argocd",
@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import base64
 import os
 import json
 
@@ -43,16 +42,16 @@ def index():
     if "attributes" not in msg:
         raise Exception("Missing pubsub attributes")
 
-    try:
-        attr = msg["attributes"]
+    shared.record_request()
 
+    try:
         # Header Event info
-        if "headers" in attr:
-            headers = json.loads(attr["headers"])
-
+        headers = shared.message_headers(msg)
+        if headers:
             # Process CircleCI Events
             if "Circleci-Event-Type" in headers:
-                event = process_circleci_event(headers, msg)
+                with shared.timed("process", "circleci"):
+                    event = process_circleci_event(headers, msg)
 
         shared.insert_row_into_bigquery(event)
 
@@ -64,15 +63,24 @@ def index():
                 "json_payload": envelope
             }
         print(json.dumps(entry))
+        return shared.handle_error(e, envelope, "circleci", event)
 
     return "", 204
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Serves this worker's metrics in the Prometheus text format.
+    """
+    return shared.metrics_response()
+
+
 def process_circleci_event(headers, msg):
     event_type = headers["Circleci-Event-Type"]
     signature = headers["Circleci-Signature"]
-    metadata = json.loads(base64.b64decode(msg["data"]).decode("utf-8").strip())
-    types = {"workflow-completed", "job-completed"}
+    metadata = shared.message_document(msg, "circleci")
+    types = shared.SUPPORTED_EVENT_TYPES["circleci"]
 
     if event_type not in types:
         raise Exception("Unsupported CircleCI event: '%s'" % event_type)
@@ -80,8 +88,9 @@ def process_circleci_event(headers, msg):
     circleci_event = {
         "event_type": event_type,
         "id": metadata["id"],
-        "metadata": json.dumps(metadata),
-        "time_created": metadata["happened_at"],
+        "metadata": metadata.dumps(),
+        "time_created": shared.normalize_timestamp(
+            metadata["happened_at"], "circleci"),
         "signature": signature,
         "msg_id": msg["message_id"],
         "source": "circleci",
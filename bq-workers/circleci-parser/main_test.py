@@ -72,7 +72,7 @@ def test_circleci_event_processed(client):
         "event_type": "workflow-completed",
         "id": "bar",
         "metadata": '{"id": "bar", "happened_at": 0}',
-        "time_created": 0,
+        "time_created": "1970-01-01T00:00:00.000000Z",
         "signature": "foo",
         "msg_id": "foobar",
         "source": "circleci",
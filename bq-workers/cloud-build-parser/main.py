@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import base64
 import os
 import json
 
@@ -43,11 +42,14 @@ def index():
     if "attributes" not in msg:
         raise Exception("Missing pubsub attributes")
 
+    shared.record_request()
+
     try:
         attr = msg["attributes"]
         # Process Cloud Build event
         if "buildId" in attr:
-            event = process_cloud_build_event(attr, msg)
+            with shared.timed("process", "cloud_build"):
+                event = process_cloud_build_event(attr, msg)
 
         shared.insert_row_into_bigquery(event)
 
@@ -59,10 +61,19 @@ def index():
                 "json_payload": envelope
             }
         print(json.dumps(entry))
+        return shared.handle_error(e, envelope, "cloud_build", event)
 
     return "", 204
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Serves this worker's metrics in the Prometheus text format.
+    """
+    return shared.metrics_response()
+
+
 def process_cloud_build_event(attr, msg):
     event_type = "build"
     e_id = attr["buildId"]
@@ -71,7 +82,7 @@ def process_cloud_build_event(attr, msg):
     signature = shared.create_unique_id(msg)
 
     # Payload
-    metadata = json.loads(base64.b64decode(msg["data"]).decode("utf-8").strip())
+    metadata = shared.message_document(msg, "cloud_build")
 
     # Most up to date timestamp for the event
     time_created = (metadata.get("finishTime") or metadata.get("startTime") or metadata.get("createTime"))
@@ -79,8 +90,8 @@ def process_cloud_build_event(attr, msg):
     build_event = {
         "event_type": event_type,
         "id": e_id,
-        "metadata": json.dumps(metadata),
-        "time_created": time_created,
+        "metadata": metadata.dumps(),
+        "time_created": shared.normalize_timestamp(time_created, "cloud_build"),
         "signature": signature,
         "msg_id": msg["message_id"],
         "source": "cloud_build",
@@ -71,7 +71,7 @@ def test_cloud_build_event_processed(client):
         "event_type": "build",
         "id": "foo",
         "metadata": '{"createTime": 1, "startTime": 2, "finishTime": 3}',
-        "time_created": 3,
+        "time_created": "1970-01-01T00:00:03.000000Z",
         "signature": shared.create_unique_id(pubsub_msg["message"]),
         "msg_id": "foobar",
         "source": "cloud_build",
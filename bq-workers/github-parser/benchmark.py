@@ -0,0 +1,125 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Micro-benchmark of process_github_event, per event type:
+
+    python benchmark.py [--number N]
+
+Payloads carry repository and sender objects of realistic size, and push
+payloads carry 20 commits. Each type is timed with and without
+METADATA_PASSTHROUGH.
+"""
+
+import argparse
+import base64
+import json
+import timeit
+
+import shared
+
+import main
+
+TIMESTAMP = "2021-06-15T13:12:14Z"
+
+
+def _padding(prefix, keys):
+    return {"%s_%d" % (prefix, i): "https://api.github.com/%s/%d" % (prefix, i)
+            for i in range(keys)}
+
+
+def _commit(i):
+    return {
+        "id": "%040x" % i,
+        "tree_id": "%040x" % (i + 1),
+        "message": "Fix [bug] #%d with \"quotes\"" % i,
+        "timestamp": TIMESTAMP,
+        "author": {"name": "Jane", "email": "jane@example.com"},
+        "added": ["src/file_%d.py" % j for j in range(5)],
+        "modified": [],
+        "removed": [],
+    }
+
+
+def _object(**fields):
+    value = _padding("field", 20)
+    value.update(fields)
+    return value
+
+
+def payloads():
+    """
+    Returns a sample payload for every supported event type
+    """
+    common = {
+        "repository": dict(_padding("repo", 80), name="fourkeys"),
+        "sender": _padding("user", 18),
+    }
+    samples = {
+        "push": {"ref": "refs/heads/main",
+                 "commits": [_commit(i) for i in range(20)],
+                 "head_commit": _commit(20)},
+        "pull_request": {"number": 1,
+                         "pull_request": _object(updated_at=TIMESTAMP)},
+        "pull_request_review": {"review": _object(id=1, submitted_at=TIMESTAMP)},
+        "pull_request_review_comment": {
+            "comment": _object(id=1, updated_at=TIMESTAMP)},
+        "issues": {"issue": _object(number=1, updated_at=TIMESTAMP)},
+        "issue_comment": {"comment": _object(id=1, updated_at=TIMESTAMP)},
+        "check_run": {"check_run": _object(id=1, completed_at=None,
+                                           started_at=TIMESTAMP)},
+        "check_suite": {"check_suite": _object(id=1, updated_at=TIMESTAMP)},
+        "deployment": {"deployment": _object(id=1, updated_at=TIMESTAMP)},
+        "deployment_status": {
+            "deployment_status": _object(id=1, updated_at=TIMESTAMP),
+            "deployment": _object(id=1)},
+        "status": _object(id=1, updated_at=TIMESTAMP),
+        "release": {"release": _object(id=1, published_at=TIMESTAMP)},
+        "workflow_run": {"workflow_run": _object(id=1, updated_at=TIMESTAMP)},
+        "workflow_job": {"workflow_job": _object(id=1, completed_at=TIMESTAMP)},
+    }
+    for event_type, sample in samples.items():
+        payload = dict(sample)
+        payload.update(common)
+        yield event_type, payload
+
+
+def run(number):
+    print("%-28s %8s %12s %12s" % ("event type", "bytes", "parsed us",
+                                   "passthrough us"))
+    for event_type, payload in payloads():
+        data = json.dumps(payload).encode("utf-8")
+        msg = {
+            "data": base64.b64encode(data).decode("utf-8"),
+            "attributes": {},
+            "message_id": "benchmark",
+        }
+        headers = {"X-Github-Event": event_type, "X-Hub-Signature": "sha1=0"}
+        timings = []
+        for passthrough in (False, True):
+            shared.METADATA_PASSTHROUGH = passthrough
+            seconds = timeit.timeit(
+                lambda: main.process_github_event(headers, msg), number=number
+            )
+            timings.append(seconds / number * 1e6)
+        shared.METADATA_PASSTHROUGH = False
+        print("%-28s %8d %12.1f %12.1f" % ((event_type, len(data)) +
+                                           tuple(timings)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=2000,
+                        help="iterations per event type")
+    run(parser.parse_args().number)
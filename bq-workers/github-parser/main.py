@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import base64
 import os
 import json
 
@@ -43,16 +42,16 @@ def index():
     if "attributes" not in msg:
         raise Exception("Missing pubsub attributes")
 
-    try:
-        attr = msg["attributes"]
+    shared.record_request()
 
+    try:
         # Header Event info
-        if "headers" in attr:
-            headers = json.loads(attr["headers"])
-
+        headers = shared.message_headers(msg)
+        if headers:
             # Process Github Events
             if "X-Github-Event" in headers:
-                event = process_github_event(headers, msg)
+                with shared.timed("process", "github"):
+                    event = process_github_event(headers, msg)
 
         shared.insert_row_into_bigquery(event)
 
@@ -64,80 +63,134 @@ def index():
                 "json_payload": envelope
             }
         print(json.dumps(entry))
+        return shared.handle_error(e, envelope, "github", event)
 
     return "", 204
 
 
-def process_github_event(headers, msg):
-    event_type = headers["X-Github-Event"]
-    signature = headers["X-Hub-Signature"]
-    source = "github"
-
-    if "Mock" in headers:
-        source += "mock"
-
-    types = {"push", "pull_request", "pull_request_review",
-             "pull_request_review_comment", "issues",
-             "issue_comment", "check_run", "check_suite", "status",
-             "deployment_status", "release"}
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Serves this worker's metrics in the Prometheus text format.
+    """
+    return shared.metrics_response()
 
-    if event_type not in types:
-        raise Exception("Unsupported GitHub event: '%s'" % event_type)
 
-    metadata = json.loads(base64.b64decode(msg["data"]).decode("utf-8").strip())
+def _value(*path):
+    """
+    Returns an accessor for the value at `path`
+    """
+    return lambda metadata: metadata[path]
 
-    if event_type == "push":
-        time_created = metadata["head_commit"]["timestamp"]
-        e_id = metadata["head_commit"]["id"]
 
-    if event_type == "pull_request":
-        time_created = metadata["pull_request"]["updated_at"]
-        e_id = metadata["repository"]["name"] + "/" + str(metadata["number"])
+def _first(*paths):
+    """
+    Returns an accessor for the first of `paths` whose value is set
+    """
+    def accessor(metadata):
+        for path in paths:
+            value = metadata.get(*path)
+            if value:
+                return value
+        return None
 
-    if event_type == "pull_request_review":
-        time_created = metadata["review"]["submitted_at"]
-        e_id = metadata["review"]["id"]
+    return accessor
 
-    if event_type == "pull_request_review_comment":
-        time_created = metadata["comment"]["updated_at"]
-        e_id = metadata["comment"]["id"]
 
-    if event_type == "issues":
-        time_created = metadata["issue"]["updated_at"]
-        e_id = metadata["repository"]["name"] + "/" + str(metadata["issue"]["number"])
+def _scoped_number(*path):
+    """
+    Returns an accessor for "<repository name>/<number at path>", since
+    issue and pull request numbers are only unique within a repository
+    """
+    return lambda metadata: "%s/%s" % (
+        metadata["repository", "name"], metadata[path]
+    )
+
+
+# ID and timestamp accessors by X-Github-Event
+EXTRACTORS = {
+    "push": (
+        _value("head_commit", "id"),
+        _value("head_commit", "timestamp"),
+    ),
+    "pull_request": (
+        _scoped_number("number"),
+        _value("pull_request", "updated_at"),
+    ),
+    "pull_request_review": (
+        _value("review", "id"),
+        _value("review", "submitted_at"),
+    ),
+    "pull_request_review_comment": (
+        _value("comment", "id"),
+        _value("comment", "updated_at"),
+    ),
+    "issues": (
+        _scoped_number("issue", "number"),
+        _value("issue", "updated_at"),
+    ),
+    "issue_comment": (
+        _value("comment", "id"),
+        _value("comment", "updated_at"),
+    ),
+    "check_run": (
+        _value("check_run", "id"),
+        _first(("check_run", "completed_at"), ("check_run", "started_at")),
+    ),
+    "check_suite": (
+        _value("check_suite", "id"),
+        _first(("check_suite", "updated_at"), ("check_suite", "created_at")),
+    ),
+    "deployment": (
+        _value("deployment", "id"),
+        _first(("deployment", "updated_at"), ("deployment", "created_at")),
+    ),
+    "deployment_status": (
+        _value("deployment_status", "id"),
+        _value("deployment_status", "updated_at"),
+    ),
+    "status": (
+        _value("id"),
+        _value("updated_at"),
+    ),
+    "release": (
+        _value("release", "id"),
+        _first(("release", "published_at"), ("release", "created_at")),
+    ),
+    "workflow_run": (
+        _value("workflow_run", "id"),
+        _first(("workflow_run", "updated_at"), ("workflow_run", "created_at")),
+    ),
+    "workflow_job": (
+        _value("workflow_job", "id"),
+        _first(("workflow_job", "completed_at"),
+               ("workflow_job", "started_at")),
+    ),
+}
 
-    if event_type == "issue_comment":
-        time_created = metadata["comment"]["updated_at"]
-        e_id = metadata["comment"]["id"]
 
-    if event_type == "check_run":
-        time_created = (metadata["check_run"]["completed_at"] or
-                        metadata["check_run"]["started_at"])
-        e_id = metadata["check_run"]["id"]
+def process_github_event(headers, msg):
+    event_type = headers["X-Github-Event"]
+    signature = headers["X-Hub-Signature"]
+    source = "github"
 
-    if event_type == "check_suite":
-        time_created = (metadata["check_suite"]["updated_at"] or
-                        metadata["check_suite"]["created_at"])
-        e_id = metadata["check_suite"]["id"]
+    if "Mock" in headers:
+        source += "mock"
 
-    if event_type == "deployment_status":
-        time_created = metadata["deployment_status"]["updated_at"]
-        e_id = metadata["deployment_status"]["id"]
+    extractor = EXTRACTORS.get(event_type)
 
-    if event_type == "status":
-        time_created = metadata["updated_at"]
-        e_id = metadata["id"]
+    if extractor is None:
+        raise Exception("Unsupported GitHub event: '%s'" % event_type)
 
-    if event_type == "release":
-        time_created = (metadata["release"]["published_at"] or
-                        metadata["release"]["created_at"])
-        e_id = metadata["release"]["id"]
+    metadata = shared.message_document(msg, "github")
+    get_id, get_time_created = extractor
 
     github_event = {
         "event_type": event_type,
-        "id": e_id,
-        "metadata": json.dumps(metadata),
-        "time_created": time_created,
+        "id": get_id(metadata),
+        "metadata": metadata.dumps(),
+        "time_created": shared.normalize_timestamp(
+            get_time_created(metadata), "github"),
         "signature": signature,
         "msg_id": msg["message_id"],
         "source": source,
@@ -74,7 +74,7 @@ def test_github_event_processed(client):
         "event_type": "push",
         "id": "bar",
         "metadata": '{"head_commit": {"timestamp": 0, "id": "bar"}}',
-        "time_created": 0,
+        "time_created": "1970-01-01T00:00:00.000000Z",
         "signature": "foo",
         "msg_id": "foobar",
         "source": "github",
@@ -144,3 +144,136 @@ def test_github_event_avoid_id_conflicts_issues(client):
     }
 
     assert github_event_calculated["id"] == github_event_expected["id"]
+
+
+def test_transient_error_returns_retryable_status(client):
+    headers = {"X-Github-Event": "push", "X-Hub-Signature": "foo"}
+    commit = json.dumps({"head_commit": {"timestamp": 0, "id": "bar"}}).encode(
+        "utf-8"
+    )
+    pubsub_msg = {
+        "message": {
+            "data": base64.b64encode(commit).decode("utf-8"),
+            "attributes": {"headers": json.dumps(headers)},
+            "message_id": "foobar",
+        },
+    }
+
+    shared.insert_row_into_bigquery = mock.MagicMock(
+        side_effect=shared.TransientError("BigQuery unavailable")
+    )
+
+    r = client.post(
+        "/",
+        data=json.dumps(pubsub_msg),
+        headers={"Content-Type": "application/json"},
+    )
+
+    assert r.status_code == 503
+    assert "Retry-After" in r.headers
+
+
+def test_metrics_endpoint(client):
+    headers = {"X-Github-Event": "push", "X-Hub-Signature": "foo"}
+    commit = json.dumps({"head_commit": {"timestamp": 0, "id": "bar"}}).encode(
+        "utf-8"
+    )
+    pubsub_msg = {
+        "message": {
+            "data": base64.b64encode(commit).decode("utf-8"),
+            "attributes": {"headers": json.dumps(headers)},
+            "message_id": "foobar",
+        },
+    }
+
+    shared.insert_row_into_bigquery = mock.MagicMock()
+    client.post(
+        "/",
+        data=json.dumps(pubsub_msg),
+        headers={"Content-Type": "application/json"},
+    )
+
+    r = client.get("/metrics")
+
+    assert r.status_code == 200
+    assert r.content_type.startswith("text/plain")
+    body = r.get_data(as_text=True)
+    assert 'fourkeys_stage_seconds_count{stage="process",source="github",event_type=""}' in body
+    assert 'fourkeys_stage_seconds_count{stage="json_loads",source="github",event_type=""}' in body
+
+
+def test_github_event_compact_envelope(client):
+    commit = json.dumps({"head_commit": {"timestamp": 0, "id": "bar"}}).encode(
+        "utf-8"
+    )
+    pubsub_msg = {
+        "message": {
+            "data": base64.b64encode(commit).decode("utf-8"),
+            "attributes": {
+                "envelope": "2",
+                "X-Github-Event": "push",
+                "X-Hub-Signature": "foo",
+            },
+            "message_id": "foobar",
+        },
+    }
+
+    shared.insert_row_into_bigquery = mock.MagicMock()
+
+    r = client.post(
+        "/",
+        data=json.dumps(pubsub_msg),
+        headers={"Content-Type": "application/json"},
+    )
+
+    event = shared.insert_row_into_bigquery.call_args[0][0]
+    assert r.status_code == 204
+    assert event["event_type"] == "push"
+    assert event["signature"] == "foo"
+
+
+UPDATED = "2021-06-15T15:12:14+02:00"
+UPDATED_UTC = "2021-06-15T13:12:14.000000Z"
+
+
+@pytest.mark.parametrize("event_type,payload,e_id", [
+    ("push", {"head_commit": {"id": "a", "timestamp": UPDATED}}, "a"),
+    ("pull_request", {"number": 1, "repository": {"name": "r"},
+                      "pull_request": {"updated_at": UPDATED}}, "r/1"),
+    ("pull_request_review",
+     {"review": {"id": 2, "submitted_at": UPDATED}}, 2),
+    ("pull_request_review_comment",
+     {"comment": {"id": 3, "updated_at": UPDATED}}, 3),
+    ("issues", {"repository": {"name": "r"},
+                "issue": {"number": 4, "updated_at": UPDATED}}, "r/4"),
+    ("issue_comment", {"comment": {"id": 5, "updated_at": UPDATED}}, 5),
+    ("check_run", {"check_run": {"id": 6, "completed_at": None,
+                                 "started_at": UPDATED}}, 6),
+    ("check_suite", {"check_suite": {"id": 7, "updated_at": UPDATED}}, 7),
+    ("deployment", {"deployment": {"id": 8, "created_at": UPDATED}}, 8),
+    ("deployment_status",
+     {"deployment_status": {"id": 9, "updated_at": UPDATED}}, 9),
+    ("status", {"id": 10, "updated_at": UPDATED}, 10),
+    ("release", {"release": {"id": 11, "published_at": None,
+                             "created_at": UPDATED}}, 11),
+    ("workflow_run", {"workflow_run": {"id": 12, "updated_at": UPDATED}}, 12),
+    ("workflow_job", {"workflow_job": {"id": 13, "completed_at": UPDATED,
+                                       "started_at": "2021-06-15T13:00:00Z"}},
+     13),
+])
+def test_github_event_extractors(event_type, payload, e_id):
+    msg = {
+        "data": base64.b64encode(json.dumps(payload).encode()).decode(),
+        "attributes": {},
+        "message_id": "foobar",
+    }
+    headers = {"X-Github-Event": event_type, "X-Hub-Signature": "foo"}
+
+    event = main.process_github_event(headers, msg)
+
+    assert event["id"] == e_id
+    assert event["time_created"] == UPDATED_UTC
+
+
+def test_every_supported_event_type_has_an_extractor():
+    assert set(main.EXTRACTORS) == shared.SUPPORTED_EVENT_TYPES["github"]
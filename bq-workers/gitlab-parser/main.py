@@ -12,8 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import base64
-from datetime import datetime
 import os
 import json
 
@@ -44,16 +42,16 @@ def index():
     if "attributes" not in msg:
         raise Exception("Missing pubsub attributes")
 
-    try:
-        attr = msg["attributes"]
+    shared.record_request()
 
+    try:
         # Header Event info
-        if "headers" in attr:
-            headers = json.loads(attr["headers"])
-
+        headers = shared.message_headers(msg)
+        if headers:
             # Process Gitlab Events
             if "X-Gitlab-Event" in headers:
-                event = process_gitlab_event(headers, msg)
+                with shared.timed("process", "gitlab"):
+                    event = process_gitlab_event(headers, msg)
 
         shared.insert_row_into_bigquery(event)
 
@@ -65,10 +63,19 @@ def index():
                 "json_payload": envelope
             }
         print(json.dumps(entry))
+        return shared.handle_error(e, envelope, "gitlab", event)
 
     return "", 204
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Serves this worker's metrics in the Prometheus text format.
+    """
+    return shared.metrics_response()
+
+
 def process_gitlab_event(headers, msg):
     # Unique hash for the event
     signature = shared.create_unique_id(msg)
@@ -77,12 +84,9 @@ def process_gitlab_event(headers, msg):
     if "Mock" in headers:
         source += "mock"
 
-    types = {"push", "merge_request",
-             "note", "tag_push", "issue",
-             "pipeline", "job", "deployment",
-             "build"}
+    types = shared.SUPPORTED_EVENT_TYPES["gitlab"]
 
-    metadata = json.loads(base64.b64decode(msg["data"]).decode("utf-8").strip())
+    metadata = shared.message_document(msg, "gitlab")
 
     event_type = metadata["object_kind"]
 
@@ -120,24 +124,16 @@ def process_gitlab_event(headers, msg):
             metadata.get("build_started_at") or
             metadata.get("build_created_at"))
 
-    # Some timestamps come in a format like "2021-04-28 21:50:00 +0200"
-    # BigQuery does not accept this as a valid format
-    # Removing the extra timezone information below
-    try:
-        dt = datetime.strptime(time_created, '%Y-%m-%d %H:%M:%S %z')
-        time_created = dt.strftime('%Y-%m-%d %H:%M:%S')
-
-    # If the timestamp is not parsed correctly,
-    # we will default to the string from the event payload
-    except Exception:
-        pass
+    # GitLab sends some timestamps as "2021-04-28 21:50:00 +0200"
+    time_created = shared.normalize_timestamp(time_created, "gitlab")
 
     gitlab_event = {
         "event_type": event_type,
         "id": e_id,
-        "metadata": json.dumps(metadata),
+        "metadata": metadata.dumps(),
         # If time_created not supplied by event, default to pub/sub publishTime
-        "time_created": time_created or msg["publishTime"],
+        "time_created": time_created or shared.normalize_timestamp(
+            msg["publishTime"], "pubsub"),
         "signature": signature,
         "msg_id": msg["message_id"],
         "source": source,
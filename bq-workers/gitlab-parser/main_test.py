@@ -77,7 +77,7 @@ def test_gitlab_event_processed(client):
         "event_type": "push",
         "id": "foo",
         "metadata": data.decode(),
-        "time_created": 2,
+        "time_created": "1970-01-01T00:00:02.000000Z",
         "signature": shared.create_unique_id(pubsub_msg["message"]),
         "msg_id": "foobar",
         "source": "gitlab",
@@ -116,7 +116,7 @@ def test_timestamp_timezone_event_processed(client):
         "event_type": "deployment",
         "id": 15,
         "metadata": data.decode(),
-        "time_created": "2021-04-28 21:50:00",
+        "time_created": "2021-04-28T19:50:00.000000Z",
         "signature": shared.create_unique_id(pubsub_msg["message"]),
         "msg_id": "foobar",
         "source": "gitlab",
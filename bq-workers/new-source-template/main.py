@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import base64
 import os
 import json
 
@@ -43,9 +42,12 @@ def index():
     if "attributes" not in msg:
         raise Exception("Missing pubsub attributes")
 
+    shared.record_request()
+
     try:
         # [TODO: Replace mock function below]
-        event = process_new_source_event(msg)
+        with shared.timed("process", "source"):
+            event = process_new_source_event(msg)
 
         # [Do not edit below]
         shared.insert_row_into_bigquery(event)
@@ -58,20 +60,29 @@ def index():
                 "json_payload": envelope
             }
         print(json.dumps(entry))
+        return shared.handle_error(e, envelope, "source", event)
 
     return "", 204
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Serves this worker's metrics in the Prometheus text format.
+    """
+    return shared.metrics_response()
+
+
 # [TODO: Replace mock function below]
 def process_new_source_event(msg):
-    metadata = json.loads(base64.b64decode(msg["data"]).decode("utf-8").strip())
+    metadata = shared.message_document(msg, "source")
 
     # [TODO: Parse the msg data to map to the event object below]
     new_source_event = {
         "event_type": "event_type",  # Event type, eg "push", "pull_reqest", etc
         "id": "e_id",  # Object ID, eg pull request ID
-        "metadata": json.dumps(metadata),  # The body of the msg
-        "time_created": 0,  # The timestamp of with the event
+        "metadata": metadata.dumps(),  # The body of the msg
+        "time_created": shared.normalize_timestamp(0, "source"),  # The timestamp of with the event
         "signature": "signature",  # The unique event signature
         "msg_id": msg["message_id"],  # The pubsub message id
         "source": "source",  # The name of the source, eg "github"
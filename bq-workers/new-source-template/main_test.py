@@ -71,7 +71,7 @@ def test_new_source_event_processed(client):
         "event_type": "event_type",
         "id": "e_id",
         "metadata": '{"foo": "bar"}',
-        "time_created": 0,
+        "time_created": "1970-01-01T00:00:00.000000Z",
         "signature": "signature",
         "msg_id": "foobar",
         "source": "source",
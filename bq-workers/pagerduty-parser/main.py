@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import base64
 import os
 import json
 
@@ -43,8 +42,11 @@ def index():
     if "attributes" not in msg:
         raise Exception("Missing pubsub attributes")
 
+    shared.record_request()
+
     try:
-        event = process_pagerduty_event(msg)
+        with shared.timed("process", "pagerduty"):
+            event = process_pagerduty_event(msg)
         print(f" Event which is to be inserted into Big query {event}")
         if event:
             # [Do not edit below]
@@ -58,29 +60,38 @@ def index():
                 "json_payload": envelope
             }
         print(f"EXCEPTION raised  {json.dumps(entry)}")
+        return shared.handle_error(e, envelope, "pagerduty", event)
     return "", 204
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Serves this worker's metrics in the Prometheus text format.
+    """
+    return shared.metrics_response()
+
+
 def process_pagerduty_event(msg):
-    metadata = json.loads(base64.b64decode(msg["data"]).decode("utf-8").strip())
+    metadata = shared.message_document(msg, "pagerduty")
 
     print(f"Metadata after decoding {metadata}")
 
     # Unique hash for the event
     signature = shared.create_unique_id(msg)
-    event = metadata['event']
-    event_type = event["event_type"]
-    types = {"incident.triggered", "incident.resolved"}
+    event_type = metadata["event", "event_type"]
+    types = shared.SUPPORTED_EVENT_TYPES["pagerduty"]
     if event_type not in types:
         raise Warning("Unsupported PagerDuty event: '%s'" % event_type)
 
     pagerduty_event = {
         "event_type": event_type,  # Event type, eg "incident.trigger", "incident.resolved", etc
-        "id": event['id'],  # Event ID,
-        "metadata": json.dumps(metadata),  # The body of the msg
+        "id": metadata["event", "id"],  # Event ID,
+        "metadata": metadata.dumps(),  # The body of the msg
         "signature": signature,  # The unique event signature
         "msg_id": msg["message_id"],  # The pubsub message id
-        "time_created" : event['occurred_at'],  # The timestamp of with the event resolved
+        "time_created": shared.normalize_timestamp(
+            metadata["event", "occurred_at"], "pagerduty"),  # The timestamp of with the event resolved
         "source": "pagerduty",  # The name of the source, eg "pagerduty"
         }
 
@@ -71,7 +71,7 @@ def test_pagerduty_event_processed(client):
         "event_type": "incident.triggered",
         "id": "foo",
         "metadata": '{"foo": "bar", "event": {"id": "foo", "occurred_at": 0, "event_type": "incident.triggered"}}',
-        "time_created": 0,
+        "time_created": "1970-01-01T00:00:00.000000Z",
         "signature": "570ece386f1c03b9c91133b186c2c4a57857e255",
         "msg_id": "foobar",
         "source": "pagerduty",
@@ -0,0 +1,94 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+
+import shared
+from shared import plugins
+
+from flask import Flask, request
+
+# Directory holding the individual parsers; bq-workers/ in this repo
+PARSERS_DIR = os.environ.get(
+    "PARSERS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir),
+)
+
+app = Flask(__name__)
+
+# Every parser under bq-workers/, imported on its first message
+registry = plugins.default_registry(PARSERS_DIR)
+
+
+@app.route("/", methods=["POST"])
+def index():
+    """
+    Receives messages from the push subscriptions of every source.
+    Routes each message to its parser, and inserts it into BigQuery.
+    """
+    event = None
+    source = None
+    # Check request for JSON
+    if not request.is_json:
+        raise Exception("Expecting JSON payload")
+    envelope = request.get_json()
+
+    # Check that message is a valid pub/sub message
+    if "message" not in envelope:
+        raise Exception("Not a valid Pub/Sub Message")
+    msg = envelope["message"]
+
+    if "attributes" not in msg:
+        raise Exception("Missing pubsub attributes")
+
+    shared.record_request()
+
+    try:
+        source = registry.route(envelope)
+        if source is None:
+            raise shared.PermanentError("No parser for this message")
+
+        with shared.timed("process", source):
+            event = registry.process(source, msg)
+
+        shared.insert_row_into_bigquery(event)
+
+    except Exception as e:
+        entry = {
+                "severity": "WARNING",
+                "msg": "Data not saved to BigQuery",
+                "errors": str(e),
+                "json_payload": envelope
+            }
+        print(json.dumps(entry))
+        return shared.handle_error(e, envelope, source or "unknown", event)
+
+    return "", 204
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Serves this worker's metrics in the Prometheus text format.
+    """
+    return shared.metrics_response()
+
+
+if __name__ == "__main__":
+    PORT = int(os.getenv("PORT")) if os.getenv("PORT") else 8080
+
+    # This is used when running locally. Gunicorn is used to run the
+    # application on Cloud Run. See entrypoint in Dockerfile.
+    app.run(host="127.0.0.1", port=PORT, debug=True)
@@ -0,0 +1,108 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import json
+
+import main
+
+import mock
+import pytest
+
+
+@pytest.fixture
+def client():
+    main.app.testing = True
+    return main.app.test_client()
+
+
+def post(client, pubsub_msg):
+    return client.post(
+        "/",
+        data=json.dumps(pubsub_msg),
+        headers={"Content-Type": "application/json"},
+    )
+
+
+def test_not_pubsub_message(client):
+    with pytest.raises(Exception) as e:
+        post(client, {"foo": "bar"})
+
+    assert "Not a valid Pub/Sub Message" in str(e.value)
+
+
+@mock.patch("shared.insert_row_into_bigquery")
+def test_routed_by_subscription(insert, client):
+    headers = {"X-Github-Event": "push", "X-Hub-Signature": "foo"}
+    commit = json.dumps({"head_commit": {"timestamp": 0, "id": "bar"}})
+    pubsub_msg = {
+        "message": {
+            "data": base64.b64encode(commit.encode("utf-8")).decode("utf-8"),
+            "attributes": {"headers": json.dumps(headers)},
+            "message_id": "foobar",
+        },
+        "subscription": "projects/foo/subscriptions/github",
+    }
+
+    r = post(client, pubsub_msg)
+
+    assert r.status_code == 204
+    event = insert.call_args[0][0]
+    assert event["source"] == "github"
+    assert event["id"] == "bar"
+    assert "github-parser" in main.registry.loaded()
+    assert "gitlab-parser" not in main.registry.loaded()
+
+
+@mock.patch("shared.insert_row_into_bigquery")
+def test_routed_by_attribute(insert, client):
+    build = json.dumps({"createTime": 0})
+    pubsub_msg = {
+        "message": {
+            "data": base64.b64encode(build.encode("utf-8")).decode("utf-8"),
+            "attributes": {"buildId": "foo"},
+            "message_id": "foobar",
+        },
+    }
+
+    r = post(client, pubsub_msg)
+
+    assert r.status_code == 204
+    event = insert.call_args[0][0]
+    assert event["source"] == "cloud_build"
+    assert event["id"] == "foo"
+
+
+def test_routed_by_header():
+    headers = {"Circleci-Event-Type": "workflow-completed",
+               "Circleci-Signature": "foo"}
+    assert main.registry.route_message(
+        {"attributes": {"headers": json.dumps(headers)}}
+    ) == "circleci"
+
+
+@mock.patch("shared.handle_error", mock.MagicMock(return_value=("", 204)))
+@mock.patch("shared.insert_row_into_bigquery")
+def test_unroutable_message_dead_lettered(insert, client):
+    pubsub_msg = {
+        "message": {"data": "", "attributes": {}, "message_id": "foobar"},
+        "subscription": "projects/foo/subscriptions/unknown",
+    }
+
+    r = post(client, pubsub_msg)
+
+    assert r.status_code == 204
+    insert.assert_not_called()
+    error = main.shared.handle_error.call_args[0][0]
+    assert isinstance(error, main.shared.PermanentError)
@@ -0,0 +1,66 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Streaming-pull entry point, an alternative to push subscriptions:
+
+    python pull.py projects/<project>/subscriptions/github ...
+
+Each subscription is routed to its parser by name and written to
+BigQuery in batches. Set PUBSUB_EMULATOR_HOST to run against the Pub/Sub
+emulator.
+"""
+
+import sys
+import threading
+
+from shared.consumer import BatchConsumer
+
+from main import registry
+
+
+def consumer_for(subscription, **kwargs):
+    """
+    Returns a BatchConsumer running the parser the subscription is
+    named after
+    """
+    source = registry.route({"subscription": subscription})
+    if source is None:
+        raise ValueError("No parser for subscription: %s" % subscription)
+    return BatchConsumer(
+        subscription,
+        lambda msg: registry.process(source, msg),
+        source,
+        **kwargs
+    )
+
+
+def main(subscriptions):
+    consumers = [consumer_for(subscription) for subscription in subscriptions]
+    threads = [
+        threading.Thread(target=consumer.run, name=consumer.source)
+        for consumer in consumers
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        for consumer in consumers:
+            consumer.stop()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import base64
 import os
 import json
 
@@ -44,13 +43,13 @@ def index():
     if "attributes" not in msg:
         raise Exception("Missing pubsub attributes")
 
-    try:
-        attr = msg["attributes"]
-
-        if "headers" in attr:
-            headers = json.loads(attr["headers"])
+    shared.record_request()
 
-            event = process_tekton_event(headers, msg)
+    try:
+        headers = shared.message_headers(msg)
+        if headers:
+            with shared.timed("process", "tekton"):
+                event = process_tekton_event(headers, msg)
             shared.insert_row_into_bigquery(event)
 
     except Exception as e:
@@ -61,12 +60,21 @@ def index():
                 "json_payload": envelope
             }
         print(json.dumps(entry))
+        return shared.handle_error(e, envelope, "tekton", event)
 
     return "", 204
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Serves this worker's metrics in the Prometheus text format.
+    """
+    return shared.metrics_response()
+
+
 def process_tekton_event(headers, msg):
-    data = base64.b64decode(msg["data"]).decode("utf-8").strip()
+    data = shared.message_data(msg, "tekton", parse_json=False)
     cloud_event = from_http(headers, data)
 
     if "pipelineRun" in cloud_event.data:
@@ -79,7 +87,7 @@ def process_tekton_event(headers, msg):
         "event_type": cloud_event["type"],
         "id": uid,  # ID of the taskRun or pipelineRun
         "metadata": to_json(cloud_event).decode(),
-        "time_created": cloud_event["time"],
+        "time_created": shared.normalize_timestamp(cloud_event["time"], "tekton"),
         "signature": cloud_event["id"],  # Unique ID for the event
         "msg_id": msg["message_id"],  # The pubsub message id
         "source": "tekton",
@@ -84,7 +84,7 @@ def test_tekton_source_event_processed(client):
         "event_type": "tekton.foo",
         "id": "foo",
         "metadata": body.decode(),
-        "time_created": 0,
+        "time_created": "1970-01-01T00:00:00.000000Z",
         "signature": "bar",
         "msg_id": "foobar",
         "source": "tekton",
@@ -1,13 +1,20 @@
 import json
-from typing import List
+import os
+from typing import Iterable, List, Set
 
 from google.cloud import bigquery
+from shared.bulk import BulkLoader
 
+import config
 from models import EventsRaw
 
 
 client = bigquery.Client()
 
+BIGQUERY_PROJECT = "devopsmetrics-369710"
+DATASET_REF = f"{BIGQUERY_PROJECT}.four_keys"
+EVENTS_RAW_TABLE_REF = f"{DATASET_REF}.events_raw"
+
 def event_exists(client, deployment_id: str, table_ref: str) -> bool:
     sql = f"""
         SELECT signature 
@@ -24,11 +31,7 @@ def event_exists(client, deployment_id: str, table_ref: str) -> bool:
 def insert_into_bigquery(events: EventsRaw or List[EventsRaw]):
     if not events:
         return
-    # Set up bigquery instance
-    project_id = "devopsmetrics-369710"
-    dataset_id = "four_keys"
-    table_id = "events_raw"
-    table_ref = f"{project_id}.{dataset_id}.{table_id}"
+    table_ref = EVENTS_RAW_TABLE_REF
     table = client.get_table(table_ref)
 
     rows = []
@@ -54,3 +57,52 @@ def insert_into_bigquery(events: EventsRaw or List[EventsRaw]):
         print(json.dumps(entry))
 
     print(f"Inserted {count} rows into {table_ref}")
+
+
+def _load_file(table_id: str, path: str):
+    table = client.get_table(f"{DATASET_REF}.{table_id}")
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        schema=table.schema,
+    )
+    with open(path, "rb") as f:
+        load_job = client.load_table_from_file(f, table, job_config=job_config)
+    # Raises if the load job failed
+    load_job.result()
+
+
+def _existing(table_id: str, column: str, values: List[str]) -> Set[str]:
+    if not values:
+        return set()
+    sql = f"""
+        SELECT DISTINCT {column}
+        FROM {DATASET_REF}.{table_id}
+        WHERE {column} IN UNNEST(@values)
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("values", "STRING", values)]
+    )
+    query_job = client.query(sql, job_config=job_config)
+    return {row[0] for row in query_job.result()}
+
+
+def load_into_bigquery(events: Iterable[EventsRaw], run_id: str,
+                       chunk_size: int = config.LOAD_CHUNK_SIZE):
+    """
+    Writes events with batch load jobs instead of streaming inserts.
+    Events are read one at a time, so any iterable works. Chunks that an
+    interrupted run with the same run_id loaded are skipped, and events
+    whose signature is already in events_raw are dropped.
+    """
+    loader = BulkLoader(
+        run_id=os.path.join(BIGQUERY_PROJECT, run_id), chunk_rows=chunk_size,
+        load=_load_file, existing=_existing,
+    )
+    # Serialize through the model so datetimes use the BigQuery format
+    summary = loader.load(json.loads(event.json()) for event in events)
+    print(
+        f"Loaded {summary['rows']} rows into {EVENTS_RAW_TABLE_REF} in "
+        f"{summary['chunks']} load jobs ({summary['skipped']} already loaded, "
+        f"{summary['duplicates']} duplicate rows dropped)"
+    )
@@ -7,3 +7,5 @@ ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 
 LOG_LEVEL = os.getenv("UPP_LOG_LEVEL", "INFO")
 BATCH_SIZE = 50
+# Rows per load job when importing with --bulk
+LOAD_CHUNK_SIZE = int(os.getenv("UPP_LOAD_CHUNK_SIZE", 50000))
@@ -1,5 +1,5 @@
 import json
-from typing import Dict, List
+from typing import Dict, Iterator, List
 
 import gitlab
 from gitlab.v4.objects import Project as GitlabProject, ProjectDeployment, ProjectEvent
@@ -8,10 +8,11 @@ import os
 import csv
 import click
 
-from bigquery_helpers import event_exists, insert_into_bigquery
+from bigquery_helpers import event_exists, insert_into_bigquery, load_into_bigquery
 from transformations import transform_deployment, transform_event
 from pydantic import ValidationError
 from log import root_logger
+from models import EventsRaw
 
 logger = root_logger.getChild('bulk-migrate-lulu')
 
@@ -56,62 +57,67 @@ def get_project_ids() -> List[Dict]:
 @click.command()
 @click.option("--project-id", help="GitLab project ID", type=int, required=False)
 @click.option("--all", help="Import all projects", is_flag=True, required=False)
-def main(project_id: int, all: bool):
+@click.option("--bulk", help="Write with batch load jobs instead of streaming inserts", is_flag=True, required=False)
+def main(project_id: int, all: bool, bulk: bool):
     if project_id:
-        import_project(project_id)
+        import_project(project_id, bulk)
     if all:
-        import_all_projects()
+        import_all_projects(bulk)
 
 
-def import_all_projects():
+def import_all_projects(bulk: bool = False):
     project_ids = [r["project_id"] for r in get_project_ids()]
     for project_id in project_ids:
         if project_id == 1657:
             continue
-        import_project(project_id)
+        import_project(project_id, bulk)
 
 
-def import_project(project_id):
-    gl = gitlab.Gitlab.from_config("lulu")
-    p: GitlabProject = gl.projects.get(project_id)
-    logger.info(f"Processing project {p.id} ({p.path_with_namespace})")
+def project_events(p: GitlabProject) -> Iterator[EventsRaw]:
+    """
+    Yields the project's push events and production deployments one at a time
+    """
     # processing events
     events = filter_events(p)
     logger.info(f"Found {len(events)} events")
-    i = 0
-    batch = []
-    for e in events:
+    for i, e in enumerate(events):
         if i % 10 == 0:
             logger.info(f"Processed {i} events")
-        if i % config.BATCH_SIZE == 0:
-            insert_into_bigquery(batch)
-            batch = []
-        raw_event = transform_event(p, e)
-        batch.append(raw_event)
-        i += 1
-
-    if batch:
-        insert_into_bigquery(batch)
+        yield transform_event(p, e)
 
     # processing deployments
     deployments = filter_deployments(p)
     logger.info(f"Found {len(deployments)} deployments")
-    i = 0
     d: ProjectDeployment
-    for d in deployments:
+    for i, d in enumerate(deployments):
         if i % 10 == 0:
             logger.info(f"Processed {i} deployments")
         if d.attributes["environment"]["name"] != "upp-prod":
             continue
         try:
-            event = transform_deployment(d)
+            yield transform_deployment(d)
         except ValidationError as e:
             logger.exception(e)
             print(f"failed to process deployment {d.get_id()}")
-            i += 1
-            continue
-        insert_into_bigquery(event)
-        i += 1
+
+
+def import_project(project_id, bulk: bool = False):
+    gl = gitlab.Gitlab.from_config("lulu")
+    p: GitlabProject = gl.projects.get(project_id)
+    logger.info(f"Processing project {p.id} ({p.path_with_namespace})")
+    events = project_events(p)
+    if bulk:
+        # Rows are streamed into the loader, never held for a whole project
+        load_into_bigquery(events, run_id=f"gitlab-project-{p.id}")
+        return
+
+    batch = []
+    for event in events:
+        batch.append(event)
+        if len(batch) == config.BATCH_SIZE:
+            insert_into_bigquery(batch)
+            batch = []
+    insert_into_bigquery(batch)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,156 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+import json
+import math
+import os
+import threading
+import time
+
+# Events per second admitted per source and per repository; 0 means
+# unlimited. GitHub does not retry a 429 on its own, so limits are opt-in.
+ADMISSION_SOURCE_RATE = float(os.environ.get("ADMISSION_SOURCE_RATE", 0))
+ADMISSION_SOURCE_BURST = float(os.environ.get("ADMISSION_SOURCE_BURST", 100))
+ADMISSION_REPO_RATE = float(os.environ.get("ADMISSION_REPO_RATE", 0))
+ADMISSION_REPO_BURST = float(os.environ.get("ADMISSION_REPO_BURST", 20))
+# Per-source overrides, e.g. {"github": {"rate": 50, "repo_rate": 5}}
+ADMISSION_LIMITS = json.loads(os.environ.get("ADMISSION_LIMITS", "{}"))
+# Repositories tracked at once; the least recently seen bucket is dropped
+ADMISSION_MAX_REPOS = int(os.environ.get("ADMISSION_MAX_REPOS", 10000))
+
+
+class TokenBucket(object):
+    """
+    Admits `rate` events per second on average and up to `burst` at once
+    """
+
+    def __init__(self, rate, burst, clock):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._clock = clock
+        self._tokens = self.burst
+        self._last = clock()
+
+    def try_acquire(self):
+        """
+        Takes a token; returns 0 on success, otherwise the seconds until
+        the next token is available. Caller holds the controller lock.
+        """
+        now = self._clock()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def refund(self):
+        self._tokens = min(self.burst, self._tokens + 1)
+
+
+class AdmissionController(object):
+    """
+    Per-source and per-repository token buckets for incoming webhooks.
+
+    An event has to get a token from its source bucket and, if it names a
+    repository, from that repository's bucket. Priority events, e.g.
+    deployments and incidents, are always admitted and do not use tokens,
+    so they are never queued behind noisier event types.
+    """
+
+    def __init__(self, source_rate=ADMISSION_SOURCE_RATE,
+                 source_burst=ADMISSION_SOURCE_BURST,
+                 repo_rate=ADMISSION_REPO_RATE, repo_burst=ADMISSION_REPO_BURST,
+                 overrides=None, max_repos=ADMISSION_MAX_REPOS, clock=None):
+        self.defaults = {
+            "rate": source_rate,
+            "burst": source_burst,
+            "repo_rate": repo_rate,
+            "repo_burst": repo_burst,
+        }
+        self.overrides = ADMISSION_LIMITS if overrides is None else overrides
+        self.max_repos = max_repos
+        self._clock = clock or time.monotonic
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._sources = {}
+        self._repos = OrderedDict()
+        self._stats = {"admitted": 0, "throttled": 0, "priority": 0}
+
+    def limits(self, source):
+        limits = dict(self.defaults)
+        limits.update(self.overrides.get(source, {}))
+        return limits
+
+    def enabled(self, source):
+        limits = self.limits(source)
+        return bool(limits["rate"] or limits["repo_rate"])
+
+    def _repo_bucket(self, source, repository, limits):
+        # Caller holds self._lock
+        key = (source, repository)
+        bucket = self._repos.get(key)
+        if bucket is None:
+            bucket = self._repos[key] = TokenBucket(
+                limits["repo_rate"], limits["repo_burst"], self._clock
+            )
+            while len(self._repos) > self.max_repos:
+                self._repos.popitem(last=False)
+        else:
+            self._repos.move_to_end(key)
+        return bucket
+
+    def admit(self, source, repository=None, priority=False):
+        """
+        Returns 0 if the event is admitted, otherwise the number of whole
+        seconds the sender should wait before retrying
+        """
+        limits = self.limits(source)
+        with self._lock:
+            if priority:
+                self._stats["priority"] += 1
+                return 0
+
+            wait = 0
+            if limits["rate"]:
+                bucket = self._sources.get(source)
+                if bucket is None:
+                    bucket = self._sources[source] = TokenBucket(
+                        limits["rate"], limits["burst"], self._clock
+                    )
+                wait = bucket.try_acquire()
+
+            if not wait and repository and limits["repo_rate"]:
+                wait = self._repo_bucket(
+                    source, repository, limits
+                ).try_acquire()
+                if wait and limits["rate"]:
+                    # Hand back the source token this event did not use
+                    bucket.refund()
+
+            if wait:
+                self._stats["throttled"] += 1
+                return max(1, int(math.ceil(wait)))
+            self._stats["admitted"] += 1
+            return 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["repositories"] = len(self._repos)
+        return stats
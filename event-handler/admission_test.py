@@ -0,0 +1,66 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import admission
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_source_bucket_allows_burst_then_throttles():
+    clock = Clock()
+    controller = admission.AdmissionController(
+        source_rate=1, source_burst=2, overrides={}, clock=clock
+    )
+
+    assert controller.admit("github") == 0
+    assert controller.admit("github") == 0
+    assert controller.admit("github") == 1
+
+    clock.now = 1
+    assert controller.admit("github") == 0
+
+
+def test_priority_events_are_never_throttled():
+    controller = admission.AdmissionController(
+        source_rate=1, source_burst=1, overrides={}, clock=Clock()
+    )
+    controller.admit("github")
+
+    assert controller.admit("github") > 0
+    assert controller.admit("github", priority=True) == 0
+
+
+def test_repository_buckets_are_separate():
+    controller = admission.AdmissionController(
+        repo_rate=0.5, repo_burst=1, overrides={}, clock=Clock()
+    )
+
+    assert controller.admit("github", "org/noisy") == 0
+    assert controller.admit("github", "org/noisy") == 2
+    assert controller.admit("github", "org/quiet") == 0
+
+
+def test_overrides_per_source():
+    controller = admission.AdmissionController(
+        overrides={"gitlab": {"rate": 1, "burst": 1}}, clock=Clock()
+    )
+
+    assert not controller.enabled("github")
+    assert controller.enabled("gitlab")
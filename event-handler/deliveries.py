@@ -0,0 +1,83 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+import os
+import threading
+import time
+
+# Seconds a delivery ID is remembered; 0 disables edge deduplication
+DELIVERY_WINDOW = float(os.environ.get("DELIVERY_WINDOW", 3600))
+DELIVERY_MAX_ENTRIES = int(os.environ.get("DELIVERY_MAX_ENTRIES", 100000))
+
+
+class DeliveryCache(object):
+    """
+    Bounded, time-windowed set of recently published delivery IDs.
+
+    IDs are kept for `window` seconds and at most `max_entries` of them,
+    evicting the oldest first. The cache only saves downstream work: the
+    parsers still deduplicate on the event signature, so an evicted ID
+    simply lets a redelivery through.
+    """
+
+    def __init__(self, window=DELIVERY_WINDOW, max_entries=DELIVERY_MAX_ENTRIES,
+                 clock=None):
+        self.window = window
+        self.max_entries = max_entries
+        self._clock = clock or time.monotonic
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+        self._stats = {"checks": 0, "duplicates": 0, "evicted": 0}
+
+    def _expire(self, now):
+        # Caller holds self._lock; entries are in insertion order
+        while self._seen:
+            key, added = next(iter(self._seen.items()))
+            if now - added < self.window and len(self._seen) <= self.max_entries:
+                break
+            self._seen.popitem(last=False)
+            self._stats["evicted"] += 1
+
+    def seen(self, key):
+        """
+        Returns True if the delivery was published within the window
+        """
+        now = self._clock()
+        with self._lock:
+            self._stats["checks"] += 1
+            self._expire(now)
+            if key in self._seen:
+                self._stats["duplicates"] += 1
+                return True
+            return False
+
+    def add(self, key):
+        """
+        Records a delivery that has just been published
+        """
+        now = self._clock()
+        with self._lock:
+            self._seen.pop(key, None)
+            self._seen[key] = now
+            self._expire(now)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._seen)
+        return stats
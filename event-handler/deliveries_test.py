@@ -0,0 +1,58 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import deliveries
+import sources
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_delivery_is_remembered_within_window():
+    clock = Clock()
+    cache = deliveries.DeliveryCache(window=60, max_entries=10, clock=clock)
+    assert not cache.seen("github:1")
+    cache.add("github:1")
+
+    assert cache.seen("github:1")
+    clock.now = 61
+    assert not cache.seen("github:1")
+
+
+def test_oldest_delivery_is_evicted_at_capacity():
+    cache = deliveries.DeliveryCache(window=60, max_entries=2, clock=Clock())
+    for key in ("a", "b", "c"):
+        cache.add(key)
+
+    assert not cache.seen("a")
+    assert cache.seen("c")
+    assert cache.stats()["entries"] == 2
+
+
+def test_delivery_ids_per_source():
+    github = sources.AUTHORIZED_SOURCES["github"]
+    pagerduty = sources.AUTHORIZED_SOURCES["pagerduty"]
+
+    assert github.delivery_id(
+        {"X-GitHub-Delivery": "abc"}, sources.Payload(b"")
+    ) == "abc"
+    assert pagerduty.delivery_id(
+        {}, sources.Payload(b'{"event": {"id": "01ABC"}}')
+    ) == "01ABC"
+    assert pagerduty.delivery_id({}, sources.Payload(b"not json")) is None
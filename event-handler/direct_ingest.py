@@ -0,0 +1,113 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import json
+import os
+import threading
+import uuid
+
+import shared
+from shared import plugins
+from shared.errors import RETRY_STATUS
+
+# "pubsub" publishes every webhook for the bq-workers parsers. "direct"
+# runs the source's parser in this process and writes the row through the
+# shared batch writer, for small deployments where the extra hop and the
+# parser's cold start cost more than they buy.
+INGEST_MODE = os.environ.get("INGEST_MODE", "pubsub")
+# Directory holding the bq-workers parsers, e.g. copied into the image
+PARSERS_DIR = os.environ.get(
+    "PARSERS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 os.pardir, "bq-workers"),
+)
+# Seconds a request waits for its row to be written
+DIRECT_INGEST_TIMEOUT = float(os.environ.get("DIRECT_INGEST_TIMEOUT", 30))
+
+
+class DirectIngest(object):
+    """
+    Runs the bq-workers parsers in-process instead of going through
+    Pub/Sub.
+
+    A parser module is imported the first time its source sends an event.
+    Events reach it as the same message it would get from a push
+    subscription, and its row is handed to shared.events_raw_writer, so
+    rows from concurrent requests are inserted together. Failures go
+    through shared.handle_error: a transient one asks the sender to retry,
+    anything else is dead-lettered or ignored as in the parser service.
+    """
+
+    def __init__(self, mode=INGEST_MODE, parsers_dir=PARSERS_DIR,
+                 timeout=DIRECT_INGEST_TIMEOUT, registry=None):
+        self.enabled = mode == "direct"
+        self.timeout = timeout
+        self.registry = registry or plugins.default_registry(parsers_dir)
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._stats = {"ingested": 0, "spooled": 0, "duplicates": 0,
+                       "retried": 0, "failed": 0}
+
+    def handles(self, source):
+        return self.enabled and source in self.registry
+
+    def ingest(self, source, body, headers):
+        """
+        Parses and writes one webhook; returns False if the sender
+        should retry it
+        """
+        msg = {
+            "data": base64.b64encode(body).decode("utf-8"),
+            "attributes": {"headers": json.dumps(headers)},
+            "message_id": uuid.uuid4().hex,
+        }
+        event = None
+        shared.record_request()
+        try:
+            with shared.timed("process", source):
+                event = self.registry.process(source, msg, headers)
+            future = shared.insert_row_into_bigquery(event, batch=True)
+            if future is None:
+                stat = "duplicates"
+            elif future == shared.SPOOLED:
+                # On disk; the spool uploads it in the background
+                stat = "spooled"
+            elif future.result(timeout=self.timeout):
+                # The writer has logged the row errors
+                raise shared.TransientError("Row not inserted")
+            else:
+                stat = "ingested"
+        except Exception as e:
+            entry = {
+                "severity": "WARNING",
+                "msg": "Data not saved to BigQuery",
+                "errors": str(e),
+                "source": source,
+            }
+            print(json.dumps(entry))
+            response = shared.handle_error(e, {"message": msg}, source, event)
+            stat = "retried" if response[1] == RETRY_STATUS else "failed"
+
+        with self._lock:
+            self._stats[stat] += 1
+        return stat != "retried"
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["parsers_loaded"] = len(self.registry.loaded())
+        return stats
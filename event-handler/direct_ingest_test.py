@@ -0,0 +1,131 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import Future
+import glob
+import json
+import os
+
+import shared
+from shared import plugins
+
+import direct_ingest
+from direct_ingest import DirectIngest
+
+import mock
+
+HEADERS = {"X-Github-Event": "push", "X-Hub-Signature": "foo"}
+BODY = json.dumps({"head_commit": {"timestamp": 0, "id": "bar"}}).encode()
+
+
+def written(errors):
+    future = Future()
+    future.set_result(errors)
+    return future
+
+
+HANDLER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def requirements(path):
+    with open(path) as f:
+        lines = (line.strip() for line in f)
+        return {line for line in lines if line and not line.startswith(".")}
+
+
+def test_image_holds_every_parser():
+    with open(os.path.join(HANDLER_DIR, "Dockerfile")) as f:
+        dockerfile = f.read()
+    # The image copies bq-workers/ to PARSERS_DIR and installs what every
+    # parser needs, so the direct mode finds the same layout as this tree
+    assert "ENV PARSERS_DIR $APP_HOME/bq-workers" in dockerfile
+    assert "COPY bq-workers $PARSERS_DIR" in dockerfile
+    assert "cd $PARSERS_DIR/parser-service && pip install" in dockerfile
+    workers_dir = os.path.join(HANDLER_DIR, os.pardir, "bq-workers")
+    installed = requirements(os.path.join(HANDLER_DIR, "requirements.txt"))
+    installed |= requirements(
+        os.path.join(workers_dir, "parser-service", "requirements.txt")
+    )
+    for path in glob.glob(os.path.join(workers_dir, "*", "requirements.txt")):
+        assert requirements(path) <= installed, path
+
+    registry = plugins.default_registry(direct_ingest.PARSERS_DIR)
+    for name in registry.names():
+        assert callable(registry.function(name)), name
+
+
+def test_pubsub_mode_handles_nothing():
+    assert not DirectIngest(mode="pubsub").handles("github")
+    assert DirectIngest(mode="direct").handles("github")
+    assert not DirectIngest(mode="direct").handles("cloud-build")
+
+
+@mock.patch("shared.insert_row_into_bigquery")
+def test_event_parsed_in_process(insert):
+    insert.return_value = written([])
+    direct = DirectIngest(mode="direct")
+
+    assert direct.ingest("github", BODY, HEADERS)
+
+    event = insert.call_args[0][0]
+    assert insert.call_args[1] == {"batch": True}
+    assert event["id"] == "bar"
+    assert event["signature"] == "foo"
+    assert event["source"] == "github"
+    # Only the parser in use is imported
+    assert direct.registry.loaded() == ["github-parser"]
+    assert direct.stats()["ingested"] == 1
+
+
+@mock.patch("shared.insert_row_into_bigquery")
+def test_spooled_write_counted_apart_from_duplicates(insert):
+    insert.return_value = shared.SPOOLED
+    direct = DirectIngest(mode="direct")
+
+    assert direct.ingest("github", BODY, HEADERS)
+    insert.return_value = None
+    assert direct.ingest("github", BODY, HEADERS)
+
+    assert direct.stats()["spooled"] == 1
+    assert direct.stats()["duplicates"] == 1
+
+
+@mock.patch("shared.insert_row_into_bigquery")
+def test_write_timeout_retried(insert):
+    insert.return_value = Future()
+    direct = DirectIngest(mode="direct", timeout=0.01)
+
+    # Classified as transient by shared.handle_error, not dead-lettered
+    assert not direct.ingest("github", BODY, HEADERS)
+    assert direct.stats()["retried"] == 1
+
+
+@mock.patch("shared.handle_error", mock.MagicMock(return_value=("", 503)))
+@mock.patch("shared.insert_row_into_bigquery")
+def test_failed_write_retried(insert):
+    insert.return_value = written([{"index": 0, "errors": ["boom"]}])
+    direct = DirectIngest(mode="direct")
+
+    assert not direct.ingest("github", BODY, HEADERS)
+    assert direct.stats()["retried"] == 1
+
+
+@mock.patch("shared.handle_error", mock.MagicMock(return_value=("", 204)))
+@mock.patch("shared.insert_row_into_bigquery")
+def test_bad_event_not_retried(insert):
+    direct = DirectIngest(mode="direct")
+
+    assert direct.ingest("github", BODY, {"X-Github-Event": "push"})
+    insert.assert_not_called()
+    assert direct.stats()["failed"] == 1
@@ -12,19 +12,93 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import Counter
 import json
 import os
 import sys
+import threading
 
 from flask import abort, Flask, request
-from google.cloud import pubsub_v1
+import shared
+from shared import claim_check, envelope, writer
 
+from admission import AdmissionController
+from deliveries import DeliveryCache
+from direct_ingest import DirectIngest
+import metrics
+from outbox import Outbox, OUTBOX_DIR
+from publisher import Publisher
 import sources
 
 PROJECT_NAME = os.environ.get("PROJECT_NAME")
+# Seconds a request waits for Pub/Sub to acknowledge its message
+PUBLISH_TIMEOUT = float(os.environ.get("PUBLISH_TIMEOUT", 30))
+# Message format, see shared.envelope; switch to 2 once every parser
+# reads it
+ENVELOPE_VERSION = int(os.environ.get("ENVELOPE_VERSION", 1))
+# Version 2 payloads above this many bytes are gzipped; 0 disables
+ENVELOPE_COMPRESS_THRESHOLD = int(
+    os.environ.get("ENVELOPE_COMPRESS_THRESHOLD", 64 * 1024)
+)
+# Bytes read from the request body at a time
+READ_CHUNK_BYTES = int(os.environ.get("READ_CHUNK_BYTES", 64 * 1024))
 
 app = Flask(__name__)
 
+# Shared by every request thread so concurrent webhooks are batched
+publisher = Publisher(PROJECT_NAME)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: publisher.reset())
+
+
+def publish(source, msg, headers):
+    """
+    Queues a message in the ENVELOPE_VERSION format; payloads above
+    CLAIM_CHECK_THRESHOLD are stored and replaced by a reference
+    """
+    auth_source = sources.AUTHORIZED_SOURCES.get(source)
+    checked_in = (claim_check.enabled() and
+                  len(msg) > claim_check.CLAIM_CHECK_THRESHOLD)
+    data, attributes = envelope.encode(
+        b"" if checked_in else msg, headers,
+        version=ENVELOPE_VERSION,
+        forward=auth_source.forward_headers if auth_source else None,
+        compress_threshold=ENVELOPE_COMPRESS_THRESHOLD,
+    )
+    if checked_in:
+        attributes.update(claim_check.check_in(msg))
+    return publisher.publish(source, data, **attributes)
+
+
+# Durable local outbox, enabled by OUTBOX_DIR; published in the background
+outbox = Outbox(OUTBOX_DIR, publish) if OUTBOX_DIR else None
+
+if outbox:
+    writer.install_shutdown_hooks(outbox)
+
+# Parsers run in-process when INGEST_MODE is "direct"
+direct = DirectIngest()
+
+if direct.enabled and not shared.BQ_BATCH_WRITES:
+    # Otherwise installed by shared already
+    writer.install_shutdown_hooks(shared.events_raw_writer)
+
+# Delivery IDs published recently, to answer redeliveries at the edge
+deliveries = DeliveryCache()
+
+# Per-source and per-repository rate limits, see admission.py
+admission = AdmissionController()
+
+# Events dropped at the edge because no parser handles them, by source
+dropped_events = Counter()
+_dropped_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: deliveries.reset())
+    os.register_at_fork(after_in_child=lambda: admission.reset())
+    os.register_at_fork(after_in_child=lambda: direct.reset())
+
 
 @app.route("/", methods=["GET", "POST"])
 def index():
@@ -46,50 +120,151 @@ def index():
     if not signature:
         abort(403, "Signature not found in request headers")
 
-    body = request.data
+    # Refuse oversized bodies before reading them
+    limit = auth_source.max_body_bytes
+    if request.content_length is not None and request.content_length > limit:
+        abort(413, f"Body exceeds {limit} bytes")
 
-    # Verify the signature
-    verify_signature = auth_source.verification
-    if not verify_signature(signature, body):
+    # Verify the signature, hashing the body as it is read
+    if auth_source.verifier:
+        verifier = auth_source.verifier()
+        body = read_body(limit, verifier.update)
+        verified = verifier.verify(signature)
+    else:
+        body = read_body(limit)
+        verified = auth_source.verification(signature, body)
+    if not verified:
         abort(403, "Signature does not match expected signature")
 
+    payload = sources.Payload(body)
+
+    # Acknowledge redeliveries of an event that was already published
+    delivery_id = None
+    if deliveries.window > 0:
+        delivery_id = auth_source.delivery_id(request.headers, payload)
+    if delivery_id:
+        delivery_id = f"{source}:{delivery_id}"
+        if deliveries.seen(delivery_id):
+            return "", 204
+
+    # Acknowledge event types the parser would reject without publishing;
+    # events without a recognizable type are left to the parser
+    event_type = auth_source.event_type(request.headers, payload)
+    if event_type is not None and not auth_source.supports(event_type):
+        with _dropped_lock:
+            dropped_events[source] += 1
+        return "", 204
+
+    # Throttle floods, but never deployments or incidents
+    if admission.enabled(source):
+        retry_after = admission.admit(
+            source,
+            repository=auth_source.repository(request.headers, payload),
+            priority=event_type in auth_source.priority_types,
+        )
+        if retry_after:
+            return "", 429, {"Retry-After": str(retry_after)}
+
     # Remove the Auth header so we do not publish it to Pub/Sub
     pubsub_headers = dict(request.headers)
     if "Authorization" in pubsub_headers:
         del pubsub_headers["Authorization"]
 
-    # Publish to Pub/Sub
-    publish_to_pubsub(source, body, pubsub_headers)
+    # Write the event in-process, or publish to Pub/Sub through the outbox
+    # if enabled
+    if direct.handles(source):
+        if not direct.ingest(source, body, pubsub_headers):
+            abort(503, "Event could not be saved")
+    elif not enqueue(source, body, pubsub_headers):
+        abort(503, "Event could not be published")
+
+    if delivery_id:
+        deliveries.add(delivery_id)
 
     # Flush the stdout to avoid log buffering.
     sys.stdout.flush()
     return "", 204
 
 
+def read_body(limit, on_chunk=None):
+    """
+    Reads the request body in READ_CHUNK_BYTES chunks, passing each to
+    `on_chunk`; aborts with 413 once more than `limit` bytes arrive
+    """
+    chunks = []
+    size = 0
+    while True:
+        chunk = request.stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > limit:
+            abort(413, f"Body exceeds {limit} bytes")
+        if on_chunk:
+            on_chunk(chunk)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def enqueue(source, msg, headers):
+    """
+    Hands the message over for publishing; True once it is safe
+    """
+    if outbox:
+        try:
+            outbox.append(source, msg, headers)
+            return True
+        except Exception as e:
+            entry = {
+                "severity": "WARNING",
+                "msg": "Outbox append failed, publishing directly.",
+                "errors": str(e),
+            }
+            print(json.dumps(entry))
+    return publish_to_pubsub(source, msg, headers)
+
+
 def publish_to_pubsub(source, msg, headers):
     """
-    Publishes the message to Cloud Pub/Sub
+    Publishes the message to Cloud Pub/Sub; True once Pub/Sub has it.
+
+    Without the outbox, nothing else holds the message, so the ack is
+    awaited: answering before it would drop the webhook on a failed
+    publish, where a 503 makes the sender redeliver it. Set OUTBOX_DIR to
+    answer once the message is on disk and publish in the background.
     """
     try:
-        publisher = pubsub_v1.PublisherClient()
-        topic_path = publisher.topic_path(PROJECT_NAME, source)
-        print(topic_path)
-
         # Pub/Sub data must be bytestring, attributes must be strings
-        future = publisher.publish(
-            topic_path, data=msg, headers=json.dumps(headers)
-        )
-
-        exception = future.exception()
-        if exception:
-            raise Exception(exception)
+        future = publish(source, msg, headers)
 
-        print(f"Published message: {future.result()}")
+        # Only the ack is awaited; the batch is shared with other requests
+        print(f"Published message: {future.result(timeout=PUBLISH_TIMEOUT)}")
+        return True
 
     except Exception as e:
         # Log any exceptions to stackdriver
         entry = dict(severity="WARNING", message=e)
         print(entry)
+        return False
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Serves this instance's metrics in the Prometheus text format.
+    """
+    body = metrics.render(
+        histograms=(publisher.latency, publisher.in_flight),
+        components={
+            "publisher": publisher.stats(),
+            "outbox": outbox.stats() if outbox else {},
+            "deliveries": deliveries.stats(),
+            "admission": admission.stats(),
+            "dropped_events": dict(dropped_events),
+            "direct_ingest": direct.stats(),
+        },
+    )
+    return body, 200, {"Content-Type": metrics.CONTENT_TYPE}
 
 
 if __name__ == "__main__":
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent.futures import Future
 import hmac
 from hashlib import sha1
 
@@ -20,6 +21,9 @@ import event_handler
 import mock
 import pytest
 
+# Some tests replace it on the module
+publish_to_pubsub = event_handler.publish_to_pubsub
+
 
 @pytest.fixture
 def client():
@@ -84,3 +88,198 @@ def test_data_sent_to_pubsub(client):
         "github", b"Hello", headers
     )
     assert r.status_code == 204
+
+
+@mock.patch("sources.get_secret", mock.MagicMock(return_value=b"foo"))
+@mock.patch(
+    "event_handler.publish_to_pubsub", mock.MagicMock(return_value=False)
+)
+def test_failed_publish_is_not_acknowledged(client):
+    signature = "sha1=" + hmac.new(b"foo", b"Hello", sha1).hexdigest()
+    r = client.post(
+        "/",
+        data="Hello",
+        headers={"User-Agent": "GitHub-Hookshot", "X-Hub-Signature": signature},
+    )
+    assert r.status_code == 503
+
+
+def test_publish_waits_for_the_ack():
+    future = Future()
+    future.set_exception(Exception("Pub/Sub unavailable"))
+
+    with mock.patch("event_handler.publish", return_value=future):
+        assert not publish_to_pubsub("github", b"Hello", {})
+
+    future = Future()
+    future.set_result("message-id")
+
+    with mock.patch("event_handler.publish", return_value=future):
+        assert publish_to_pubsub("github", b"Hello", {})
+
+
+@mock.patch("sources.get_secret", mock.MagicMock(return_value=b"foo"))
+def test_redelivery_is_not_published(client):
+    signature = "sha1=" + hmac.new(b"foo", b"Hello", sha1).hexdigest()
+    headers = {
+        "User-Agent": "GitHub-Hookshot",
+        "X-Hub-Signature": signature,
+        "X-GitHub-Delivery": "72d3162e-cc78-11e3-81ab-4c9367dc0958",
+    }
+
+    with mock.patch("event_handler.enqueue",
+                    mock.MagicMock(return_value=True)) as enqueue:
+        assert client.post("/", data="Hello", headers=headers).status_code == 204
+        assert client.post("/", data="Hello", headers=headers).status_code == 204
+
+    enqueue.assert_called_once()
+
+
+@mock.patch("sources.get_secret", mock.MagicMock(return_value=b"foo"))
+def test_throttled_event_gets_retry_after(client):
+    signature = "sha1=" + hmac.new(b"foo", b"Hello", sha1).hexdigest()
+    headers = {
+        "User-Agent": "GitHub-Hookshot",
+        "X-Hub-Signature": signature,
+        "X-Github-Event": "issue_comment",
+    }
+    controller = event_handler.AdmissionController(
+        source_rate=0.01, source_burst=1, overrides={}
+    )
+
+    with mock.patch("event_handler.admission", controller), \
+            mock.patch("event_handler.enqueue", mock.MagicMock(return_value=True)):
+        assert client.post("/", data="Hello", headers=headers).status_code == 204
+        r = client.post("/", data="Hello", headers=headers)
+        assert r.status_code == 429
+        assert int(r.headers["Retry-After"]) > 0
+
+        headers["X-Github-Event"] = "deployment_status"
+        assert client.post("/", data="Hello", headers=headers).status_code == 204
+
+
+@mock.patch("sources.get_secret", mock.MagicMock(return_value=b"foo"))
+def test_unsupported_event_is_dropped(client):
+    signature = "sha1=" + hmac.new(b"foo", b"Hello", sha1).hexdigest()
+    headers = {
+        "User-Agent": "GitHub-Hookshot",
+        "X-Hub-Signature": signature,
+        "X-Github-Event": "ping",
+    }
+
+    with mock.patch("event_handler.enqueue",
+                    mock.MagicMock(return_value=True)) as enqueue:
+        r = client.post("/", data="Hello", headers=headers)
+
+    assert r.status_code == 204
+    enqueue.assert_not_called()
+    assert event_handler.dropped_events["github"] >= 1
+
+
+def test_publisher_is_reused():
+    future = mock.MagicMock()
+    future.result.return_value = "1"
+    client = mock.MagicMock()
+    client.publish.return_value = future
+    factory = mock.MagicMock(return_value=client)
+    publisher = event_handler.Publisher("project", client_factory=factory)
+
+    publisher.publish("github", b"Hello", headers="{}")
+    publisher.publish("github", b"Hello", headers="{}")
+
+    factory.assert_called_once()
+    client.topic_path.assert_called_once_with("project", "github")
+    assert client.publish.call_count == 2
+    callback = future.add_done_callback.call_args[0][0]
+    future.exception.return_value = None
+    callback(future)
+    assert publisher.stats()["published"] == 1
+
+
+def test_large_payload_is_checked_in(tmp_path):
+    store = event_handler.claim_check.store_for("file://" + str(tmp_path))
+    publisher = mock.MagicMock()
+
+    with mock.patch("event_handler.publisher", publisher), \
+            mock.patch("event_handler.claim_check._store", store), \
+            mock.patch("event_handler.claim_check.CLAIM_CHECK_THRESHOLD", 4):
+        event_handler.publish("github", b"Hello", {})
+        event_handler.publish("github", b"Hi", {})
+
+    source, data = publisher.publish.call_args_list[0][0]
+    attributes = publisher.publish.call_args_list[0][1]
+    assert data == b""
+    assert event_handler.claim_check.check_out(
+        attributes, store=store
+    ) == b"Hello"
+    publisher.publish.assert_called_with("github", b"Hi", headers="{}")
+
+
+def test_compact_envelope_forwards_needed_headers():
+    publisher = mock.MagicMock()
+    headers = {
+        "X-Github-Event": "push",
+        "X-Hub-Signature": "sha1=foo",
+        "User-Agent": "GitHub-Hookshot",
+        "Accept": "*/*",
+    }
+
+    with mock.patch("event_handler.publisher", publisher), \
+            mock.patch("event_handler.ENVELOPE_VERSION", 2):
+        event_handler.publish("github", b"Hello", headers)
+
+    publisher.publish.assert_called_once_with(
+        "github", b"Hello", envelope="2",
+        **{"X-Github-Event": "push", "X-Hub-Signature": "sha1=foo"}
+    )
+
+
+def test_metrics(client):
+    r = client.get("/metrics")
+
+    assert r.status_code == 200
+    body = r.get_data(as_text=True)
+    assert "# TYPE event_handler_publish_seconds histogram" in body
+    assert "# TYPE event_handler_publish_in_flight_messages histogram" in body
+    assert 'event_handler_component_stats{component="publisher",' in body
+
+
+@mock.patch("sources.get_secret", mock.MagicMock(return_value=b"foo"))
+def test_oversized_body_rejected(client):
+    signature = "sha1=" + hmac.new(b"foo", b"Hello", sha1).hexdigest()
+    headers = {"User-Agent": "GitHub-Hookshot", "X-Hub-Signature": signature}
+
+    with mock.patch.object(
+        event_handler.sources.AUTHORIZED_SOURCES["github"], "max_body_bytes", 4
+    ):
+        r = client.post("/", data="Hello", headers=headers)
+
+    assert r.status_code == 413
+
+
+@mock.patch("sources.get_secret", mock.MagicMock(return_value=b"foo"))
+def test_body_hashed_in_chunks(client):
+    body = b"x" * 1000
+    signature = "sha1=" + hmac.new(b"foo", body, sha1).hexdigest()
+    headers = {"User-Agent": "GitHub-Hookshot", "X-Hub-Signature": signature}
+
+    with mock.patch("event_handler.READ_CHUNK_BYTES", 64), \
+            mock.patch("event_handler.enqueue") as enqueue:
+        r = client.post("/", data=body, headers=headers)
+
+    assert r.status_code == 204
+    assert enqueue.call_args[0][1] == body
+
+
+@mock.patch("sources.get_secret", mock.MagicMock(return_value=b"foo"))
+def test_pagerduty_accepts_any_listed_signature():
+    signature = "v1=" + hmac.new(b"foo", b"Hello", "sha256").hexdigest()
+
+    verifier = event_handler.sources.pagerduty_verifier()
+    verifier.update(b"Hel")
+    verifier.update(b"lo")
+
+    assert verifier.verify("v1=bar," + signature)
+    assert not event_handler.sources.github_verification(
+        "sha1=bar," + signature, b"Hello"
+    )
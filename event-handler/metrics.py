@@ -0,0 +1,36 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from shared.metrics import CONTENT_TYPE, Registry  # noqa: F401
+
+COMPONENT_STATS = "event_handler_component_stats"
+
+
+def render(histograms=(), components=None):
+    """
+    Renders histograms (shared.metrics.Histogram) and component counters
+    ({component: stats dict}) in the Prometheus text format
+    """
+    registry = Registry()
+    for histogram in histograms:
+        registry.register(histogram)
+    if components:
+        registry.gauge(
+            COMPONENT_STATS, "Counters kept by the event-handler components.",
+            ("component", "stat"),
+            lambda: {(component, stat): value
+                     for component, stats in components.items()
+                     for stat, value in stats.items()},
+        )
+    return registry.render()
@@ -0,0 +1,93 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import os
+
+from shared.spool import Spool
+
+# Enables the outbox when set; webhooks are then answered once on disk
+OUTBOX_DIR = os.environ.get("OUTBOX_DIR")
+OUTBOX_SEGMENT_BYTES = int(os.environ.get("OUTBOX_SEGMENT_BYTES", 8 * 1024 * 1024))
+# Seconds an open segment may collect messages before it is published
+OUTBOX_MAX_AGE = float(os.environ.get("OUTBOX_MAX_AGE", 0.5))
+OUTBOX_PUBLISH_TIMEOUT = float(os.environ.get("OUTBOX_PUBLISH_TIMEOUT", 60))
+OUTBOX_MAX_BACKOFF = float(os.environ.get("OUTBOX_MAX_BACKOFF", 60))
+
+
+class Outbox(Spool):
+    """
+    Durable, append-only outbox for verified webhook payloads.
+
+    A shared.spool.Spool whose records are messages: `append` returns
+    once the payload is fsynced, and the drainer publishes sealed
+    segments with `publish(source, data, headers)`, which returns a
+    future. A segment is deleted once every message in it is acked.
+    Messages that were already acked are not published again when a
+    failed segment is retried.
+    """
+
+    thread_name = "outbox-drainer"
+    stat_names = ("appended", "fsyncs", "published", "segments",
+                  "publish_errors")
+    error_stat = "publish_errors"
+    retry_msg = "Outbox publish failed, retrying."
+    shutdown_msg = "Outbox not drained at shutdown."
+
+    def __init__(self, directory, publish, segment_bytes=OUTBOX_SEGMENT_BYTES,
+                 max_age=OUTBOX_MAX_AGE, publish_timeout=OUTBOX_PUBLISH_TIMEOUT,
+                 max_backoff=OUTBOX_MAX_BACKOFF):
+        super().__init__(directory, None, segment_bytes=segment_bytes,
+                         max_age=max_age, fsync=True, max_backoff=max_backoff)
+        self._publish = publish
+        self.publish_timeout = publish_timeout
+
+    def _open(self):
+        # Indices of the acked messages of segments not yet deleted
+        self._acked = {}
+        super()._open()
+
+    def append(self, source, data, headers):
+        """
+        Durably records a message; returns once it is on disk
+        """
+        self._write({
+            "source": source,
+            "data": base64.b64encode(data).decode("utf-8"),
+            "headers": headers,
+        })
+
+    def _deliver(self, path, records):
+        acked = self._acked.setdefault(path, set())
+        futures = [
+            (i, self._publish(record["source"],
+                              base64.b64decode(record["data"]),
+                              record["headers"]))
+            for i, record in enumerate(records)
+            if i not in acked
+        ]
+        published = 0
+        error = None
+        for i, future in futures:
+            try:
+                future.result(timeout=self.publish_timeout)
+                acked.add(i)
+                published += 1
+            except Exception as e:
+                error = error or e
+        with self._lock:
+            self._stats["published"] += published
+        if error:
+            raise error
+        del self._acked[path]
@@ -0,0 +1,127 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import Future
+import os
+import threading
+
+from shared import spool
+
+import outbox
+
+import mock
+
+
+def _acked(message_id="1"):
+    future = Future()
+    future.set_result(message_id)
+    return future
+
+
+def _failed(error):
+    future = Future()
+    future.set_exception(error)
+    return future
+
+
+def test_drain_publishes_and_deletes_segments(tmp_path):
+    publish = mock.MagicMock(return_value=_acked())
+    box = outbox.Outbox(str(tmp_path), publish, max_age=3600)
+    box.append("github", b"Hello", '{"X-Github-Event": "push"}')
+    box.close()
+
+    publish.assert_called_once_with(
+        "github", b"Hello", '{"X-Github-Event": "push"}'
+    )
+    assert box.stats()["pending_segments"] == 0
+    assert box.stats()["published"] == 1
+
+
+def test_concurrent_appends_share_fsyncs(tmp_path):
+    box = outbox.Outbox(str(tmp_path), mock.MagicMock(), max_age=3600)
+    threads = [
+        threading.Thread(target=box.append, args=("github", b"x", "{}"))
+        for _ in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = box.stats()
+    assert stats["appended"] == 20
+    assert 1 <= stats["fsyncs"] <= 20
+
+
+def test_failed_publish_keeps_segment_and_skips_acked(tmp_path):
+    publish = mock.MagicMock(side_effect=[
+        _acked(), _failed(Exception("Pub/Sub unavailable")),
+    ])
+    box = outbox.Outbox(str(tmp_path), publish, max_age=3600)
+    box.append("github", b"first", "{}")
+    box.append("github", b"second", "{}")
+    with box._lock:
+        box._seal()
+
+    try:
+        box.drain()
+        assert False, "drain should raise"
+    except Exception as e:
+        assert str(e) == "Pub/Sub unavailable"
+    assert box.stats()["pending_segments"] == 1
+
+    publish.side_effect = None
+    publish.return_value = _acked()
+    box.drain()
+
+    assert publish.call_args_list[-1] == mock.call("github", b"second", "{}")
+    assert publish.call_count == 3
+    assert box.stats()["pending_segments"] == 0
+
+
+def test_torn_record_is_ignored(tmp_path):
+    path = str(tmp_path / "segment.log")
+    box = outbox.Outbox(str(tmp_path / "box"), mock.MagicMock(), max_age=3600)
+    box.append("github", b"Hello", "{}")
+    with box._lock:
+        segment = box._segment_path(box._sequence)
+        box._seal()
+    with open(segment, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data + data[:10])
+
+    records = spool.read_segment(path)
+
+    assert len(records) == 1
+    assert records[0]["source"] == "github"
+    assert os.path.exists(segment)
+
+
+def test_concurrent_first_appends_open_one_slot(tmp_path):
+    box = outbox.Outbox(str(tmp_path), mock.MagicMock(), max_age=3600)
+    barrier = threading.Barrier(8)
+
+    def append():
+        barrier.wait()
+        box.append("github", b"x", "{}")
+
+    threads = [threading.Thread(target=append) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert os.listdir(str(tmp_path)) == ["slot-0"]
+    assert box.stats()["appended"] == 8
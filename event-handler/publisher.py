@@ -0,0 +1,132 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+import time
+
+from google.cloud import pubsub_v1
+from shared.metrics import BATCH_BUCKETS, Histogram
+
+# Batches close at whichever limit is hit first. A short latency lets
+# concurrent webhooks share a publish RPC without delaying a lone one.
+PUBSUB_MAX_MESSAGES = int(os.environ.get("PUBSUB_MAX_MESSAGES", 100))
+PUBSUB_MAX_BYTES = int(os.environ.get("PUBSUB_MAX_BYTES", 1024 * 1024))
+PUBSUB_MAX_LATENCY = float(os.environ.get("PUBSUB_MAX_LATENCY", 0.01))
+
+
+class Publisher(object):
+    """
+    Long-lived, batching Pub/Sub publisher shared by all request threads.
+
+    The client is created lazily once per process. `publish` returns the
+    client's future right away; completion is tracked with a callback
+    that records the publish latency and logs failures.
+    """
+
+    def __init__(self, project_name, max_messages=PUBSUB_MAX_MESSAGES,
+                 max_bytes=PUBSUB_MAX_BYTES, max_latency=PUBSUB_MAX_LATENCY,
+                 client_factory=None):
+        self.project_name = project_name
+        self.batch_settings = pubsub_v1.types.BatchSettings(
+            max_bytes=max_bytes,
+            max_latency=max_latency,
+            max_messages=max_messages,
+        )
+        self._client_factory = client_factory or pubsub_v1.PublisherClient
+        self.reset()
+
+    def reset(self):
+        """
+        Drops the client and the counters, e.g. in a forked child
+        """
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._client = None
+        self._topics = {}
+        self._in_flight = 0
+        self.latency = Histogram(
+            "event_handler_publish_seconds",
+            "Time from queueing a message to its Pub/Sub ack.",
+        )
+        # The client does not report the size of the batches it sends, so
+        # this is the number of messages still awaiting an ack
+        self.in_flight = Histogram(
+            "event_handler_publish_in_flight_messages",
+            "Messages awaiting a Pub/Sub ack when another is published.",
+            buckets=BATCH_BUCKETS,
+        )
+        self._stats = {"published": 0, "failed": 0, "bytes": 0}
+
+    def client(self):
+        if self._pid != os.getpid():
+            self.reset()
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._client_factory(
+                        batch_settings=self.batch_settings
+                    )
+        return self._client
+
+    def topic_path(self, topic):
+        path = self._topics.get(topic)
+        if path is None:
+            path = self._topics[topic] = self.client().topic_path(
+                self.project_name, topic
+            )
+        return path
+
+    def publish(self, topic, data, **attributes):
+        """
+        Queues a message for the next batch and returns its future
+        """
+        client = self.client()
+        started = time.monotonic()
+        with self._lock:
+            self._in_flight += 1
+            in_flight = self._in_flight
+        self.in_flight.observe(in_flight)
+
+        future = client.publish(self.topic_path(topic), data, **attributes)
+        future.add_done_callback(
+            lambda f: self._done(f, topic, len(data), started)
+        )
+        return future
+
+    def _done(self, future, topic, size, started):
+        self.latency.observe(time.monotonic() - started)
+        error = future.exception()
+        with self._lock:
+            self._in_flight -= 1
+            if error:
+                self._stats["failed"] += 1
+            else:
+                self._stats["published"] += 1
+                self._stats["bytes"] += size
+        if error:
+            entry = {
+                "severity": "WARNING",
+                "msg": "Message not published.",
+                "topic": topic,
+                "errors": str(error),
+            }
+            print(json.dumps(entry))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = self._in_flight
+        return stats
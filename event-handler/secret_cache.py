@@ -0,0 +1,151 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+import time
+
+# Seconds a fetched secret is served without asking Secret Manager again
+SECRET_CACHE_TTL = float(os.environ.get("SECRET_CACHE_TTL", 300))
+# Refresh in the background once an entry is this close to expiring
+SECRET_REFRESH_AHEAD = float(os.environ.get("SECRET_REFRESH_AHEAD", 60))
+# How long the value replaced by a rotation is still accepted
+SECRET_ROTATION_GRACE = float(os.environ.get("SECRET_ROTATION_GRACE", 600))
+
+
+class _Entry(object):
+    def __init__(self):
+        self.value = None
+        self.expires = 0
+        self.previous = None
+        self.previous_expires = 0
+        self.loaded = threading.Event()
+        self.loading = False
+
+
+class SecretCache(object):
+    """
+    Process-wide cache of secret payloads.
+
+    `fetch(key)` loads a secret. Entries are served for `ttl` seconds and
+    refreshed in the background during the last `refresh_ahead` seconds,
+    so requests only wait on Secret Manager for the very first load. Only
+    one thread loads a given key at a time; concurrent callers wait for
+    its result. When a refresh returns a new value, the old one is kept
+    for `grace` seconds so signatures made before the rotation still
+    verify.
+    """
+
+    def __init__(self, fetch, ttl=SECRET_CACHE_TTL,
+                 refresh_ahead=SECRET_REFRESH_AHEAD,
+                 grace=SECRET_ROTATION_GRACE, clock=None):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.grace = grace
+        self._clock = clock or time.monotonic
+        self.reset()
+
+    def reset(self):
+        """
+        Drops every cached secret, e.g. in a forked child
+        """
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._stats = {"hits": 0, "misses": 0, "refreshes": 0,
+                       "rotations": 0, "errors": 0}
+
+    def get(self, key):
+        """
+        Returns the current value of the secret
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            if entry.loaded.is_set() and now < entry.expires:
+                self._stats["hits"] += 1
+                if (entry.expires - now <= self.refresh_ahead and
+                        not entry.loading):
+                    entry.loading = True
+                    self._stats["refreshes"] += 1
+                    threading.Thread(
+                        target=self._load, args=(key, entry),
+                        name="secret-refresh", daemon=True,
+                    ).start()
+                return entry.value
+
+            self._stats["misses"] += 1
+            load = not entry.loading
+            if load:
+                entry.loading = True
+                entry.loaded.clear()
+
+        if load:
+            self._load(key, entry)
+        else:
+            entry.loaded.wait()
+
+        with self._lock:
+            if entry.value is None:
+                raise KeyError("Secret not available: %s" % (key,))
+            return entry.value
+
+    def previous(self, key):
+        """
+        Returns the value replaced by the last rotation while it is within
+        its grace period, or None; never loads anything
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.previous is not None and \
+                    self._clock() < entry.previous_expires:
+                return entry.previous
+        return None
+
+    def _load(self, key, entry):
+        try:
+            value = self._fetch(key)
+            with self._lock:
+                now = self._clock()
+                if entry.value is not None and value != entry.value:
+                    entry.previous = entry.value
+                    entry.previous_expires = now + self.grace
+                    self._stats["rotations"] += 1
+                entry.value = value
+                entry.expires = now + self.ttl
+        except Exception as e:
+            with self._lock:
+                self._stats["errors"] += 1
+                if entry.value is not None:
+                    # Keep serving the last good value; the next background
+                    # refresh starts after another `refresh_ahead` seconds
+                    entry.expires = self._clock() + 2 * self.refresh_ahead
+            print(json.dumps({
+                "severity": "WARNING",
+                "msg": "Secret not refreshed.",
+                "errors": str(e),
+            }))
+        finally:
+            with self._lock:
+                entry.loading = False
+            entry.loaded.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["secrets"] = len(self._entries)
+        return stats
@@ -0,0 +1,102 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import secret_cache
+
+import mock
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def _wait_for_refresh(cache):
+    for _ in range(100):
+        if not any(e.loading for e in cache._entries.values()):
+            return
+        time.sleep(0.01)
+
+
+def test_hit_skips_fetch():
+    fetch = mock.MagicMock(return_value=b"foo")
+    cache = secret_cache.SecretCache(fetch, ttl=300, clock=Clock())
+
+    assert cache.get("key") == b"foo"
+    assert cache.get("key") == b"foo"
+    fetch.assert_called_once_with("key")
+    assert cache.stats()["hits"] == 1
+
+
+def test_concurrent_misses_load_once():
+    started = threading.Event()
+    release = threading.Event()
+
+    def fetch(key):
+        started.set()
+        release.wait(5)
+        return b"foo"
+
+    fetch = mock.MagicMock(side_effect=fetch)
+    cache = secret_cache.SecretCache(fetch, ttl=300, clock=Clock())
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("key")))
+               for _ in range(5)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == [b"foo"] * 5
+    fetch.assert_called_once_with("key")
+
+
+def test_rotation_keeps_previous_version():
+    clock = Clock()
+    fetch = mock.MagicMock(side_effect=[b"old", b"new"])
+    cache = secret_cache.SecretCache(
+        fetch, ttl=300, refresh_ahead=60, grace=600, clock=clock
+    )
+    assert cache.get("key") == b"old"
+
+    # Close to expiry the old value is served while refreshing
+    clock.now = 250
+    assert cache.get("key") == b"old"
+    _wait_for_refresh(cache)
+
+    assert cache.get("key") == b"new"
+    assert cache.previous("key") == b"old"
+    clock.now = 250 + 601
+    assert cache.previous("key") is None
+
+
+def test_failed_refresh_serves_last_value():
+    clock = Clock()
+    fetch = mock.MagicMock(side_effect=[b"foo", Exception("unavailable")])
+    cache = secret_cache.SecretCache(fetch, ttl=300, refresh_ahead=60,
+                                     clock=clock)
+    cache.get("key")
+
+    clock.now = 300
+    assert cache.get("key") == b"foo"
+    assert cache.stats()["errors"] == 1
@@ -14,11 +14,22 @@
 
 import hmac
 from hashlib import sha1, sha256
+import json
 import os
+import threading
 
 from google.cloud import secretmanager
+from shared.event_types import SUPPORTED_EVENT_TYPES
+
+from secret_cache import SecretCache
 
 PROJECT_NAME = os.environ.get("PROJECT_NAME")
+# Largest body accepted, in bytes; GitHub caps payloads at 25 MB
+MAX_BODY_BYTES = int(os.environ.get("MAX_BODY_BYTES", 25 * 1024 * 1024))
+# Per-source overrides, e.g. {"pagerduty": 1048576}
+MAX_BODY_BYTES_BY_SOURCE = json.loads(
+    os.environ.get("MAX_BODY_BYTES_BY_SOURCE", "{}")
+)
 
 
 class EventSource(object):
@@ -26,78 +37,188 @@ class EventSource(object):
     A source of event data being delivered to the webhook
     """
 
-    def __init__(self, signature_header, verification_func):
+    def __init__(self, signature_header, verification_func,
+                 delivery_id_func=None, event_type_func=None,
+                 repository_func=None, priority_types=(), event_types=None,
+                 forward_headers=None, verifier_func=None,
+                 max_body_bytes=MAX_BODY_BYTES):
         self.signature = signature_header
         self.verification = verification_func
+        # Returns an object hashing the body chunk by chunk, see
+        # HmacVerifier; sources without one are verified on the whole body
+        self.verifier = verifier_func
+        self.max_body_bytes = max_body_bytes
+        # Each of these takes (headers, payload) and may return None.
+        # The delivery ID is shared by all redeliveries of an event.
+        self.delivery_id = delivery_id_func or _none
+        self.event_type = event_type_func or _none
+        self.repository = repository_func or _none
+        # Event types that are never throttled, e.g. deployments
+        self.priority_types = frozenset(priority_types)
+        # Event types the parser handles; None accepts everything
+        self.event_types = event_types
+        # Headers the parser reads, see shared.envelope; None keeps all
+        self.forward_headers = forward_headers
+
+    def supports(self, event_type):
+        return self.event_types is None or event_type in self.event_types
+
+
+class Payload(object):
+    """
+    The raw body of a webhook, parsed as JSON at most once
+    """
 
+    def __init__(self, body):
+        self.body = body
+        self._json = None
+        self._parsed = False
 
-def github_verification(signature, body):
+    @property
+    def json(self):
+        if not self._parsed:
+            try:
+                self._json = json.loads(self.body)
+            except ValueError:
+                self._json = None
+            self._parsed = True
+        return self._json
+
+
+def _none(headers, payload):
+    return None
+
+
+def header_value(*names):
     """
-    Verifies that the signature received from the github event is accurate
+    Returns a function reading the first of the headers that is present
     """
+    def value(headers, payload):
+        for name in names:
+            found = headers.get(name)
+            if found:
+                return found
+        return None
 
-    expected_signature = "sha1="
-    try:
-        # Get secret from Cloud Secret Manager
-        secret = get_secret(PROJECT_NAME, "event-handler", "latest")
-        # Compute the hashed signature
-        hashed = hmac.new(secret, body, sha1)
-        expected_signature += hashed.hexdigest()
+    return value
 
-    except Exception as e:
-        print(e)
 
-    return hmac.compare_digest(signature, expected_signature)
+def body_value(*path):
+    """
+    Returns a function reading a field of the JSON body
+    """
+    def value(headers, payload):
+        found = payload.json
+        try:
+            for key in path:
+                found = found[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+        return str(found) if found else None
+
+    return value
 
 
-def circleci_verification(signature, body):
+_prototypes = {}
+_prototypes_lock = threading.Lock()
+
+
+def hmac_prototype(secret, digestmod):
     """
-    Verifies that the signature received from the circleci event is accurate
+    Returns a keyed HMAC to copy per request, so the key schedule is
+    computed once per secret instead of on every webhook
+    """
+    key = (secret, digestmod)
+    prototype = _prototypes.get(key)
+    if prototype is None:
+        prototype = hmac.new(secret, digestmod=digestmod)
+        with _prototypes_lock:
+            # Only a few secrets are live at a time; drop rotated ones
+            if len(_prototypes) >= 16:
+                _prototypes.clear()
+            _prototypes[key] = prototype
+    return prototype
+
+
+class HmacVerifier(object):
+    """
+    Hashes a body incrementally with every live version of a secret and
+    checks the result against the signature header
     """
 
-    expected_signature = "v1="
-    try:
-        # Get secret from Cloud Secret Manager
-        secret = get_secret(PROJECT_NAME, "event-handler", "latest")
-        # Compute the hashed signature
-        hashed = hmac.new(secret, body, 'sha256')
-        expected_signature += hashed.hexdigest()
+    def __init__(self, secrets, digestmod, prefix, multiple=False):
+        self.prefix = prefix
+        # Whether the header may hold several comma-separated signatures
+        self.multiple = multiple
+        self._macs = []
+        for secret in secrets:
+            try:
+                self._macs.append(hmac_prototype(secret, digestmod).copy())
+            except Exception as e:
+                print(e)
+
+    def update(self, chunk):
+        for mac in self._macs:
+            mac.update(chunk)
+
+    def verify(self, signature):
+        candidates = signature.split(",") if self.multiple else [signature]
+        for mac in self._macs:
+            expected = self.prefix + mac.hexdigest()
+            for candidate in candidates:
+                if hmac.compare_digest(candidate, expected):
+                    return True
+        return False
 
-    except Exception as e:
-        print(e)
 
-    return hmac.compare_digest(signature, expected_signature)
+def _verify_body(verifier, signature, body):
+    verifier.update(body)
+    return verifier.verify(signature)
 
 
-def pagerduty_verification(signatures, body):
+def github_verifier():
+    # Get secrets from Cloud Secret Manager, current version first
+    return HmacVerifier(
+        get_secrets(PROJECT_NAME, "event-handler", "latest"), sha1, "sha1="
+    )
+
+
+def circleci_verifier():
+    return HmacVerifier(
+        get_secrets(PROJECT_NAME, "event-handler", "latest"), sha256, "v1="
+    )
+
+
+def pagerduty_verifier():
+    return HmacVerifier(
+        get_secrets(PROJECT_NAME, "pager_duty_secret", "latest"),
+        sha256, "v1=", multiple=True,
+    )
+
+
+def github_verification(signature, body):
     """
-    Verifies that the signature received from the pagerduty event is accurate
+    Verifies that the signature received from the github event is accurate
     """
+    return _verify_body(github_verifier(), signature, body)
 
-    if not signatures:
-        raise Exception("Pagerduty signature is empty")
 
-    signature_list = signatures.split(",")
+def circleci_verification(signature, body):
+    """
+    Verifies that the signature received from the circleci event is accurate
+    """
+    return _verify_body(circleci_verifier(), signature, body)
 
-    if len(signature_list) == 0:
-        raise Exception("Pagerduty signature list is empty")
 
-    expected_signature = "v1="
-    try:
-        # Get secret from Cloud Secret Manager
-        secret = get_secret(PROJECT_NAME, "pager_duty_secret", "latest")
-
-        # Compute the hashed signature
-        hashed = hmac.new(secret, body, sha256)
-        expected_signature += hashed.hexdigest()
+def pagerduty_verification(signatures, body):
+    """
+    Verifies that the signature received from the pagerduty event is accurate
+    """
 
-    except Exception as e:
-        print(e)
+    if not signatures:
+        raise Exception("Pagerduty signature is empty")
 
-    if expected_signature in signature_list:
-        return True
-    else:
-        return False
+    return _verify_body(pagerduty_verifier(), signatures, body)
 
 
 def simple_token_verification(token, body):
@@ -111,21 +232,57 @@ def simple_token_verification(token, body):
     return secret.decode() == token
 
 
+_client = None
+_client_pid = None
+
+
+def _secret_client():
+    # One client per process; gRPC channels do not survive a fork
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = secretmanager.SecretManagerServiceClient()
+        _client_pid = os.getpid()
+    return _client
+
+
+def _fetch_secret(key):
+    project_name, secret_name, version_num = key
+    client = _secret_client()
+    name = client.secret_version_path(project_name, secret_name, version_num)
+    secret = client.access_secret_version(name)
+    return secret.payload.data
+
+
+secret_cache = SecretCache(_fetch_secret)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: secret_cache.reset())
+
+
 def get_secret(project_name, secret_name, version_num):
     """
     Returns secret payload from Cloud Secret Manager
     """
     try:
-        client = secretmanager.SecretManagerServiceClient()
-        name = client.secret_version_path(
-            project_name, secret_name, version_num
-        )
-        secret = client.access_secret_version(name)
-        return secret.payload.data
+        return secret_cache.get((project_name, secret_name, version_num))
     except Exception as e:
         print(e)
 
 
+def get_secrets(project_name, secret_name, version_num):
+    """
+    Returns the current secret payload, followed by the payload it
+    replaced while a rotation is still within its grace period
+    """
+    current = get_secret(project_name, secret_name, version_num)
+    if current is None:
+        return []
+    previous = secret_cache.previous((project_name, secret_name, version_num))
+    if previous is None or previous == current:
+        return [current]
+    return [current, previous]
+
+
 def get_source(headers):
     """
     Gets the source from the User-Agent header
@@ -150,18 +307,54 @@ def get_source(headers):
 
 AUTHORIZED_SOURCES = {
     "github": EventSource(
-        "X-Hub-Signature", github_verification
+        "X-Hub-Signature", github_verification,
+        verifier_func=github_verifier,
+        delivery_id_func=header_value("X-GitHub-Delivery"),
+        event_type_func=header_value("X-Github-Event"),
+        repository_func=body_value("repository", "full_name"),
+        priority_types={"deployment", "deployment_status", "release"},
+        event_types=SUPPORTED_EVENT_TYPES["github"],
+        forward_headers=("X-Github-Event", "X-Hub-Signature",
+                         "X-GitHub-Delivery", "Mock"),
         ),
     "gitlab": EventSource(
-        "X-Gitlab-Token", simple_token_verification
+        "X-Gitlab-Token", simple_token_verification,
+        delivery_id_func=header_value("Idempotency-Key", "X-Gitlab-Event-UUID"),
+        event_type_func=body_value("object_kind"),
+        repository_func=body_value("project", "path_with_namespace"),
+        priority_types={"deployment"},
+        event_types=SUPPORTED_EVENT_TYPES["gitlab"],
+        forward_headers=("X-Gitlab-Event", "Idempotency-Key", "Mock"),
         ),
     "tekton": EventSource(
-        "tekton-secret", simple_token_verification
+        "tekton-secret", simple_token_verification,
+        delivery_id_func=header_value("Ce-Id"),
+        event_type_func=header_value("Ce-Type"),
+        # CloudEvents binary mode needs every ce- attribute
+        forward_headers=("Ce-*", "Content-Type"),
         ),
     "circleci": EventSource(
-        "Circleci-Signature", circleci_verification
+        "Circleci-Signature", circleci_verification,
+        verifier_func=circleci_verifier,
+        delivery_id_func=body_value("id"),
+        event_type_func=header_value("Circleci-Event-Type"),
+        repository_func=body_value("project", "slug"),
+        priority_types={"workflow-completed"},
+        event_types=SUPPORTED_EVENT_TYPES["circleci"],
+        forward_headers=("Circleci-Event-Type", "Circleci-Signature", "Mock"),
         ),
     "pagerduty": EventSource(
-        "X-Pagerduty-Signature", pagerduty_verification
+        "X-Pagerduty-Signature", pagerduty_verification,
+        verifier_func=pagerduty_verifier,
+        delivery_id_func=body_value("event", "id"),
+        event_type_func=body_value("event", "event_type"),
+        priority_types={"incident.triggered", "incident.resolved"},
+        event_types=SUPPORTED_EVENT_TYPES["pagerduty"],
+        forward_headers=("X-Pagerduty-Signature", "Mock"),
         ),
 }
+
+for _name, _source in AUTHORIZED_SOURCES.items():
+    _source.max_body_bytes = MAX_BODY_BYTES_BY_SOURCE.get(
+        _name, _source.max_body_bytes
+    )
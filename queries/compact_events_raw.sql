@@ -0,0 +1,27 @@
+-- Compaction of events_raw, run as a scheduled query by terraform.
+-- Generated from shared.sinks.COMPACTION_SQL with COMPACTION_DAYS=3;
+-- shared/sinks_test.py checks that the two match.
+
+BEGIN TRANSACTION;
+
+CREATE TEMP TABLE duplicates AS
+SELECT kept.*
+FROM (
+  SELECT ARRAY_AGG(e ORDER BY e.msg_id LIMIT 1)[OFFSET(0)] AS kept
+  FROM four_keys.events_raw e
+  WHERE e.time_created >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 3 DAY)
+    AND (e.time_inserted IS NULL OR
+         e.time_inserted < TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 90 MINUTE))
+  GROUP BY e.signature
+  HAVING COUNT(*) > 1
+);
+
+DELETE FROM four_keys.events_raw
+WHERE signature IN (SELECT signature FROM duplicates)
+  AND time_created >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 3 DAY)
+  AND (time_inserted IS NULL OR
+       time_inserted < TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 90 MINUTE));
+
+INSERT INTO four_keys.events_raw SELECT * FROM duplicates;
+
+COMMIT TRANSACTION;
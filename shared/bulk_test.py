@@ -0,0 +1,121 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+
+from shared import bulk, sinks
+
+import pytest
+
+
+def _rows(count):
+    return [("push", str(i), "{}", "2021-06-15T13:12:14Z", "sig-%d" % i,
+             "msg-%d" % i, "github") for i in range(count)]
+
+
+def _none_stored(table_id, column, values):
+    return set()
+
+
+def test_rows_split_into_chunks(tmp_path):
+    loaded = []
+
+    def load(table_id, path):
+        with gzip.open(path, "rt") as f:
+            loaded.append([json.loads(line) for line in f])
+
+    loader = bulk.BulkLoader(staging_dir=str(tmp_path), chunk_rows=2,
+                             workers=2, load=load, existing=_none_stored)
+    summary = loader.load(_rows(5))
+
+    assert summary == {"chunks": 3, "skipped": 0, "rows": 5, "duplicates": 0}
+    assert sorted(len(chunk) for chunk in loaded) == [1, 2, 2]
+    # Chunks load concurrently, so only the set of rows is deterministic
+    assert sorted(row["signature"] for chunk in loaded for row in chunk) == [
+        "sig-%d" % i for i in range(5)
+    ]
+
+
+def test_committed_chunks_skipped_on_rerun(tmp_path):
+    calls = []
+
+    def failing_load(table_id, path):
+        calls.append(path)
+        if len(calls) == 2:
+            raise Exception("load job failed")
+
+    loader = bulk.BulkLoader(staging_dir=str(tmp_path), chunk_rows=2,
+                             workers=1, load=failing_load,
+                             existing=_none_stored)
+    with pytest.raises(Exception):
+        loader.load(_rows(4))
+
+    calls = []
+    rerun = bulk.BulkLoader(staging_dir=str(tmp_path), chunk_rows=2,
+                            workers=1, existing=_none_stored,
+                            load=lambda table_id, path: calls.append(path))
+    summary = rerun.load(_rows(4))
+
+    assert summary["skipped"] == 1
+    assert len(calls) == 1
+
+
+def test_load_into_local_sink(tmp_path):
+    sink = sinks.SQLiteSink(str(tmp_path / "four_keys.db"))
+    loader = bulk.BulkLoader(
+        staging_dir=str(tmp_path / "staging"), chunk_rows=10,
+        load=sink.load_file, existing=sink.existing,
+    )
+
+    loader.load(_rows(25))
+
+    assert sink.query("SELECT COUNT(*) FROM four_keys.events_raw") == [(25,)]
+
+
+def test_stored_rows_not_loaded_again(tmp_path):
+    sink = sinks.SQLiteSink(str(tmp_path / "four_keys.db"))
+    sink.insert_rows("events_raw", _rows(3))
+    loader = bulk.BulkLoader(
+        staging_dir=str(tmp_path / "staging"), chunk_rows=4,
+        load=sink.load_file, existing=sink.existing,
+    )
+
+    # The listing changed, so no chunk matches the checkpoint, and one
+    # row is repeated within the input
+    summary = loader.load(_rows(6) + _rows(6)[-1:])
+
+    assert summary["rows"] == 3
+    assert summary["duplicates"] == 4
+    assert sink.query(
+        "SELECT COUNT(*), COUNT(DISTINCT signature) FROM four_keys.events_raw"
+    ) == [(6, 6)]
+
+
+def test_staging_dir_scoped_to_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk, "BULK_STAGING_DIR", str(tmp_path))
+
+    def loader(run_id):
+        return bulk.BulkLoader(run_id=run_id, existing=_none_stored,
+                               load=lambda table_id, path: None)
+
+    loader("project-1").load(_rows(3))
+    rerun = loader("project-1")
+
+    assert rerun.staging_dir == str(tmp_path / "project-1" / "events_raw")
+    assert rerun.load(_rows(3))["skipped"] == 1
+    # Another run does not inherit its checkpoints
+    assert loader("project-2").load(_rows(3))["skipped"] == 0
+    with pytest.raises(ValueError):
+        bulk.BulkLoader()
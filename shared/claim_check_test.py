@@ -0,0 +1,74 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+
+import shared
+from shared import claim_check
+
+import mock
+import pytest
+
+
+def test_check_in_and_out_round_trip(tmp_path):
+    store = claim_check.store_for("file://" + str(tmp_path))
+    attributes = claim_check.check_in(b'{"commits": []}', store=store)
+
+    assert attributes["claim_check"].startswith("file://")
+    assert attributes["claim_check_encoding"] == "gzip"
+    assert claim_check.check_out(attributes, store=store) == b'{"commits": []}'
+
+
+def test_inline_message_has_no_claim_check():
+    assert claim_check.check_out({"headers": "{}"}) is None
+
+
+def test_message_data_fetches_checked_in_payload(tmp_path):
+    store = claim_check.store_for("file://" + str(tmp_path))
+    attributes = claim_check.check_in(b'{"id": 1}', store=store)
+    inline = {"data": base64.b64encode(b'{"id": 2}'), "attributes": {}}
+
+    with mock.patch("shared.claim_check._store", store):
+        assert shared.message_data({"attributes": attributes}, "test") == {"id": 1}
+        assert shared.message_data(inline, "test") == {"id": 2}
+
+
+@pytest.mark.parametrize("reference", [
+    "file:///etc/passwd",
+    "file://{root}/../outside.gz",
+    "file://host{root}/payload.gz",
+    "gs://bucket/claims/payload.gz",
+])
+def test_references_outside_the_store_are_refused(tmp_path, reference):
+    root = tmp_path / "claims"
+    store = claim_check.store_for("file://" + str(root))
+    attributes = {"claim_check": reference.format(root=root)}
+
+    with pytest.raises(ValueError):
+        claim_check.check_out(attributes, store=store)
+
+
+def test_gcs_references_must_share_bucket_and_prefix():
+    store = claim_check.store_for("gs://bucket/claims")
+
+    assert store.contains("gs://bucket/claims/payload.gz")
+    assert not store.contains("gs://bucket/other/payload.gz")
+    assert not store.contains("gs://bucket/claims-old/payload.gz")
+    assert not store.contains("gs://other/claims/payload.gz")
+
+
+def test_claim_checks_need_a_store():
+    with mock.patch("shared.claim_check._store", None):
+        with pytest.raises(ValueError):
+            claim_check.check_out({"claim_check": "file:///tmp/payload.gz"})
@@ -0,0 +1,78 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from shared import clients
+
+import mock
+import pytest
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(clock):
+    return clients.BigQueryCache(
+        ttl=60, client_factory=mock.MagicMock, clock=clock
+    )
+
+
+def test_client_created_once(cache):
+    assert cache.client() is cache.client()
+    assert cache.stats()["clients"] == 1
+
+
+def test_table_cached_until_ttl(cache, clock):
+    first = cache.get_table("four_keys", "events_raw")
+    second = cache.get_table("four_keys", "events_raw")
+
+    assert first is second
+    assert cache.client().get_table.call_count == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+    clock.now = 61
+    cache.get_table("four_keys", "events_raw")
+
+    assert cache.client().get_table.call_count == 2
+    assert cache.stats()["refreshes"] == 1
+
+
+def test_invalidate(cache):
+    cache.get_table("four_keys", "events_raw")
+    cache.invalidate("four_keys", "events_raw")
+    cache.get_table("four_keys", "events_raw")
+
+    assert cache.stats()["misses"] == 2
+
+
+def test_reset_after_fork(cache):
+    client = cache.client()
+    cache.get_table("four_keys", "events_raw")
+
+    # Simulate running in a forked child
+    cache._pid = -1
+
+    assert cache.client() is not client
+    assert cache.stats()["tables"] == 0
@@ -0,0 +1,144 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import json
+import os
+import uuid
+
+import shared
+from shared import sinks
+from shared.consumer import BatchConsumer
+
+import mock
+import pytest
+
+
+def _message(data, message_id="1"):
+    return mock.MagicMock(data=data, attributes={"foo": "bar"},
+                          message_id=message_id)
+
+
+def _process(msg):
+    body = json.loads(base64.b64decode(msg["data"]))
+    return {
+        "event_type": "push",
+        "id": body["id"],
+        "metadata": json.dumps(body),
+        "time_created": 0,
+        "signature": body["id"],
+        "msg_id": msg["message_id"],
+        "source": "github",
+    }
+
+
+def test_acked_once_batch_is_written():
+    insert = mock.MagicMock(return_value=[])
+    consumer = BatchConsumer("subscriptions/github", _process, "github",
+                             batch_latency=60, insert=insert)
+    messages = [_message(b'{"id": "%d"}' % i, str(i)) for i in range(3)]
+
+    for message in messages:
+        consumer.callback(message)
+    for message in messages:
+        message.ack.assert_not_called()
+    consumer.writer.flush()
+
+    assert insert.call_count == 1
+    assert len(insert.call_args[0][0]) == 3
+    for message in messages:
+        message.ack.assert_called_once_with()
+    assert consumer.stats()["acked"] == 3
+
+
+def test_failed_rows_nacked():
+    insert = mock.MagicMock(return_value=[{"index": 1, "errors": ["boom"]}])
+    consumer = BatchConsumer("subscriptions/github", _process, "github",
+                             batch_latency=60, insert=insert)
+    messages = [_message(b'{"id": "%d"}' % i, str(i)) for i in range(2)]
+
+    for message in messages:
+        consumer.callback(message)
+    consumer.writer.flush()
+
+    messages[0].ack.assert_called_once_with()
+    messages[1].nack.assert_called_once_with()
+    messages[1].ack.assert_not_called()
+
+
+@mock.patch("shared.handle_error")
+def test_parse_errors_handled_like_push(handle_error):
+    consumer = BatchConsumer("subscriptions/github", _process, "github",
+                             insert=mock.MagicMock(return_value=[]))
+    permanent, transient = _message(b"not json"), _message(b"not json")
+
+    handle_error.return_value = ("", 204)
+    consumer.callback(permanent)
+    handle_error.return_value = ("", 503)
+    consumer.callback(transient)
+
+    permanent.ack.assert_called_once_with()
+    transient.nack.assert_called_once_with()
+    assert handle_error.call_args[0][2] == "github"
+
+
+def test_run_flushes_on_stop():
+    insert = mock.MagicMock(return_value=[])
+    message = _message(b'{"id": "1"}')
+    subscriber = mock.MagicMock()
+
+    def subscribe(subscription, callback, flow_control):
+        assert flow_control.max_messages == 10
+        streaming = mock.MagicMock()
+        streaming.result.side_effect = lambda timeout: callback(message)
+        return streaming
+
+    subscriber.subscribe.side_effect = subscribe
+    consumer = BatchConsumer("subscriptions/github", _process, "github",
+                             max_messages=10, batch_latency=60,
+                             subscriber=subscriber, insert=insert)
+    consumer.run(timeout=1)
+
+    insert.assert_called_once()
+    message.ack.assert_called_once_with()
+
+
+@pytest.mark.skipif(not os.environ.get("PUBSUB_EMULATOR_HOST"),
+                    reason="needs the Pub/Sub emulator")
+def test_streaming_pull_against_emulator(tmp_path):
+    from google.cloud import pubsub_v1
+
+    project = "fourkeys-test"
+    name = "github-%s" % uuid.uuid4().hex
+    publisher = pubsub_v1.PublisherClient()
+    subscriber = pubsub_v1.SubscriberClient()
+    topic = publisher.topic_path(project, name)
+    subscription = subscriber.subscription_path(project, name)
+    publisher.create_topic(topic)
+    subscriber.create_subscription(subscription, topic)
+    for i in range(5):
+        publisher.publish(topic, b'{"id": "%d"}' % i).result()
+
+    sink = sinks.SQLiteSink(str(tmp_path / "four_keys.db"))
+    shared.set_sink(sink)
+    shared.signatures.reset()
+    try:
+        consumer = BatchConsumer(subscription, _process, "github",
+                                 batch_latency=0.1, subscriber=subscriber)
+        consumer.run(timeout=5)
+    finally:
+        shared.set_sink(None)
+
+    assert sink.query("SELECT COUNT(*) FROM four_keys.events_raw") == [(5,)]
+    assert consumer.stats()["acked"] == 5
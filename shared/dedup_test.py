@@ -0,0 +1,94 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from shared import dedup
+
+import mock
+import pytest
+
+
+def test_bloom_filter_membership():
+    bloom = dedup.BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add("sig-%d" % i)
+
+    assert all("sig-%d" % i in bloom for i in range(1000))
+    false_positives = sum("other-%d" % i in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_bloom_filter_rejects_bad_error_rate():
+    with pytest.raises(ValueError):
+        dedup.BloomFilter(1000, 1)
+
+
+def test_new_signature_skips_store():
+    exists = mock.MagicMock(return_value=False)
+    index = dedup.SignatureIndex(exists, capacity=100, error_rate=0.01)
+
+    assert index.is_unique("foo")
+    exists.assert_not_called()
+
+
+def test_added_signature_is_duplicate():
+    exists = mock.MagicMock(return_value=True)
+    index = dedup.SignatureIndex(exists, capacity=100, error_rate=0.01)
+    index.add("foo")
+
+    assert not index.is_unique("foo")
+    exists.assert_not_called()
+    assert index.stats()["lru_hits"] == 1
+
+
+def test_warm_up_hit_checks_store():
+    exists = mock.MagicMock(return_value=True)
+    index = dedup.SignatureIndex(
+        exists, capacity=100, error_rate=0.01,
+        warmup=lambda: iter(["foo", "bar"]),
+    )
+
+    assert not index.is_unique("foo")
+    exists.assert_called_once_with("foo")
+    assert index.stats()["warmed"] == 2
+
+    # Confirmed duplicates are answered from the LRU afterwards
+    assert not index.is_unique("foo")
+    assert exists.call_count == 1
+
+
+def test_failed_warm_up_falls_back_to_store():
+    def warmup():
+        raise Exception("BigQuery unavailable")
+
+    exists = mock.MagicMock(return_value=False)
+    index = dedup.SignatureIndex(
+        exists, capacity=100, error_rate=0.01, warmup=warmup
+    )
+
+    assert index.is_unique("foo")
+    exists.assert_called_once_with("foo")
+
+
+def test_batch_checks_probable_hits_in_one_lookup():
+    exists = mock.MagicMock()
+    existing = mock.MagicMock(return_value={"foo"})
+    index = dedup.SignatureIndex(
+        exists, capacity=100, error_rate=0.01,
+        warmup=lambda: iter(["foo", "bar"]), existing=existing,
+    )
+
+    assert index.unique(["foo", "bar", "baz"]) == ["baz", "bar"]
+    existing.assert_called_once_with(["foo", "bar"])
+    exists.assert_not_called()
+    assert index.stats()["store_checks"] == 1
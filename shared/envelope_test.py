@@ -0,0 +1,61 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import json
+
+from shared import envelope
+
+
+def _pushed(data, attributes):
+    return {"data": base64.b64encode(data).decode("utf-8"),
+            "attributes": attributes}
+
+
+def test_version_1_round_trip():
+    headers = {"X-Github-Event": "push", "User-Agent": "GitHub-Hookshot"}
+    data, attributes = envelope.encode(b"Hello", headers)
+
+    assert attributes == {"headers": json.dumps(headers)}
+    msg = _pushed(data, attributes)
+    assert envelope.version(msg) == 1
+    assert envelope.decode_headers(msg) == headers
+    assert envelope.decode_data(msg) == b"Hello"
+
+
+def test_version_2_keeps_forwarded_headers_and_compresses():
+    headers = {
+        "Ce-Id": "1",
+        "Ce-Type": "dev.tekton.event",
+        "Content-Type": "application/json",
+        "User-Agent": "Go-http-client",
+    }
+    data, attributes = envelope.encode(
+        b"x" * 100, headers, version=2, forward=("ce-*", "Content-Type"),
+        compress_threshold=10,
+    )
+
+    assert attributes["content_encoding"] == "gzip"
+    msg = _pushed(data, attributes)
+    assert envelope.version(msg) == 2
+    assert envelope.decode_headers(msg) == {
+        "Ce-Id": "1",
+        "Ce-Type": "dev.tekton.event",
+        "Content-Type": "application/json",
+    }
+    assert envelope.decode_data(msg) == b"x" * 100
+
+
+def test_message_without_headers():
+    assert envelope.decode_headers({"attributes": {"buildId": "1"}}) == {}
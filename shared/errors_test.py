@@ -0,0 +1,90 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import json
+
+from shared import errors
+
+from google.api_core import exceptions as api_exceptions
+import mock
+
+
+ENVELOPE = {"message": {"data": "", "attributes": {}, "message_id": "foobar"}}
+
+
+def test_classify():
+    assert errors.classify(api_exceptions.ServiceUnavailable("down")) == "transient"
+    assert errors.classify(ConnectionError()) == "transient"
+    assert errors.classify(concurrent.futures.TimeoutError()) == "transient"
+    assert errors.classify(KeyError("id")) == "permanent"
+    assert errors.classify(Exception("Unsupported GitHub event")) == "permanent"
+    assert errors.classify(Warning("Unsupported PagerDuty event")) == "ignored"
+
+
+def test_retry_budget_exhausted():
+    budget = errors.RetryBudget(ratio=0.5, min_per_second=0, clock=lambda: 0)
+    budget._tokens = 0
+
+    budget.record_request()
+    assert not budget.try_retry()
+
+    budget.record_request()
+    assert budget.try_retry()
+    assert not budget.try_retry()
+
+
+def test_transient_error_retried():
+    dead_letter = mock.MagicMock(return_value=[])
+    handler = errors.ErrorHandler(dead_letter)
+
+    body, status, headers = handler.handle(
+        api_exceptions.ServiceUnavailable("down"), ENVELOPE, "github"
+    )
+
+    assert status == 503
+    assert 0 <= int(headers["Retry-After"]) <= errors.RETRY_BACKOFF_BASE
+    dead_letter.assert_not_called()
+
+
+def test_transient_error_dead_lettered_without_budget():
+    dead_letter = mock.MagicMock(return_value=[])
+    budget = errors.RetryBudget(ratio=0, min_per_second=0)
+    budget._tokens = 0
+    handler = errors.ErrorHandler(dead_letter, budget=budget)
+
+    assert handler.handle(
+        api_exceptions.ServiceUnavailable("down"), ENVELOPE, "github"
+    ) == ("", 204)
+    assert dead_letter.call_args[0][0][0][1] == "transient"
+
+
+def test_permanent_error_dead_lettered():
+    dead_letter = mock.MagicMock(return_value=[])
+    handler = errors.ErrorHandler(dead_letter)
+
+    assert handler.handle(KeyError("id"), ENVELOPE, "github") == ("", 204)
+
+    row = dead_letter.call_args[0][0][0]
+    assert row[:3] == ("github", "permanent", "KeyError: 'id'")
+    assert json.loads(row[3]) == ENVELOPE
+
+
+def test_failed_dead_letter_logged(capsys):
+    dead_letter = mock.MagicMock(side_effect=Exception("BigQuery unavailable"))
+    handler = errors.ErrorHandler(dead_letter)
+
+    handler.handle(KeyError("id"), ENVELOPE, "github")
+
+    assert '"severity": "ERROR"' in capsys.readouterr().out
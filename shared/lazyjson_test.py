@@ -0,0 +1,103 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import json
+
+import shared
+from shared.lazyjson import LazyJSON, ParsedJSON
+
+import pytest
+
+DOCUMENT = {
+    "ref": "refs/heads/main",
+    "commits": [
+        {"id": "a", "message": "Fix \"quotes\", [brackets] and {braces}"},
+        {"id": "b", "message": "café"},
+    ],
+    "head_commit": {"id": "b", "timestamp": "2021-06-15T13:12:14Z"},
+    "check_run": {"completed_at": None, "started_at": "2021-06-15"},
+    "empty": {},
+}
+
+
+@pytest.fixture(params=[LazyJSON, ParsedJSON])
+def document(request):
+    if request.param is LazyJSON:
+        return LazyJSON(json.dumps(DOCUMENT, indent=2))
+    return ParsedJSON(DOCUMENT)
+
+
+def test_paths(document):
+    assert document["ref"] == "refs/heads/main"
+    assert document["head_commit", "timestamp"] == "2021-06-15T13:12:14Z"
+    assert document["commits", 1, "message"] == "café"
+    assert document["commits", 0, "id"] == "a"
+    assert document["empty"] == {}
+    assert (document["check_run", "completed_at"] or
+            document["check_run", "started_at"]) == "2021-06-15"
+
+
+def test_missing_paths(document):
+    for path in ["nope", ("commits", 2), ("ref", "x"), ("commits", "id"),
+                 ("empty", "x"), ("head_commit", 0)]:
+        with pytest.raises(KeyError):
+            document[path]
+        assert document.get(*path) is None
+    assert document.get("nope", default=1) == 1
+
+
+def test_lazy_document_keeps_text():
+    text = '{ "id" : 1,\n  "b": [1, 2] }'
+    document = LazyJSON(text)
+
+    assert document["b"] == [1, 2]
+    assert document.dumps() == text
+
+
+def test_lazy_document_reads_only_up_to_the_key():
+    # Anything after the key read is never scanned
+    document = LazyJSON('{"id": "foo", "rest": not json')
+
+    assert document["id"] == "foo"
+
+
+def test_lazy_document_skips_nested_keys():
+    text = json.dumps({
+        "a": {"name": "nested", "b": [{"name": "deeper"}]},
+        "note": "{\"name\": \"in a string\"}",
+        "name": "direct",
+    }, indent=8)
+    document = LazyJSON(text)
+
+    assert document["name"] == "direct"
+    assert document["a", "name"] == "nested"
+    assert document["a", "b", 0, "name"] == "deeper"
+    assert document.get("a", "missing") is None
+
+
+def test_lazy_document_escaped_keys():
+    document = LazyJSON('{"a": {"n\\u0061me": "x"}, "\\u006eame": "y"}')
+
+    assert document["name"] == "y"
+    assert document["a", "name"] == "x"
+
+
+def test_message_document_passthrough(monkeypatch):
+    text = '{"id":  "foo"}'
+    msg = {"data": base64.b64encode(text.encode()).decode(), "attributes": {}}
+
+    assert shared.message_document(msg, "test").dumps() == '{"id": "foo"}'
+    monkeypatch.setattr(shared, "METADATA_PASSTHROUGH", True)
+    assert shared.message_document(msg, "test").dumps() == text
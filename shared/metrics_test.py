@@ -0,0 +1,63 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import json
+
+import shared
+from shared import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    histogram = registry.histogram("latency", "Latency.", ("stage",),
+                                   buckets=(0.1, 1))
+    histogram.observe(0.05, "parse")
+    histogram.observe(0.5, "parse")
+    histogram.observe(5, "parse")
+
+    text = registry.render()
+
+    assert '# TYPE latency histogram' in text
+    assert 'latency_bucket{stage="parse",le="0.1"} 1' in text
+    assert 'latency_bucket{stage="parse",le="1"} 2' in text
+    assert 'latency_bucket{stage="parse",le="+Inf"} 3' in text
+    assert 'latency_count{stage="parse"} 3' in text
+    assert 'latency_sum{stage="parse"} 5.55' in text
+
+
+def test_counter_escapes_label_values():
+    registry = metrics.Registry()
+    counter = registry.counter("errors_total", "Errors.", ("source",))
+    counter.inc('git"hub')
+    counter.inc('git"hub', amount=2)
+
+    assert 'errors_total{source="git\\"hub"} 3' in registry.render()
+
+
+def test_message_data_times_decoding():
+    before = metrics.STAGE_SECONDS.count("json_loads", "test", "")
+    data = base64.b64encode(json.dumps({"id": 1}).encode("utf-8"))
+
+    assert shared.message_data({"data": data}, "test") == {"id": 1}
+    assert metrics.STAGE_SECONDS.count("json_loads", "test", "") == before + 1
+
+
+def test_metrics_response_is_prometheus_text():
+    body, status, headers = shared.metrics_response()
+
+    assert status == 200
+    assert headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE fourkeys_stage_seconds histogram" in body
+    assert 'fourkeys_component_stats{component="table_cache",stat="hits"}' in body
@@ -0,0 +1,60 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+from shared import plugins
+
+import pytest
+
+
+@pytest.fixture
+def registry(tmp_path):
+    for name in ("foo", "bar"):
+        directory = tmp_path / ("%s-parser" % name)
+        directory.mkdir()
+        (directory / "main.py").write_text(
+            "def process(*args):\n    return (%r,) + args\n" % name
+        )
+    registry = plugins.PluginRegistry(str(tmp_path))
+    registry.register(plugins.Plugin("foo", "foo-parser", "process",
+                                     headers=("X-Foo-Event",)))
+    registry.register(plugins.Plugin("bar", "bar-parser", "process",
+                                     call=plugins.ATTRIBUTES,
+                                     subscriptions=("bars",),
+                                     attributes=("barId",)))
+    return registry
+
+
+def test_route_by_subscription(registry):
+    envelope = {"subscription": "projects/p/subscriptions/bars", "message": {}}
+    assert registry.route(envelope) == "bar"
+
+
+def test_route_by_attribute_and_header(registry):
+    assert registry.route_message({"attributes": {"barId": "1"}}) == "bar"
+    headers = json.dumps({"x-foo-event": "push"})
+    assert registry.route_message({"attributes": {"headers": headers}}) == "foo"
+    assert registry.route_message({"attributes": {}}) is None
+
+
+def test_plugins_imported_on_first_use(registry):
+    msg = {"attributes": {"barId": "1"}}
+
+    assert registry.loaded() == []
+    assert registry.process("bar", msg) == ("bar", {"barId": "1"}, msg)
+    assert registry.loaded() == ["bar-parser"]
+    assert registry.process("foo", msg, {"X-Foo-Event": "push"}) == (
+        "foo", {"X-Foo-Event": "push"}, msg
+    )
@@ -21,7 +21,7 @@ setup(
    url='git@github.com:four-keys-playground.git#egg=shared&subdirectory=shared',
    author='Google Inc.',
    license='Apache-2.0',
-   py_modules=['shared'],
-   install_requires=['google-cloud-bigquery'],
+   packages=['shared'],
+   install_requires=['google-cloud-bigquery', 'google-cloud-storage'],
    zip_safe=False
 )
@@ -0,0 +1,446 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from collections import OrderedDict
+import hashlib
+import json
+import os
+
+from shared.clients import (  # noqa: F401
+    cache_stats,
+    get_client,
+    get_schema,
+    get_table,
+    invalidate_table,
+)
+from shared.bulk import BulkLoader  # noqa: F401
+from shared.dedup import DEDUP_WARMUP_DAYS, SignatureIndex
+from shared import envelope, metrics
+from shared.envelope import decode_headers as message_headers  # noqa: F401
+from shared.metrics import timed  # noqa: F401
+from shared.lazyjson import LazyJSON, ParsedJSON
+from shared.event_types import is_supported, SUPPORTED_EVENT_TYPES  # noqa: F401
+from shared.errors import (  # noqa: F401
+    classify,
+    ErrorHandler,
+    insert_error,
+    PermanentError,
+    TransientError,
+)
+from shared.sinks import get_sink, set_sink  # noqa: F401
+from shared.spool import BQ_SPOOL_DIR, Spool
+from shared import timestamps
+from shared.timestamps import normalize as normalize_timestamp  # noqa: F401
+from shared.writer import (
+    BatchWriter,
+    BQ_BATCH_WRITES,
+    install_shutdown_hooks,
+)
+
+# "check" confirms each signature is new before writing it.
+# "insert_id" skips that check and relies on the signature being used as the
+# streaming insert ID, plus the shared.compaction job for rare leftovers.
+BQ_WRITE_MODE = os.environ.get("BQ_WRITE_MODE", "check")
+
+# Stores payloads in events_raw.metadata exactly as received instead of
+# re-serializing the parsed JSON; whitespace and key order are kept.
+METADATA_PASSTHROUGH = os.environ.get(
+    "METADATA_PASSTHROUGH", ""
+).lower() in ("1", "true")
+
+# Returned by insert_row_into_bigquery for a row written to the spool
+SPOOLED = "spooled"
+
+
+def message_data(msg, source, parse_json=True):
+    """
+    Decodes the data of a Pub/Sub message, timing each step.
+    Payloads offloaded by the event-handler are fetched from the store.
+    """
+    with metrics.timed("decode", source):
+        data = envelope.decode_data(msg).decode("utf-8").strip()
+    if not parse_json:
+        return data
+    with metrics.timed("json_loads", source):
+        return json.loads(data)
+
+
+def message_document(msg, source):
+    """
+    Returns the JSON data of a Pub/Sub message as a document read by
+    path. With METADATA_PASSTHROUGH only the paths read are decoded and
+    the original text is kept as the metadata.
+    """
+    data = message_data(msg, source, parse_json=False)
+    if METADATA_PASSTHROUGH:
+        return LazyJSON(data)
+    with metrics.timed("json_loads", source):
+        return ParsedJSON(json.loads(data))
+
+
+def _is_unique(event):
+    if BQ_WRITE_MODE == "insert_id":
+        return True
+    with metrics.timed("dedup", event["source"], event["event_type"]):
+        unique = signatures.is_unique(event["signature"])
+    metrics.count_dedup(
+        "events_raw", event["source"], event["event_type"], unique
+    )
+    return unique
+
+
+def insert_row_into_bigquery(event, batch=None):
+    """
+    Writes an event to events_raw unless its signature was seen before.
+
+    `batch` overrides BQ_BATCH_WRITES; a batched row is handed to
+    events_raw_writer and the Future of its write is returned. With
+    BQ_SPOOL_DIR the row is on disk once this returns SPOOLED.
+    """
+    if not event:
+        raise Exception("No data to insert")
+
+    if _is_unique(event):
+        # Insert row
+        row_to_insert = [_raw_row(event)]
+
+        if events_spool:
+            events_spool.append(
+                "events_raw", row_to_insert[0], row_id=event["signature"],
+            )
+            signatures.add(event["signature"])
+            return SPOOLED
+
+        if BQ_BATCH_WRITES if batch is None else batch:
+            return events_raw_writer.submit(
+                row_to_insert[0], context=event, key=event["signature"]
+            )
+
+        metrics.observe_batch("events_raw", 1)
+        with metrics.timed("insert_rows", event["source"], event["event_type"]):
+            bq_errors = get_sink().insert_rows(
+                "events_raw", row_to_insert, row_ids=[event["signature"]]
+            )
+
+        # If errors, log to Stackdriver and let handle_error route them
+        if bq_errors:
+            entry = {
+                "severity": "WARNING",
+                "msg": "Row not inserted.",
+                "errors": bq_errors,
+                "row": row_to_insert,
+            }
+            print(json.dumps(entry))
+            raise insert_error(bq_errors)
+        signatures.add(event["signature"])
+
+
+def _raw_row(event):
+    return (
+        event["event_type"],
+        event["id"],
+        event["metadata"],
+        event["time_created"],
+        event["signature"],
+        event["msg_id"],
+        event["source"],
+    )
+
+
+def insert_rows_into_bigquery(events, row_ids=None):
+    """
+    Writes a batch of events to events_raw in one insert, skipping
+    signatures written before. Returns per-event errors in the
+    `client.insert_rows` format, indexed like `events`, so it can serve
+    as the insert of a BatchWriter.
+    """
+    batch = OrderedDict()
+    for i, event in enumerate(events):
+        batch.setdefault(event["signature"], []).append(i)
+
+    if BQ_WRITE_MODE == "insert_id":
+        new = list(batch)
+    else:
+        with metrics.timed("dedup"):
+            new = signatures.unique(list(batch))
+        fresh = set(new)
+        for event in events:
+            metrics.count_dedup("events_raw", event["source"],
+                                event["event_type"], event["signature"] in fresh)
+    if not new:
+        return []
+
+    rows_to_insert = [_raw_row(events[batch[s][0]]) for s in new]
+
+    if events_spool:
+        for signature, row in zip(new, rows_to_insert):
+            events_spool.append("events_raw", row, row_id=signature)
+            signatures.add(signature)
+        return []
+
+    metrics.observe_batch("events_raw", len(rows_to_insert))
+    with metrics.timed("insert_rows"):
+        bq_errors = get_sink().insert_rows(
+            "events_raw", rows_to_insert, row_ids=new
+        )
+
+    failed = {}
+    for error in bq_errors or []:
+        failed.setdefault(error.get("index"), []).append(error)
+    errors = []
+    for i, signature in enumerate(new):
+        if i in failed:
+            # Every event carrying the signature failed with its row
+            errors.extend({"index": j, "errors": failed[i]}
+                          for j in batch[signature])
+        else:
+            signatures.add(signature)
+    return errors
+
+
+def insert_row_into_events_enriched(event):
+    if not event:
+        raise Exception("No data to insert")
+
+    insert_rows_into_events_enriched([event])
+
+
+def _enriched_rows(events):
+    # One row per signature; the last event wins within a batch
+    rows = OrderedDict()
+    for event in events:
+        rows[event["events_raw_signature"]] = (
+            event["events_raw_signature"],
+            event["enriched_metadata"],
+        )
+    return rows
+
+
+def insert_rows_into_events_enriched(events):
+    """
+    Inserts enriched rows whose signature is not in events_enriched yet,
+    checking the whole batch against the table in one lookup
+    """
+    rows = _enriched_rows(events)
+    with metrics.timed("dedup_enriched"):
+        new = enriched_signatures.unique(list(rows))
+    if not new:
+        return
+
+    if events_spool:
+        for signature in new:
+            events_spool.append(
+                "events_enriched", rows[signature], row_id=signature,
+            )
+            enriched_signatures.add(signature)
+        return
+
+    rows_to_insert = [rows[signature] for signature in new]
+    metrics.observe_batch("events_enriched", len(rows_to_insert))
+    with metrics.timed("insert_rows"):
+        bq_errors = get_sink().insert_rows(
+            "events_enriched", rows_to_insert, row_ids=new
+        )
+
+    # If errors, log to Stackdriver
+    failed = {error.get("index") for error in bq_errors or []}
+    if bq_errors:
+        entry = {
+            "severity": "WARNING",
+            "msg": "Row not inserted.",
+            "errors": bq_errors,
+            "row": rows_to_insert,
+        }
+        print(json.dumps(entry))
+    for i, signature in enumerate(new):
+        if i not in failed:
+            enriched_signatures.add(signature)
+
+
+def upsert_events_enriched(events):
+    """
+    Writes enriched rows, replacing the metadata of signatures already in
+    events_enriched, e.g. when a backfill re-enriches events
+    """
+    rows = _enriched_rows(events)
+    if not rows:
+        return
+    get_sink().upsert(
+        "events_enriched", "events_raw_signature", list(rows.values())
+    )
+    for signature in rows:
+        enriched_signatures.add(signature)
+
+
+def is_unique(client, signature):
+    sql = "SELECT signature FROM four_keys.events_raw WHERE signature = '%s'"
+    query_job = client.query(sql % signature)
+    results = query_job.result()
+    return not results.total_rows
+
+
+def _signature_exists(signature):
+    return get_sink().exists("events_raw", "signature", signature)
+
+
+def _signatures_existing(signatures):
+    return get_sink().existing("events_raw", "signature", signatures)
+
+
+def _warm_up_signatures():
+    return get_sink().recent_signatures(DEDUP_WARMUP_DAYS)
+
+
+def _enriched_signature_exists(signature):
+    return get_sink().exists("events_enriched", "events_raw_signature", signature)
+
+
+def _enriched_signatures_existing(signatures):
+    return get_sink().existing(
+        "events_enriched", "events_raw_signature", signatures
+    )
+
+
+def _warm_up_enriched_signatures():
+    return get_sink().recent_enriched_signatures(DEDUP_WARMUP_DAYS)
+
+
+# Local dedup index consulted before every events_raw insert
+signatures = SignatureIndex(
+    _signature_exists,
+    warmup=_warm_up_signatures if DEDUP_WARMUP_DAYS else None,
+    existing=_signatures_existing,
+)
+
+# Same for events_enriched, keyed by the events_raw signature
+enriched_signatures = SignatureIndex(
+    _enriched_signature_exists,
+    warmup=_warm_up_enriched_signatures if DEDUP_WARMUP_DAYS else None,
+    existing=_enriched_signatures_existing,
+)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: signatures.reset())
+    os.register_at_fork(after_in_child=lambda: enriched_signatures.reset())
+
+
+def dedup_stats():
+    return signatures.stats()
+
+
+def enriched_dedup_stats():
+    return enriched_signatures.stats()
+
+
+def _insert_events_raw(rows, row_ids=None):
+    metrics.observe_batch("events_raw", len(rows))
+    with metrics.timed("insert_rows"):
+        return get_sink().insert_rows("events_raw", rows, row_ids=row_ids)
+
+
+def _events_raw_written(pending):
+    signatures.add(pending.key)
+
+
+# Buffers events_raw rows across requests when BQ_BATCH_WRITES is set
+events_raw_writer = BatchWriter(
+    _insert_events_raw, on_success=_events_raw_written
+)
+
+if BQ_BATCH_WRITES:
+    install_shutdown_hooks(events_raw_writer)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: events_raw_writer.reset())
+
+
+def writer_stats():
+    return events_raw_writer.stats()
+
+
+def _upload_spooled(table_id, rows, row_ids):
+    metrics.observe_batch(table_id, len(rows))
+    with metrics.timed("insert_rows"):
+        return get_sink().insert_rows(table_id, rows, row_ids=row_ids)
+
+
+# Write-ahead spool on local disk, enabled by BQ_SPOOL_DIR
+events_spool = Spool(BQ_SPOOL_DIR, _upload_spooled) if BQ_SPOOL_DIR else None
+
+if events_spool:
+    install_shutdown_hooks(events_spool)
+
+
+def spool_stats():
+    return events_spool.stats() if events_spool else {}
+
+
+def _write_dead_letter(rows):
+    return get_sink().insert_rows("events_dead_letter", rows)
+
+
+# Decides between retrying and dead-lettering a failed message
+error_handler = ErrorHandler(_write_dead_letter)
+
+
+def record_request():
+    """
+    Counts an incoming message towards this instance's retry budget
+    """
+    error_handler.record_request()
+
+
+def handle_error(error, envelope, source, event=None):
+    """
+    Returns the response for a message that failed to process
+    """
+    event_type = event.get("event_type") if event else None
+    metrics.count_error(source, event_type, classify(error))
+    return error_handler.handle(error, envelope, source)
+
+
+def _component_stats():
+    components = {
+        "table_cache": cache_stats,
+        "dedup_events_raw": dedup_stats,
+        "dedup_events_enriched": enriched_dedup_stats,
+        "batch_writer": writer_stats,
+        "spool": spool_stats,
+        "error_handler": error_handler.stats,
+        "timestamp_formats": timestamps.formats.stats,
+    }
+    values = {}
+    for component, stats in components.items():
+        for stat, value in stats().items():
+            values[(component, stat)] = value
+    return values
+
+
+metrics.registry.gauge(
+    "fourkeys_component_stats",
+    "Counters kept by the shared caches, dedup indexes and writers.",
+    ("component", "stat"),
+    _component_stats,
+)
+
+
+def metrics_response():
+    """
+    Returns a Flask response with every metric of this process
+    """
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+
+def create_unique_id(msg):
+    hashed = hashlib.sha1(bytes(json.dumps(msg), "utf-8"))
+    return hashed.hexdigest()
@@ -0,0 +1,172 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from shared.sinks import get_sink, TABLE_COLUMNS
+
+BULK_CHUNK_ROWS = int(os.environ.get("BULK_CHUNK_ROWS", 50000))
+# Uncompressed bytes per chunk; load jobs are most efficient at tens of MB
+BULK_CHUNK_BYTES = int(os.environ.get("BULK_CHUNK_BYTES", 64 * 1024 * 1024))
+BULK_WORKERS = int(os.environ.get("BULK_WORKERS", 4))
+# Chunks and checkpoints are kept here between runs, one directory per
+# run and table, so a rerun finds what an interrupted one already loaded
+BULK_STAGING_DIR = os.environ.get(
+    "BULK_STAGING_DIR", os.path.join(tempfile.gettempdir(), "fourkeys-bulk")
+)
+
+CHECKPOINT_FILE = "checkpoint.jsonl"
+
+# Column identifying a row, for the tables whose loads are deduplicated
+ROW_KEYS = {"events_raw": "signature", "events_enriched": "events_raw_signature"}
+
+
+def _load_with_sink(table_id, path):
+    get_sink().load_file(table_id, path)
+
+
+def _existing_in_sink(table_id, column, values):
+    return get_sink().existing(table_id, column, values)
+
+
+class BulkLoader(object):
+    """
+    Writes large numbers of rows with batch load jobs instead of streaming.
+
+    Rows are split into chunks of at most `chunk_rows` rows or `chunk_bytes`
+    bytes, staged as gzipped NDJSON in `staging_dir` (by default
+    BULK_STAGING_DIR/`run_id`/`table_id`), and loaded by `workers` threads.
+    Every committed chunk is recorded in a checkpoint file, so rerunning an
+    interrupted backfill with the same `run_id` only loads the chunks that
+    are missing. The checkpoint only holds for unchanged input, so rows
+    whose key (ROW_KEYS) `existing(table_id, column, keys)` reports as
+    already stored are dropped from every chunk before it is loaded.
+    """
+
+    def __init__(self, table_id="events_raw", staging_dir=None, run_id=None,
+                 chunk_rows=BULK_CHUNK_ROWS, chunk_bytes=BULK_CHUNK_BYTES,
+                 workers=BULK_WORKERS, load=None, existing=None):
+        if not staging_dir and not run_id:
+            raise ValueError("BulkLoader needs a run_id or a staging_dir")
+        self.table_id = table_id
+        self.columns = TABLE_COLUMNS[table_id]
+        self.key = ROW_KEYS.get(table_id)
+        self.staging_dir = staging_dir or os.path.join(
+            BULK_STAGING_DIR, run_id, table_id
+        )
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self.chunk_rows = chunk_rows
+        self.chunk_bytes = chunk_bytes
+        self.workers = workers
+        self._load = load or _load_with_sink
+        self._existing = existing or _existing_in_sink
+        self._lock = threading.Lock()
+        self._checkpoint_path = os.path.join(self.staging_dir, CHECKPOINT_FILE)
+        self.committed = self._read_checkpoint()
+
+    def _read_checkpoint(self):
+        try:
+            with open(self._checkpoint_path) as f:
+                return {json.loads(line)["chunk"] for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def _checkpoint(self, chunk_id, rows):
+        with self._lock:
+            self.committed.add(chunk_id)
+            with open(self._checkpoint_path, "a") as f:
+                f.write(json.dumps({"chunk": chunk_id, "rows": rows}) + "\n")
+
+    def _chunks(self, rows):
+        # Yields lists of (key, line) pairs
+        lines = []
+        size = 0
+        for row in rows:
+            if not isinstance(row, dict):
+                row = dict(zip(self.columns, row))
+            line = json.dumps(row, default=str) + "\n"
+            lines.append((row.get(self.key) if self.key else None, line))
+            size += len(line)
+            if len(lines) >= self.chunk_rows or size >= self.chunk_bytes:
+                yield lines
+                lines = []
+                size = 0
+        if lines:
+            yield lines
+
+    def _new_lines(self, lines):
+        # Drops rows stored by earlier runs and repeats within the chunk
+        if not self.key:
+            return [line for _, line in lines]
+        stored = set(self._existing(
+            self.table_id, self.key, list({key for key, _ in lines if key})
+        ))
+        new = []
+        for key, line in lines:
+            if key and key in stored:
+                continue
+            if key:
+                stored.add(key)
+            new.append(line)
+        return new
+
+    def _write_chunk(self, index, lines):
+        data = "".join(line for _, line in lines).encode("utf-8")
+        # Content-addressed, so the same input maps to the same checkpoint
+        chunk_id = "%s-%06d-%s" % (
+            self.table_id, index, hashlib.sha1(data).hexdigest()[:16]
+        )
+        if chunk_id in self.committed:
+            return chunk_id, 0, 0, True
+
+        new = self._new_lines(lines)
+        if new:
+            path = os.path.join(self.staging_dir, chunk_id + ".ndjson.gz")
+            with gzip.open(path, "wb") as f:
+                f.write("".join(new).encode("utf-8"))
+            self._load(self.table_id, path)
+            os.remove(path)
+        self._checkpoint(chunk_id, len(new))
+        return chunk_id, len(new), len(lines) - len(new), False
+
+    def load(self, rows):
+        """
+        Loads an iterable of row tuples or dicts; returns a summary
+        """
+        summary = {"chunks": 0, "skipped": 0, "rows": 0, "duplicates": 0}
+
+        def collect(future):
+            # Re-raises the first failed chunk; committed ones stay
+            # checkpointed for the next run
+            _, count, duplicates, skipped = future.result()
+            summary["chunks"] += 1
+            summary["skipped"] += int(skipped)
+            summary["rows"] += count
+            summary["duplicates"] += duplicates
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = []
+            for index, lines in enumerate(self._chunks(rows)):
+                pending.append(executor.submit(self._write_chunk, index, lines))
+                # Bound the number of chunks held in memory
+                while len(pending) > self.workers * 2:
+                    collect(pending.pop(0))
+            for future in pending:
+                collect(future)
+        return summary
@@ -0,0 +1,154 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import gzip
+import hashlib
+import os
+import threading
+from urllib.parse import urlparse
+
+# Where oversized payloads are stored, e.g. gs://bucket/claims or
+# file:///tmp/claims; claim checks are disabled when unset. Parsers only
+# read references inside it, so they need the same setting.
+CLAIM_CHECK_URL = os.environ.get("CLAIM_CHECK_URL")
+# Payloads above this many bytes are replaced by a reference
+CLAIM_CHECK_THRESHOLD = int(os.environ.get("CLAIM_CHECK_THRESHOLD", 512 * 1024))
+
+# Pub/Sub attributes of a message whose body was checked in
+REFERENCE_ATTRIBUTE = "claim_check"
+ENCODING_ATTRIBUTE = "claim_check_encoding"
+
+
+class FileStore(object):
+    """
+    Keeps payloads as files under a local directory, for tests and
+    local runs
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def put(self, key, data):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so a reader never sees a partial object
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return "file://" + os.path.abspath(path)
+
+    def contains(self, reference):
+        parsed = urlparse(reference)
+        if parsed.scheme != "file" or parsed.netloc:
+            return False
+        # Resolved, so neither ".." nor a symlink leads out of the root
+        root = os.path.realpath(self.root)
+        return os.path.commonpath(
+            [root, os.path.realpath(parsed.path)]
+        ) == root
+
+    def get(self, reference):
+        with open(urlparse(reference).path, "rb") as f:
+            return f.read()
+
+
+class GCSStore(object):
+    """
+    Keeps payloads as objects in a Cloud Storage bucket
+    """
+
+    def __init__(self, bucket, prefix=""):
+        self.bucket_name = bucket
+        self.prefix = prefix.strip("/")
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _bucket(self):
+        # Imported here so only deployments using GCS need the library
+        from google.cloud import storage
+
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                self._client = storage.Client()
+                self._pid = os.getpid()
+            return self._client.bucket(self.bucket_name)
+
+    def put(self, key, data):
+        name = "/".join(part for part in (self.prefix, key) if part)
+        self._bucket().blob(name).upload_from_string(
+            data, content_type="application/gzip"
+        )
+        return "gs://%s/%s" % (self.bucket_name, name)
+
+    def contains(self, reference):
+        parsed = urlparse(reference)
+        name = parsed.path.lstrip("/")
+        return (parsed.scheme == "gs" and parsed.netloc == self.bucket_name and
+                (not self.prefix or name.startswith(self.prefix + "/")))
+
+    def get(self, reference):
+        name = urlparse(reference).path.lstrip("/")
+        return self._bucket().blob(name).download_as_string()
+
+
+def store_for(url):
+    """
+    Returns the store for a gs:// or file:// URL
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "gs":
+        return GCSStore(parsed.netloc, parsed.path)
+    if parsed.scheme == "file":
+        return FileStore(parsed.path)
+    raise ValueError("Unsupported claim check store: %s" % url)
+
+
+_store = store_for(CLAIM_CHECK_URL) if CLAIM_CHECK_URL else None
+
+
+def enabled():
+    return _store is not None
+
+
+def check_in(data, store=None):
+    """
+    Stores the gzipped payload; returns the Pub/Sub attributes that
+    replace it
+    """
+    store = store or _store
+    # Content-addressed, so redeliveries reuse the same object
+    key = hashlib.sha256(data).hexdigest() + ".gz"
+    reference = store.put(key, gzip.compress(data))
+    return {REFERENCE_ATTRIBUTE: reference, ENCODING_ATTRIBUTE: "gzip"}
+
+
+def check_out(attributes, store=None):
+    """
+    Returns the payload a message refers to, or None if it carries its
+    payload inline. Raises ValueError for a reference outside the store,
+    which a forged message could otherwise use to read any file or object.
+    """
+    reference = (attributes or {}).get(REFERENCE_ATTRIBUTE)
+    if not reference:
+        return None
+    store = store or _store
+    if store is None:
+        raise ValueError("Claim check received, but CLAIM_CHECK_URL is unset")
+    if not store.contains(reference):
+        raise ValueError("Claim check outside the store: %s" % reference)
+    data = store.get(reference)
+    if attributes.get(ENCODING_ATTRIBUTE) == "gzip":
+        data = gzip.decompress(data)
+    return data
@@ -0,0 +1,143 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import threading
+import time
+
+from google.cloud import bigquery
+
+from shared import metrics
+
+# How long a resolved table handle (and its schema) is trusted before
+# it is fetched again from the BigQuery API
+TABLE_CACHE_TTL = float(os.environ.get("BQ_TABLE_CACHE_TTL", 300))
+
+
+class BigQueryCache(object):
+    """
+    Process-wide BigQuery client and table-handle cache.
+
+    The client is created lazily on first use, and table handles are kept
+    for `ttl` seconds. The cache is reset in forked children so every
+    gunicorn worker builds its own client.
+    """
+
+    def __init__(self, ttl=TABLE_CACHE_TTL, client_factory=None, clock=None):
+        self.ttl = ttl
+        self._client_factory = client_factory or bigquery.Client
+        self._clock = clock or time.monotonic
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Drops the client, every cached table and the counters
+        """
+        # A lock held by another thread at fork time is never released
+        # in the child, so always start over with a fresh one.
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._client = None
+        self._tables = {}
+        self._stats = {"hits": 0, "misses": 0, "refreshes": 0, "clients": 0}
+
+    def _check_pid(self):
+        # Covers forks that happened without running the at-fork hooks
+        if self._pid != os.getpid():
+            self.reset()
+
+    def client(self):
+        """
+        Returns the BigQuery client for this process, creating it if needed
+        """
+        self._check_pid()
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._client_factory()
+                    self._stats["clients"] += 1
+        return self._client
+
+    def get_table(self, dataset_id, table_id):
+        """
+        Returns the table handle, fetching it if missing or expired
+        """
+        client = self.client()
+        key = (dataset_id, table_id)
+        with self._lock:
+            cached = self._tables.get(key)
+            now = self._clock()
+            if cached and now < cached[1]:
+                self._stats["hits"] += 1
+                return cached[0]
+
+            self._stats["misses"] += 1
+            if cached:
+                self._stats["refreshes"] += 1
+            table_ref = client.dataset(dataset_id).table(table_id)
+            table = client.get_table(table_ref)
+            self._tables[key] = (table, now + self.ttl)
+            return table
+
+    def get_schema(self, dataset_id, table_id):
+        """
+        Returns the cached schema of the table
+        """
+        return self.get_table(dataset_id, table_id).schema
+
+    def invalidate(self, dataset_id=None, table_id=None):
+        """
+        Forgets one table, or every table if no table is given
+        """
+        with self._lock:
+            if dataset_id is None:
+                self._tables.clear()
+            else:
+                self._tables.pop((dataset_id, table_id), None)
+
+    def stats(self):
+        """
+        Returns a copy of the hit/miss counters
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["tables"] = len(self._tables)
+        return stats
+
+
+_cache = BigQueryCache()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: _cache.reset())
+
+
+def get_client():
+    return _cache.client()
+
+
+def get_table(dataset_id, table_id):
+    with metrics.timed("get_table"):
+        return _cache.get_table(dataset_id, table_id)
+
+
+def get_schema(dataset_id, table_id):
+    return _cache.get_schema(dataset_id, table_id)
+
+
+def invalidate_table(dataset_id=None, table_id=None):
+    _cache.invalidate(dataset_id, table_id)
+
+
+def cache_stats():
+    return _cache.stats()
@@ -0,0 +1,45 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Removes duplicate events_raw rows that slipped past the streaming insert IDs.
+
+The terraform module runs the same statements as a BigQuery scheduled
+query, queries/compact_events_raw.sql. Elsewhere, run periodically, e.g.
+as a Cloud Run job or cron, with:
+
+    python -m shared.compaction
+"""
+import json
+import os
+
+from shared.sinks import get_sink
+
+# How many days back duplicates are looked for
+COMPACTION_DAYS = int(os.environ.get("COMPACTION_DAYS", 3))
+
+
+def compact_events_raw(days=COMPACTION_DAYS):
+    removed = get_sink().compact(days)
+    entry = {
+        "severity": "INFO",
+        "msg": "Compacted events_raw.",
+        "days": days,
+        "rows_affected": removed,
+    }
+    print(json.dumps(entry))
+    return removed
+
+
+if __name__ == "__main__":
+    compact_events_raw()
@@ -0,0 +1,170 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import base64
+from concurrent.futures import TimeoutError
+import json
+import os
+import threading
+
+import shared
+from shared.errors import RETRY_STATUS
+from shared.writer import BatchWriter
+
+# Flow control: messages and bytes leased but not yet acked
+PULL_MAX_MESSAGES = int(os.environ.get("PULL_MAX_MESSAGES", 1000))
+PULL_MAX_BYTES = int(os.environ.get("PULL_MAX_BYTES", 100 * 1024 * 1024))
+# A batch is written once it holds this many rows, or once its oldest row
+# has waited PULL_BATCH_LATENCY seconds
+PULL_BATCH_ROWS = int(os.environ.get("PULL_BATCH_ROWS", 500))
+PULL_BATCH_LATENCY = float(os.environ.get("PULL_BATCH_LATENCY", 1.0))
+
+
+def message_dict(message):
+    """
+    Returns a pulled message in the format of a pushed one, which is what
+    the process_*_event functions read
+    """
+    return {
+        "data": base64.b64encode(message.data).decode("utf-8"),
+        "attributes": dict(message.attributes),
+        "message_id": message.message_id,
+    }
+
+
+class BatchConsumer(object):
+    """
+    Streaming-pull subscriber writing events_raw rows in batches.
+
+    `process(msg)` turns a message, in the pushed format, into an
+    events_raw row. Rows go through a BatchWriter backed by
+    shared.insert_rows_into_bigquery. A message is acked only once its row
+    is committed and nacked if the write fails. Parse errors are handled
+    as in the push services: transient ones are nacked for redelivery,
+    anything else is dead-lettered or ignored, then acked. Flow control
+    bounds the messages in flight, so the batch never outgrows them.
+    """
+
+    def __init__(self, subscription, process, source,
+                 max_messages=PULL_MAX_MESSAGES, max_bytes=PULL_MAX_BYTES,
+                 batch_rows=PULL_BATCH_ROWS, batch_latency=PULL_BATCH_LATENCY,
+                 subscriber=None, insert=None):
+        self.subscription = subscription
+        self._process = process
+        self.source = source
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._subscriber = subscriber
+        self.writer = BatchWriter(
+            insert or shared.insert_rows_into_bigquery,
+            max_rows=min(batch_rows, max_messages),
+            max_bytes=max_bytes,
+            max_latency=batch_latency,
+        )
+        self._lock = threading.Lock()
+        self._stats = {"received": 0, "acked": 0, "nacked": 0}
+        self._streaming = None
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _ack(self, message):
+        message.ack()
+        self._count("acked")
+
+    def _nack(self, message):
+        message.nack()
+        self._count("nacked")
+
+    def callback(self, message):
+        """
+        Parses one message and queues its row; runs on the subscriber's
+        callback threads
+        """
+        self._count("received")
+        shared.record_request()
+        msg = message_dict(message)
+        event = None
+        try:
+            with shared.timed("process", self.source):
+                event = self._process(msg)
+            if not event:
+                raise Exception("No data to insert")
+        except Exception as e:
+            entry = {
+                "severity": "WARNING",
+                "msg": "Data not saved to BigQuery",
+                "errors": str(e),
+                "json_payload": msg,
+            }
+            print(json.dumps(entry))
+            envelope = {"message": msg, "subscription": self.subscription}
+            response = shared.handle_error(e, envelope, self.source, event)
+            if response[1] == RETRY_STATUS:
+                self._nack(message)
+            else:
+                self._ack(message)
+            return
+
+        future = self.writer.submit(event, context=msg, key=event["signature"])
+        future.add_done_callback(
+            lambda f: self._ack(message) if not f.result()
+            else self._nack(message)
+        )
+
+    def run(self, timeout=None):
+        """
+        Pulls until `timeout` seconds pass, the stream fails or `stop` is
+        called, then writes what is left
+        """
+        subscriber = self._subscriber
+        if subscriber is None:
+            # Imported here so push-only deployments do not need it
+            from google.cloud import pubsub_v1
+
+            subscriber = pubsub_v1.SubscriberClient()
+        from google.cloud.pubsub_v1.types import FlowControl
+
+        self._streaming = subscriber.subscribe(
+            self.subscription,
+            callback=self.callback,
+            flow_control=FlowControl(
+                max_messages=self.max_messages, max_bytes=self.max_bytes
+            ),
+        )
+        try:
+            self._streaming.result(timeout=timeout)
+        except TimeoutError:
+            pass
+        except Exception as e:
+            print(json.dumps({
+                "severity": "WARNING",
+                "msg": "Streaming pull stopped.",
+                "errors": str(e),
+            }))
+        finally:
+            self.stop()
+
+    def stop(self):
+        # Acks sent after the stream is cancelled may be lost; those
+        # messages are redelivered and dropped by the signature dedup
+        if self._streaming is not None:
+            self._streaming.cancel()
+        self.writer.close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["writer"] = self.writer.stats()
+        return stats
@@ -0,0 +1,234 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from collections import OrderedDict
+import hashlib
+import json
+import math
+import os
+import threading
+
+# Number of signatures the Bloom filter is sized for
+DEDUP_CAPACITY = int(os.environ.get("DEDUP_CAPACITY", 1000000))
+# Target false-positive rate of the Bloom filter at full capacity
+DEDUP_ERROR_RATE = float(os.environ.get("DEDUP_ERROR_RATE", 0.001))
+# Number of recently confirmed signatures kept exactly
+DEDUP_LRU_SIZE = int(os.environ.get("DEDUP_LRU_SIZE", 10000))
+# How many days of events_raw are loaded into the filter on first use.
+# Set to 0 to skip warm-up; the filter then only knows this process's writes.
+DEDUP_WARMUP_DAYS = int(os.environ.get("DEDUP_WARMUP_DAYS", 7))
+
+WARMUP_SQL = (
+    "SELECT signature FROM four_keys.events_raw "
+    "WHERE time_created >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL %d DAY)"
+)
+# events_enriched has no time of its own; its rows are bounded by the
+# events_raw rows they enrich
+ENRICHED_WARMUP_SQL = (
+    "SELECT events_raw_signature AS signature FROM four_keys.events_enriched "
+    "WHERE events_raw_signature IN (SELECT signature FROM four_keys.events_raw "
+    "WHERE time_created >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL %d DAY))"
+)
+
+
+class BloomFilter(object):
+    """
+    Fixed-size Bloom filter over string keys
+    """
+
+    def __init__(self, capacity, error_rate):
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        capacity = max(int(capacity), 1)
+        bits = -capacity * math.log(error_rate) / (math.log(2) ** 2)
+        self.size = max(int(math.ceil(bits)), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing: derive every probe from two 64-bit halves
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(
+            self._bits[pos >> 3] & (1 << (pos & 7))
+            for pos in self._positions(key)
+        )
+
+
+class SignatureIndex(object):
+    """
+    Local index of event signatures already written to events_raw.
+
+    A Bloom filter answers "definitely new" without leaving the process.
+    Only probable hits that are not in the exact LRU are confirmed against
+    the authoritative store, `exists(signature)`. The filter is seeded from
+    the last DEDUP_WARMUP_DAYS of events_raw, which covers the Pub/Sub
+    redelivery window.
+    """
+
+    def __init__(self, exists, capacity=DEDUP_CAPACITY,
+                 error_rate=DEDUP_ERROR_RATE, lru_size=DEDUP_LRU_SIZE,
+                 warmup=None, existing=None):
+        self._exists = exists
+        # Optional batched form of `exists`, returning the stored subset
+        self._existing = existing
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._lru_size = lru_size
+        self._warmup = warmup
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._bloom = BloomFilter(self._capacity, self._error_rate)
+        self._recent = OrderedDict()
+        self._warmed = self._warmup is None
+        # Whether a Bloom filter miss can be trusted as "new"
+        self._trusted = True
+        self._stats = {"checks": 0, "new": 0, "lru_hits": 0,
+                       "store_checks": 0, "false_positives": 0,
+                       "duplicates": 0, "warmed": 0}
+
+    def _ensure_ready(self):
+        if self._pid != os.getpid():
+            self.reset()
+        if self._warmed:
+            return
+        with self._lock:
+            if self._warmed:
+                return
+            try:
+                count = 0
+                for signature in self._warmup():
+                    self._bloom.add(signature)
+                    count += 1
+                self._stats["warmed"] = count
+            except Exception as e:
+                # Without warm-up every probe falls back to the store
+                # on a miss, so treat it as not loaded and stay correct.
+                entry = {
+                    "severity": "WARNING",
+                    "msg": "Dedup index warm-up failed.",
+                    "errors": str(e),
+                }
+                print(json.dumps(entry))
+                self._trusted = False
+            self._warmed = True
+
+    def is_unique(self, signature):
+        """
+        Returns True if the signature has not been written yet
+        """
+        self._ensure_ready()
+        with self._lock:
+            self._stats["checks"] += 1
+            if signature in self._recent:
+                self._recent.move_to_end(signature)
+                self._stats["lru_hits"] += 1
+                self._stats["duplicates"] += 1
+                return False
+            probable = signature in self._bloom or not self._trusted
+
+        if not probable:
+            with self._lock:
+                self._stats["new"] += 1
+            return True
+
+        exists = self._exists(signature)
+        with self._lock:
+            self._stats["store_checks"] += 1
+            if exists:
+                self._stats["duplicates"] += 1
+                self._remember(signature)
+            else:
+                self._stats["new"] += 1
+                if self._trusted:
+                    self._stats["false_positives"] += 1
+        return not exists
+
+    def unique(self, signatures):
+        """
+        Returns the signatures that have not been written yet, confirming
+        every probable hit with a single batched store lookup
+        """
+        self._ensure_ready()
+        new = []
+        probable = []
+        with self._lock:
+            for signature in signatures:
+                self._stats["checks"] += 1
+                if signature in self._recent:
+                    self._recent.move_to_end(signature)
+                    self._stats["lru_hits"] += 1
+                    self._stats["duplicates"] += 1
+                elif signature in self._bloom or not self._trusted:
+                    probable.append(signature)
+                else:
+                    new.append(signature)
+            self._stats["new"] += len(new)
+
+        if probable:
+            if self._existing:
+                stored = set(self._existing(probable))
+            else:
+                stored = {s for s in probable if self._exists(s)}
+            with self._lock:
+                self._stats["store_checks"] += 1 if self._existing else len(probable)
+                for signature in probable:
+                    if signature in stored:
+                        self._stats["duplicates"] += 1
+                        self._remember(signature)
+                    else:
+                        self._stats["new"] += 1
+                        if self._trusted:
+                            self._stats["false_positives"] += 1
+                        new.append(signature)
+        return new
+
+    def add(self, signature):
+        """
+        Records a signature that has just been written
+        """
+        with self._lock:
+            self._bloom.add(signature)
+            self._remember(signature)
+
+    def _remember(self, signature):
+        self._recent[signature] = True
+        self._recent.move_to_end(signature)
+        while len(self._recent) > self._lru_size:
+            self._recent.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+def recent_signatures(client, days=DEDUP_WARMUP_DAYS, sql=WARMUP_SQL):
+    """
+    Yields the signatures written to events_raw in the last `days` days,
+    or those selected by another warm-up `sql`
+    """
+    query_job = client.query(sql % days)
+    for row in query_job.result():
+        yield row["signature"]
@@ -0,0 +1,102 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import base64
+import gzip
+import json
+
+from shared import claim_check
+
+# Pub/Sub message format between the event-handler and the parsers.
+#
+# Version 1 carries every request header as one JSON "headers" attribute.
+# Version 2 is marked by envelope="2" and carries only the headers the
+# source's parser reads, each as an attribute of its own, so routing a
+# message needs no JSON decoding. Its data may be gzipped, flagged by
+# content_encoding="gzip". The decoders below read both versions.
+VERSION_ATTRIBUTE = "envelope"
+ENCODING_ATTRIBUTE = "content_encoding"
+RESERVED_ATTRIBUTES = frozenset({
+    VERSION_ATTRIBUTE,
+    ENCODING_ATTRIBUTE,
+    claim_check.REFERENCE_ATTRIBUTE,
+    claim_check.ENCODING_ATTRIBUTE,
+})
+
+
+def select_headers(headers, names):
+    """
+    Returns the headers listed in `names`; a name ending in "*" matches
+    every header with that prefix, case-insensitively
+    """
+    prefixes = tuple(n[:-1].lower() for n in names if n.endswith("*"))
+    exact = {n.lower() for n in names if not n.endswith("*")}
+    return {
+        name: value for name, value in headers.items()
+        if name.lower() in exact or
+        (prefixes and name.lower().startswith(prefixes))
+    }
+
+
+def encode(data, headers, version=1, forward=None, compress_threshold=0):
+    """
+    Returns the message data and attributes for a webhook payload.
+
+    `forward` lists the headers kept in version 2; None keeps them all.
+    Data larger than `compress_threshold` bytes is gzipped in version 2.
+    """
+    if int(version) < 2:
+        return data, {"headers": json.dumps(headers)}
+
+    attributes = dict(headers if forward is None
+                      else select_headers(headers, forward))
+    for name in RESERVED_ATTRIBUTES:
+        attributes.pop(name, None)
+    attributes[VERSION_ATTRIBUTE] = "2"
+    if compress_threshold and len(data) > compress_threshold:
+        data = gzip.compress(data)
+        attributes[ENCODING_ATTRIBUTE] = "gzip"
+    return data, attributes
+
+
+def version(msg):
+    attributes = msg.get("attributes") or {}
+    return int(attributes.get(VERSION_ATTRIBUTE, 1))
+
+
+def decode_headers(msg):
+    """
+    Returns the webhook headers of a pushed Pub/Sub message, or an empty
+    dict if it has none
+    """
+    attributes = msg.get("attributes") or {}
+    if VERSION_ATTRIBUTE in attributes:
+        return {name: value for name, value in attributes.items()
+                if name not in RESERVED_ATTRIBUTES}
+    if "headers" in attributes:
+        return json.loads(attributes["headers"])
+    return {}
+
+
+def decode_data(msg):
+    """
+    Returns the webhook body of a pushed Pub/Sub message as bytes
+    """
+    attributes = msg.get("attributes") or {}
+    data = claim_check.check_out(attributes)
+    if data is not None:
+        return data
+    data = base64.b64decode(msg.get("data") or b"")
+    if attributes.get(ENCODING_ATTRIBUTE) == "gzip":
+        data = gzip.decompress(data)
+    return data
@@ -0,0 +1,240 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import concurrent.futures
+from datetime import datetime, timezone
+import json
+import os
+import random
+import threading
+import time
+
+from google.api_core import exceptions as api_exceptions
+
+# Share of requests that may additionally be retried, e.g. 0.2 lets 20%
+# of the traffic come back as retries before failures are dead-lettered
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", 0.2))
+# Retries always allowed per second, so a quiet instance can still retry
+RETRY_BUDGET_MIN_PER_SECOND = float(
+    os.environ.get("RETRY_BUDGET_MIN_PER_SECOND", 1)
+)
+RETRY_BACKOFF_BASE = float(os.environ.get("RETRY_BACKOFF_BASE", 10))
+RETRY_BACKOFF_MAX = float(os.environ.get("RETRY_BACKOFF_MAX", 600))
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+# Expected rejections, e.g. the pagerduty-parser's Warning for event types
+# it does not track; acknowledged without dead-lettering
+IGNORED = "ignored"
+
+# Status returned for transient failures; Pub/Sub push redelivers on any
+# non-2xx response and applies the subscription's retry policy
+RETRY_STATUS = 503
+
+TRANSIENT_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.TooManyRequests,
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.Aborted,
+    api_exceptions.RetryError,
+    ConnectionError,
+    TimeoutError,
+    # Not a TimeoutError before Python 3.11; raised waiting for a write
+    concurrent.futures.TimeoutError,
+)
+
+# Per-row insert error reasons that BigQuery reports for failures on its
+# side; anything else, e.g. "invalid", fails again on every retry
+TRANSIENT_REASONS = (
+    "backendError",
+    "internalError",
+    "rateLimitExceeded",
+    "quotaExceeded",
+    "timeout",
+)
+
+
+class TransientError(Exception):
+    """
+    A failure worth retrying, e.g. a BigQuery outage
+    """
+
+
+class PermanentError(Exception):
+    """
+    A failure that will happen again on every retry, e.g. a bad payload
+    """
+
+
+def insert_error(row_errors):
+    """
+    Returns the exception for rows rejected by `insert_rows`
+
+    `row_errors` is in the `client.insert_rows` format; the rows are
+    retried if any of their errors has a transient reason.
+    """
+    message = "Row not inserted: %s" % json.dumps(row_errors, default=str)
+    reasons = [
+        error.get("reason")
+        for row in row_errors
+        for error in row.get("errors", [])
+        if isinstance(error, dict)
+    ]
+    if any(reason in TRANSIENT_REASONS for reason in reasons):
+        return TransientError(message)
+    return PermanentError(message)
+
+
+def classify(error):
+    """
+    Returns TRANSIENT, PERMANENT or IGNORED for an exception
+    """
+    if isinstance(error, Warning):
+        return IGNORED
+    if isinstance(error, PermanentError):
+        return PERMANENT
+    if isinstance(error, (TransientError,) + TRANSIENT_ERRORS):
+        return TRANSIENT
+    # Quota errors surface as 403 in BigQuery
+    if isinstance(error, api_exceptions.Forbidden) and any(
+        e.get("reason") in ("rateLimitExceeded", "quotaExceeded")
+        for e in getattr(error, "errors", None) or []
+    ):
+        return TRANSIENT
+    return PERMANENT
+
+
+class RetryBudget(object):
+    """
+    Caps retries to a share of the requests seen by this instance.
+
+    Every request deposits `ratio` tokens and every retry withdraws one,
+    on top of `min_per_second` tokens that refill over time. This keeps a
+    dependency outage from turning into a retry storm.
+    """
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO,
+                 min_per_second=RETRY_BUDGET_MIN_PER_SECOND, clock=None):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self._clock = clock or time.monotonic
+        self._lock = threading.Lock()
+        # Enough for ten seconds of the minimum rate
+        self._cap = max(10 * min_per_second, 10)
+        self._tokens = self._cap
+        self._last = self._clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(
+            self._cap, self._tokens + (now - self._last) * self.min_per_second
+        )
+        self._last = now
+
+    def record_request(self):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._cap, self._tokens + self.ratio)
+
+    def try_retry(self):
+        """
+        Withdraws a retry; False once the budget is exhausted
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+def backoff_hint(attempt, base=RETRY_BACKOFF_BASE, maximum=RETRY_BACKOFF_MAX):
+    """
+    Full-jitter exponential backoff, in whole seconds
+    """
+    return int(random.uniform(0, min(maximum, base * 2 ** max(attempt - 1, 0))))
+
+
+def delivery_attempt(envelope):
+    # Only set when the subscription has a dead-letter policy
+    try:
+        return int(envelope.get("deliveryAttempt") or 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+class ErrorHandler(object):
+    """
+    Turns a parser failure into the response returned to Pub/Sub.
+
+    Transient failures are answered with RETRY_STATUS while the retry
+    budget lasts. Permanent failures, and transient ones once the budget is
+    spent, are written to the dead-letter table with the original envelope
+    and acknowledged.
+    """
+
+    def __init__(self, dead_letter, budget=None):
+        self._dead_letter = dead_letter
+        self.budget = budget or RetryBudget()
+        self._lock = threading.Lock()
+        self._stats = {"retried": 0, "dead_lettered": 0,
+                       TRANSIENT: 0, PERMANENT: 0, IGNORED: 0}
+
+    def record_request(self):
+        self.budget.record_request()
+
+    def handle(self, error, envelope, source):
+        kind = classify(error)
+        with self._lock:
+            self._stats[kind] += 1
+
+        if kind == TRANSIENT and self.budget.try_retry():
+            with self._lock:
+                self._stats["retried"] += 1
+            retry_after = backoff_hint(delivery_attempt(envelope))
+            return "", RETRY_STATUS, {"Retry-After": str(retry_after)}
+
+        if kind != IGNORED:
+            self.dead_letter(error, kind, envelope, source)
+        return "", 204
+
+    def dead_letter(self, error, kind, envelope, source):
+        row = (
+            source,
+            kind,
+            "%s: %s" % (type(error).__name__, error),
+            json.dumps(envelope, default=str),
+            datetime.now(timezone.utc).isoformat(),
+        )
+        try:
+            errors = self._dead_letter([row])
+            if errors:
+                raise Exception(errors)
+            with self._lock:
+                self._stats["dead_lettered"] += 1
+        except Exception as e:
+            # Last resort: keep the envelope in the logs
+            entry = {
+                "severity": "ERROR",
+                "msg": "Dead-letter write failed.",
+                "errors": str(e),
+                "json_payload": envelope,
+            }
+            print(json.dumps(entry, default=str))
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
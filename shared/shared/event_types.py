@@ -0,0 +1,43 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Event types each parser turns into rows, by source. The event-handler
+# drops anything else before publishing; sources missing here are not
+# filtered.
+SUPPORTED_EVENT_TYPES = {
+    # X-Github-Event header
+    "github": frozenset({
+        "push", "pull_request", "pull_request_review",
+        "pull_request_review_comment", "issues", "issue_comment",
+        "check_run", "check_suite", "status", "deployment",
+        "deployment_status", "release", "workflow_run", "workflow_job",
+    }),
+    # object_kind of the body
+    "gitlab": frozenset({
+        "push", "merge_request", "note", "tag_push", "issue", "pipeline",
+        "job", "deployment", "build",
+    }),
+    # Circleci-Event-Type header
+    "circleci": frozenset({"workflow-completed", "job-completed"}),
+    # event.event_type of the body
+    "pagerduty": frozenset({"incident.triggered", "incident.resolved"}),
+}
+
+
+def is_supported(source, event_type):
+    """
+    Returns False for event types the source's parser would reject
+    """
+    types = SUPPORTED_EVENT_TYPES.get(source)
+    return types is None or event_type in types
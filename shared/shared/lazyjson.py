@@ -0,0 +1,203 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+from json.decoder import scanstring
+import re
+
+# Documents read by path, so parsers can pull out the few fields they
+# need. Both classes are indexed with a key or a tuple of keys and array
+# indexes, e.g. doc["head_commit", "id"], and raise KeyError for a
+# missing path; `dumps()` returns the document as JSON text.
+
+_WS = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+_AFTER_KEY = re.compile(r"[ \t\n\r]*:[ \t\n\r]*")
+_quoted = {}
+
+
+def _key_offsets(text, key, pos):
+    # Yields (separator, value) offsets for every place `key` is written as
+    # an object key. A quote preceded by "{" or "," cannot be inside a
+    # string, where quotes are escaped, so each one is a key of some object.
+    quoted = _quoted.get(key)
+    if quoted is None:
+        quoted = _quoted[key] = json.dumps(key, ensure_ascii=False)
+    pos = text.find(quoted, pos)
+    while pos != -1:
+        after = _AFTER_KEY.match(text, pos + len(quoted))
+        before = pos - 1
+        while before >= 0 and text[before] in " \t\n\r":
+            before -= 1
+        if after and before >= 0 and text[before] in "{,":
+            yield before, after.end()
+        pos = text.find(quoted, pos + 1)
+
+
+def _path(path):
+    return path if isinstance(path, tuple) else (path,)
+
+
+class ParsedJSON(object):
+    """
+    A fully decoded document
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __getitem__(self, path):
+        value = self.value
+        try:
+            for key in _path(path):
+                value = value[key]
+        except (KeyError, IndexError, TypeError):
+            raise KeyError(path)
+        return value
+
+    def get(self, *path, default=None):
+        try:
+            return self[path]
+        except KeyError:
+            return default
+
+    def dumps(self):
+        return json.dumps(self.value)
+
+    def __str__(self):
+        return self.dumps()
+
+
+class LazyJSON(object):
+    """
+    JSON text that is only decoded along the paths read from it.
+
+    A key is found by searching the text for where it is written as an
+    object key, and the members before it are then checked, in one pass
+    of the C decoder, to be complete values, which proves the key belongs
+    to the object being read and not to one nested in it. When that check
+    fails, members are stepped over one at a time up to the candidate.
+    Values after the last key read are never touched. `dumps()` returns
+    the original text untouched.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self._root = _WS.match(text, 0).end()
+        # Keys can only be missed by the search if some are escaped
+        self._escapes = "\\" in text
+        # Container offset -> [member offsets by key, offset up to which
+        # every member is recorded, or None once all of them are]
+        self._containers = {}
+        self._values = {}
+
+    def _scan(self, start, entry, stop=None, key=None):
+        # Records the members of the container at `start` one at a time,
+        # until `key` is found or the scan passes the offset `stop`
+        text = self.text
+        members, pos = entry
+        is_object = text[start] == "{"
+        while pos is not None:
+            pos = _WS.match(text, pos).end()
+            char = text[pos]
+            if char == ",":
+                pos = _WS.match(text, pos + 1).end()
+                char = text[pos]
+            if char in "}]":
+                pos = None
+                break
+            if is_object:
+                name, pos = scanstring(text, pos + 1)
+                # Skip the colon and the whitespace around it
+                pos = _WS.match(text, _WS.match(text, pos).end() + 1).end()
+            else:
+                name = len(members)
+            members.setdefault(name, pos)
+            # The C scanner steps over a value faster than a pure-Python
+            # scan could, even though it decodes what it skips
+            pos = _decoder.raw_decode(text, pos)[1]
+            if name == key or (stop is not None and pos > stop):
+                break
+        entry[1] = pos
+
+    def _search(self, start, entry, key):
+        # Jumps to `key` in the object at `start`; see the class docstring
+        text = self.text
+        members = entry[0]
+        for separator, value in _key_offsets(text, key, start):
+            if separator == start:
+                members[key] = value
+                return value
+            scanned = entry[1]
+            if scanned is None or separator < scanned:
+                # Direct members before here are all recorded
+                continue
+            # The members between must form a complete object body
+            body = text[scanned:separator].strip(" \t\n\r,")
+            try:
+                _decoder.decode("{%s}" % body)
+            except ValueError:
+                self._scan(start, entry, stop=separator)
+                if key in members:
+                    return members[key]
+                continue
+            members[key] = value
+            return value
+        return None
+
+    def _member(self, start, key):
+        # Returns the offset of the value under `key` in the container
+        # starting at `start`
+        entry = self._containers.get(start)
+        if entry is None:
+            entry = self._containers[start] = [{}, start + 1]
+        members = entry[0]
+        if key in members:
+            return members[key]
+
+        if self.text[start] == "{":
+            pos = self._search(start, entry, key)
+            if pos is not None:
+                return pos
+            if not self._escapes:
+                raise KeyError(key)
+        self._scan(start, entry, key=key)
+        if key in members:
+            return members[key]
+        raise KeyError(key)
+
+    def __getitem__(self, path):
+        pos = self._root
+        try:
+            for key in _path(path):
+                if self.text[pos] not in "{[" or \
+                        isinstance(key, int) != (self.text[pos] == "["):
+                    raise KeyError(key)
+                pos = self._member(pos, key)
+        except KeyError:
+            raise KeyError(path)
+        if pos not in self._values:
+            self._values[pos] = _decoder.raw_decode(self.text, pos)[0]
+        return self._values[pos]
+
+    def get(self, *path, default=None):
+        try:
+            return self[path]
+        except KeyError:
+            return default
+
+    def dumps(self):
+        return self.text
+
+    def __str__(self):
+        return self.text
@@ -0,0 +1,286 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from bisect import bisect_left
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true")
+
+# Seconds; sub-millisecond buckets cover decoding and the dedup index
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (n, _escape(v)) for n, v in pairs)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter(object):
+    """
+    Monotonic count per combination of label values
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Histogram(object):
+    """
+    Bucketed distribution per combination of label values
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts..., overflow count, sum]
+        self._values = {}
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, *labels):
+        with self._lock:
+            counts = self._values.get(labels)
+            return sum(counts[:-1]) if counts else 0
+
+    def samples(self):
+        with self._lock:
+            values = {labels: list(counts) for labels, counts in self._values.items()}
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield (self.name + "_bucket",
+                       _format_labels(self.labelnames, labels,
+                                      ("le", _format_value(bound))),
+                       cumulative)
+            yield (self.name + "_sum",
+                   _format_labels(self.labelnames, labels), counts[-1])
+            yield (self.name + "_count",
+                   _format_labels(self.labelnames, labels), cumulative)
+
+
+class Gauge(object):
+    """
+    Values read from a callback at scrape time, e.g. cache counters kept
+    elsewhere. `collect()` returns a dict of label value tuples to values.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._collect = collect
+
+    def reset(self):
+        pass
+
+    def samples(self):
+        for labels, value in sorted(self._collect().items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Registry(object):
+    """
+    The metrics of this process, rendered in the Prometheus text format.
+
+    Every gunicorn worker keeps its own registry; metrics are reset in
+    forked children so a worker never reports its parent's counts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=LATENCY_BUCKETS):
+        return self.register(
+            Histogram(name, documentation, labelnames, buckets)
+        )
+
+    def gauge(self, name, documentation, labelnames, collect):
+        return self.register(Gauge(name, documentation, labelnames, collect))
+
+    def reset(self):
+        with self._lock:
+            for metric in self._metrics:
+                metric.reset()
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.documentation))
+            lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+            try:
+                for name, labels, value in metric.samples():
+                    lines.append("%s%s %s" % (name, labels, _format_value(value)))
+            except Exception as e:
+                # A failing callback must not break the whole scrape
+                lines.append("# %s unavailable: %s" % (metric.name, e))
+        return "\n".join(lines) + "\n"
+
+
+class _Timer(object):
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+class _NoTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_TIMER = _NoTimer()
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "fourkeys_stage_seconds",
+    "Time spent in each stage of handling a message.",
+    ("stage", "source", "event_type"),
+)
+BATCH_ROWS = registry.histogram(
+    "fourkeys_insert_batch_rows",
+    "Rows per insert call.",
+    ("table",),
+    buckets=BATCH_BUCKETS,
+)
+DEDUP_RESULTS = registry.counter(
+    "fourkeys_dedup_total",
+    "Signature checks by result (new or duplicate).",
+    ("table", "source", "event_type", "result"),
+)
+ERRORS = registry.counter(
+    "fourkeys_errors_total",
+    "Failed messages by error class.",
+    ("source", "event_type", "kind"),
+)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: registry.reset())
+
+
+def timed(stage, source="", event_type=""):
+    """
+    Context manager recording the duration of a stage
+    """
+    if not METRICS_ENABLED:
+        return _NO_TIMER
+    return _Timer(STAGE_SECONDS, (stage, source, event_type or ""))
+
+
+def observe_batch(table_id, rows):
+    if METRICS_ENABLED:
+        BATCH_ROWS.observe(rows, table_id)
+
+
+def count_dedup(table_id, source, event_type, unique):
+    if METRICS_ENABLED:
+        DEDUP_RESULTS.inc(table_id, source or "", event_type or "",
+                          "new" if unique else "duplicate")
+
+
+def count_error(source, event_type, kind):
+    if METRICS_ENABLED:
+        ERRORS.inc(source or "", event_type or "", kind)
+
+
+def render():
+    return registry.render()
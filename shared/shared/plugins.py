@@ -0,0 +1,157 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import importlib.util
+import os
+import threading
+
+from shared import envelope
+
+# How a parser's process function is called
+HEADERS = "headers"        # process(headers, msg)
+ATTRIBUTES = "attributes"  # process(attributes, msg)
+MESSAGE = "message"        # process(msg)
+
+
+class Plugin(object):
+    """
+    A bq-workers parser: the `function` defined in `directory`/main.py.
+
+    Messages are routed to it by subscription name, by any of its
+    `attributes` or by any of its webhook `headers`.
+    """
+
+    def __init__(self, name, directory, function, call=HEADERS,
+                 subscriptions=(), attributes=(), headers=()):
+        self.name = name
+        self.directory = directory
+        self.function = function
+        self.call = call
+        self.subscriptions = tuple(subscriptions) or (name,)
+        self.attributes = tuple(attributes)
+        self.headers = tuple(h.lower() for h in headers)
+
+
+class PluginRegistry(object):
+    """
+    Parsers by source, imported the first time a message is routed to
+    them, so a service only loads the parsers it actually receives
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._plugins = {}
+        self._subscriptions = {}
+        self._modules = {}
+        self._lock = threading.Lock()
+
+    def register(self, plugin):
+        self._plugins[plugin.name] = plugin
+        for subscription in plugin.subscriptions:
+            self._subscriptions[subscription] = plugin.name
+
+    def __contains__(self, name):
+        return name in self._plugins
+
+    def names(self):
+        return list(self._plugins)
+
+    def loaded(self):
+        return list(self._modules)
+
+    def route(self, push_envelope):
+        """
+        Returns the plugin name for a pushed Pub/Sub envelope, or None
+        """
+        # "projects/<project>/subscriptions/<name>"
+        subscription = (push_envelope.get("subscription") or "").split("/")[-1]
+        name = self._subscriptions.get(subscription)
+        if name:
+            return name
+        return self.route_message(push_envelope.get("message") or {})
+
+    def route_message(self, msg):
+        attributes = msg.get("attributes") or {}
+        headers = None
+        for plugin in self._plugins.values():
+            if any(a in attributes for a in plugin.attributes):
+                return plugin.name
+            if plugin.headers:
+                if headers is None:
+                    headers = {h.lower() for h in envelope.decode_headers(msg)}
+                if any(h in headers for h in plugin.headers):
+                    return plugin.name
+        return None
+
+    def _module(self, directory):
+        module = self._modules.get(directory)
+        if module is None:
+            with self._lock:
+                module = self._modules.get(directory)
+                if module is None:
+                    path = os.path.join(self.root, directory, "main.py")
+                    spec = importlib.util.spec_from_file_location(
+                        directory.replace("-", "_"), path
+                    )
+                    module = importlib.util.module_from_spec(spec)
+                    spec.loader.exec_module(module)
+                    self._modules[directory] = module
+        return module
+
+    def function(self, name):
+        """
+        Returns a plugin's parser function, importing its module
+        """
+        plugin = self._plugins[name]
+        return getattr(self._module(plugin.directory), plugin.function)
+
+    def process(self, name, msg, headers=None):
+        """
+        Returns the events_raw row a plugin makes of a Pub/Sub message;
+        `headers` saves decoding them again when the caller has them
+        """
+        plugin = self._plugins[name]
+        process = self.function(name)
+        if plugin.call == HEADERS:
+            if headers is None:
+                headers = envelope.decode_headers(msg)
+            return process(headers, msg)
+        if plugin.call == ATTRIBUTES:
+            return process(msg.get("attributes") or {}, msg)
+        return process(msg)
+
+
+def default_registry(root):
+    """
+    Returns a registry of the parsers under bq-workers/, found at `root`
+    """
+    registry = PluginRegistry(root)
+    for plugin in (
+        Plugin("github", "github-parser", "process_github_event",
+               headers=("X-Github-Event",)),
+        Plugin("gitlab", "gitlab-parser", "process_gitlab_event",
+               headers=("X-Gitlab-Event",)),
+        Plugin("circleci", "circleci-parser", "process_circleci_event",
+               headers=("Circleci-Event-Type",)),
+        Plugin("tekton", "tekton-parser", "process_tekton_event",
+               headers=("Ce-Type",)),
+        Plugin("pagerduty", "pagerduty-parser", "process_pagerduty_event",
+               call=MESSAGE, headers=("X-Pagerduty-Signature",)),
+        Plugin("cloud_build", "cloud-build-parser", "process_cloud_build_event",
+               call=ATTRIBUTES, subscriptions=("cloudbuild", "cloud-builds"),
+               attributes=("buildId",)),
+        Plugin("argocd", "argocd-parser", "process_argocd_event",
+               call=MESSAGE),
+    ):
+        registry.register(plugin)
+    return registry
@@ -0,0 +1,579 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import abc
+from datetime import datetime
+import gzip
+import json
+import os
+import re
+import sqlite3
+import threading
+
+from google.cloud import bigquery
+
+from shared.clients import get_client, get_table
+from shared.dedup import ENRICHED_WARMUP_SQL, recent_signatures
+from shared.timestamps import CANONICAL_FORMAT
+
+# Where events are written: "bigquery", "sqlite" or "ndjson"
+EVENTS_SINK = os.environ.get("EVENTS_SINK", "bigquery")
+# File (sqlite) or directory (ndjson) used by the local sinks
+EVENTS_SINK_PATH = os.environ.get("EVENTS_SINK_PATH")
+
+DATASET_ID = "four_keys"
+
+# Set by the sinks as rows are written, unlike time_created, which is
+# when the event happened and can be far older for redeliveries and
+# backfills
+INSERTED_COLUMN = "time_inserted"
+
+# SQLite allows at most 999 bound variables before version 3.32
+SQLITE_MAX_VARIABLES = 999
+
+# Rows streamed more recently than this may still be in the BigQuery
+# streaming buffer, where DML cannot touch them
+COMPACTION_SETTLE_MINUTES = 90
+
+# Keeps one row per duplicated signature among the rows written over the
+# recent window. Rows without an insertion time were written by load
+# jobs, or before the column existed, and are settled.
+COMPACTION_SQL = """
+BEGIN TRANSACTION;
+
+CREATE TEMP TABLE duplicates AS
+SELECT kept.*
+FROM (
+  SELECT ARRAY_AGG(e ORDER BY e.msg_id LIMIT 1)[OFFSET(0)] AS kept
+  FROM {dataset}.events_raw e
+  WHERE e.time_created >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {days} DAY)
+    AND (e.time_inserted IS NULL OR
+         e.time_inserted < TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {settle} MINUTE))
+  GROUP BY e.signature
+  HAVING COUNT(*) > 1
+);
+
+DELETE FROM {dataset}.events_raw
+WHERE signature IN (SELECT signature FROM duplicates)
+  AND time_created >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {days} DAY)
+  AND (time_inserted IS NULL OR
+       time_inserted < TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {settle} MINUTE));
+
+INSERT INTO {dataset}.events_raw SELECT * FROM duplicates;
+
+COMMIT TRANSACTION;
+"""
+
+# Column order of the rows passed to insert_rows, as in setup/*_schema.json
+TABLE_COLUMNS = {
+    "events_raw": (
+        "event_type",
+        "id",
+        "metadata",
+        "time_created",
+        "signature",
+        "msg_id",
+        "source",
+        INSERTED_COLUMN,
+    ),
+    "events_enriched": (
+        "events_raw_signature",
+        "enriched_metadata",
+    ),
+    "events_dead_letter": (
+        "source",
+        "error_type",
+        "error",
+        "envelope",
+        "time_received",
+    ),
+}
+
+
+class EventSink(abc.ABC):
+    """
+    Destination for the rows written by the bq-workers.
+
+    `insert_rows` returns per-row errors in the `client.insert_rows` format,
+    `[{"index": i, "errors": [...]}]`. `row_ids` are insert IDs the sink may
+    use to drop retried rows.
+    """
+
+    name = None
+
+    @abc.abstractmethod
+    def insert_rows(self, table_id, rows, row_ids=None):
+        pass
+
+    @abc.abstractmethod
+    def exists(self, table_id, column, value):
+        pass
+
+    def existing(self, table_id, column, values):
+        """
+        Returns the subset of `values` already stored in `column`
+        """
+        return {value for value in values if self.exists(table_id, column, value)}
+
+    @abc.abstractmethod
+    def upsert(self, table_id, key, rows):
+        """
+        Inserts rows, replacing the stored row with the same `key` column
+        """
+
+    @abc.abstractmethod
+    def recent_signatures(self, days):
+        pass
+
+    @abc.abstractmethod
+    def recent_enriched_signatures(self, days):
+        """
+        Returns the events_enriched signatures of events_raw rows created
+        in the last `days` days
+        """
+
+    @abc.abstractmethod
+    def compact(self, days):
+        """
+        Removes duplicate events_raw rows written in the last `days` days
+        """
+
+    def load_file(self, table_id, path):
+        """
+        Loads a gzipped NDJSON file of rows keyed by column name
+        """
+        with gzip.open(path, "rt") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        errors = self.insert_rows(table_id, rows)
+        if errors:
+            raise Exception("Rows not loaded: %s" % errors)
+
+
+class BigQuerySink(EventSink):
+    """
+    Streams rows into the four_keys dataset in BigQuery
+    """
+
+    name = "bigquery"
+
+    def insert_rows(self, table_id, rows, row_ids=None):
+        table = get_table(DATASET_ID, table_id)
+        return get_client().insert_rows(
+            table, _stamped(table_id, rows), row_ids=row_ids
+        )
+
+    def exists(self, table_id, column, value):
+        sql = "SELECT %s FROM %s.%s WHERE %s = '%s'"
+        query_job = get_client().query(
+            sql % (column, DATASET_ID, table_id, column, value)
+        )
+        return query_job.result().total_rows > 0
+
+    def existing(self, table_id, column, values):
+        values = list(values)
+        if not values:
+            return set()
+        sql = "SELECT DISTINCT %s FROM %s.%s WHERE %s IN UNNEST(@values)" % (
+            column, DATASET_ID, table_id, column
+        )
+        job_config = bigquery.QueryJobConfig()
+        job_config.query_parameters = [
+            bigquery.ArrayQueryParameter("values", "STRING", values)
+        ]
+        query_job = get_client().query(sql, job_config=job_config)
+        return {row[0] for row in query_job.result()}
+
+    def upsert(self, table_id, key, rows):
+        # One MERGE per batch; every column of the upserted tables is a
+        # STRING. DML fails on rows still in the streaming buffer, so rows
+        # streamed in the last COMPACTION_SETTLE_MINUTES cannot be updated.
+        columns = TABLE_COLUMNS[table_id]
+        sql = (
+            "MERGE {dataset}.{table} t USING UNNEST(@rows) s "
+            "ON t.{key} = s.{key} "
+            "WHEN MATCHED THEN UPDATE SET {updates} "
+            "WHEN NOT MATCHED THEN INSERT ({columns}) VALUES ({values})"
+        ).format(
+            dataset=DATASET_ID, table=table_id, key=key,
+            updates=", ".join(
+                "%s = s.%s" % (c, c) for c in columns if c != key
+            ),
+            columns=", ".join(columns),
+            values=", ".join("s.%s" % c for c in columns),
+        )
+        job_config = bigquery.QueryJobConfig()
+        job_config.query_parameters = [
+            bigquery.ArrayQueryParameter("rows", "STRUCT", [
+                bigquery.StructQueryParameter(None, *[
+                    bigquery.ScalarQueryParameter(column, "STRING", value)
+                    for column, value in zip(columns, _row_values(columns, row))
+                ])
+                for row in rows
+            ])
+        ]
+        get_client().query(sql, job_config=job_config).result()
+
+    def recent_signatures(self, days):
+        return recent_signatures(get_client(), days)
+
+    def recent_enriched_signatures(self, days):
+        return recent_signatures(get_client(), days, ENRICHED_WARMUP_SQL)
+
+    def load_file(self, table_id, path):
+        job_config = bigquery.LoadJobConfig()
+        job_config.source_format = bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
+        job_config.write_disposition = bigquery.WriteDisposition.WRITE_APPEND
+        table = get_table(DATASET_ID, table_id)
+        job_config.schema = table.schema
+        with open(path, "rb") as f:
+            load_job = get_client().load_table_from_file(
+                f, table, job_config=job_config
+            )
+        # Raises if the load job failed
+        load_job.result()
+
+    def compact(self, days):
+        sql = COMPACTION_SQL.format(
+            dataset=DATASET_ID, days=int(days), settle=COMPACTION_SETTLE_MINUTES
+        )
+        query_job = get_client().query(sql)
+        query_job.result()
+        return query_job.num_dml_affected_rows
+
+
+def _json_extract(document, path):
+    # Supports the '$.a.b' paths used in queries/*.sql
+    if document is None:
+        return None
+    value = json.loads(document)
+    for key in path.lstrip("$").split("."):
+        if not key:
+            continue
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def _json_extract_scalar(document, path):
+    value = _json_extract(document, path)
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _json_extract_json(document, path):
+    value = _json_extract(document, path)
+    return None if value is None else json.dumps(value)
+
+
+def _regexp_extract(value, pattern):
+    match = re.search(pattern, value or "")
+    if not match:
+        return None
+    return match.group(1) if match.groups() else match.group(0)
+
+
+def _regexp_contains(value, pattern):
+    return re.search(pattern, value or "") is not None
+
+
+class SQLiteSink(EventSink):
+    """
+    Writes rows to a local SQLite database attached as `four_keys`.
+
+    The BigQuery JSON_EXTRACT(_SCALAR) and REGEXP_* functions are
+    registered on the connection, so filters from queries/*.sql can be
+    run against `four_keys.events_raw` with `query()`.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=None):
+        self.path = path or EVENTS_SINK_PATH or "four_keys.db"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self._conn.execute("ATTACH DATABASE ? AS %s" % DATASET_ID, (self.path,))
+        self._conn.create_function("JSON_EXTRACT_SCALAR", 2, _json_extract_scalar)
+        self._conn.create_function("JSON_EXTRACT", 2, _json_extract_json)
+        self._conn.create_function("REGEXP_EXTRACT", 2, _regexp_extract)
+        self._conn.create_function("REGEXP_CONTAINS", 2, _regexp_contains)
+        with self._lock, self._conn:
+            for table_id, columns in TABLE_COLUMNS.items():
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS %s.%s (%s)"
+                    % (DATASET_ID, table_id, ", ".join(columns))
+                )
+                # Adds columns missing from stores created before them
+                stored = {row[1] for row in self._conn.execute(
+                    "PRAGMA %s.table_info(%s)" % (DATASET_ID, table_id)
+                )}
+                for column in columns:
+                    if column not in stored:
+                        self._conn.execute("ALTER TABLE %s.%s ADD COLUMN %s"
+                                           % (DATASET_ID, table_id, column))
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS %s.events_raw_signature "
+                "ON events_raw (signature)" % DATASET_ID
+            )
+
+    def insert_rows(self, table_id, rows, row_ids=None):
+        columns = TABLE_COLUMNS[table_id]
+        sql = "INSERT INTO %s.%s (%s) VALUES (%s)" % (
+            DATASET_ID, table_id, ", ".join(columns),
+            ", ".join("?" * len(columns)),
+        )
+        errors = []
+        rows = _stamped(table_id, rows)
+        with self._lock, self._conn:
+            for i, row in enumerate(rows):
+                try:
+                    self._conn.execute(sql, _row_values(columns, row))
+                except sqlite3.Error as e:
+                    errors.append({"index": i, "errors": [str(e)]})
+        return errors
+
+    def exists(self, table_id, column, value):
+        sql = "SELECT 1 FROM %s.%s WHERE %s = ? LIMIT 1" % (
+            DATASET_ID, table_id, column
+        )
+        with self._lock:
+            return self._conn.execute(sql, (value,)).fetchone() is not None
+
+    def existing(self, table_id, column, values):
+        values = list(values)
+        found = set()
+        with self._lock:
+            for start in range(0, len(values), SQLITE_MAX_VARIABLES):
+                chunk = values[start:start + SQLITE_MAX_VARIABLES]
+                sql = "SELECT DISTINCT %s FROM %s.%s WHERE %s IN (%s)" % (
+                    column, DATASET_ID, table_id, column,
+                    ", ".join("?" * len(chunk)),
+                )
+                found.update(row[0] for row in self._conn.execute(sql, chunk))
+        return found
+
+    def upsert(self, table_id, key, rows):
+        columns = TABLE_COLUMNS[table_id]
+        with self._lock, self._conn:
+            for row in rows:
+                values = dict(zip(columns, _row_values(columns, row)))
+                self._conn.execute(
+                    "DELETE FROM %s.%s WHERE %s = ?" % (DATASET_ID, table_id, key),
+                    (values[key],),
+                )
+                self._conn.execute(
+                    "INSERT INTO %s.%s (%s) VALUES (%s)" % (
+                        DATASET_ID, table_id, ", ".join(columns),
+                        ", ".join("?" * len(columns)),
+                    ),
+                    tuple(values[c] for c in columns),
+                )
+
+    def recent_signatures(self, days):
+        sql = (
+            "SELECT signature FROM %s.events_raw "
+            "WHERE datetime(time_created) >= datetime('now', ?)" % DATASET_ID
+        )
+        with self._lock:
+            rows = self._conn.execute(sql, ("-%d days" % days,)).fetchall()
+        return [row[0] for row in rows]
+
+    def recent_enriched_signatures(self, days):
+        sql = (
+            "SELECT events_raw_signature FROM {0}.events_enriched "
+            "WHERE events_raw_signature IN (SELECT signature FROM {0}.events_raw "
+            "WHERE datetime(time_created) >= datetime('now', ?))"
+        ).format(DATASET_ID)
+        with self._lock:
+            rows = self._conn.execute(sql, ("-%d days" % days,)).fetchall()
+        return [row[0] for row in rows]
+
+    def compact(self, days):
+        # Local stores are small enough to compact in full
+        sql = (
+            "DELETE FROM {0}.events_raw WHERE rowid NOT IN ("
+            "SELECT MIN(rowid) FROM {0}.events_raw GROUP BY signature)"
+        ).format(DATASET_ID)
+        with self._lock, self._conn:
+            return self._conn.execute(sql).rowcount
+
+    def query(self, sql, params=()):
+        """
+        Runs a read-only query against the local store
+        """
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+
+class NDJSONSink(EventSink):
+    """
+    Appends rows as newline-delimited JSON, one file per table.
+
+    The files can be loaded into BigQuery as-is with `bq load
+    --source_format=NEWLINE_DELIMITED_JSON`. The values of each column
+    looked up are indexed in memory the first time, from the file, and
+    kept current as rows are written.
+    """
+
+    name = "ndjson"
+
+    def __init__(self, directory=None):
+        self.directory = directory or EVENTS_SINK_PATH or "events"
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # (table_id, column) -> set of the values stored in that column
+        self._indexes = {}
+
+    def _path(self, table_id):
+        return os.path.join(self.directory, "%s.ndjson" % table_id)
+
+    def insert_rows(self, table_id, rows, row_ids=None):
+        columns = TABLE_COLUMNS[table_id]
+        named = [dict(zip(columns, _row_values(columns, row)))
+                 for row in _stamped(table_id, rows)]
+        with self._lock:
+            with open(self._path(table_id), "a") as f:
+                f.write("".join(json.dumps(row, default=str) + "\n"
+                                for row in named))
+            for (table, column), index in self._indexes.items():
+                if table == table_id:
+                    index.update(row.get(column) for row in named)
+        return []
+
+    def _read(self, table_id):
+        try:
+            with open(self._path(table_id)) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _index(self, table_id, column):
+        # Called with the lock held
+        index = self._indexes.get((table_id, column))
+        if index is None:
+            index = {row.get(column) for row in self._read(table_id)}
+            self._indexes[(table_id, column)] = index
+        return index
+
+    def _rewrite(self, table_id, rows):
+        # Called with the lock held
+        with open(self._path(table_id), "w") as f:
+            f.write("".join(json.dumps(row, default=str) + "\n" for row in rows))
+        for key in [key for key in self._indexes if key[0] == table_id]:
+            del self._indexes[key]
+
+    def exists(self, table_id, column, value):
+        with self._lock:
+            return value in self._index(table_id, column)
+
+    def existing(self, table_id, column, values):
+        with self._lock:
+            return self._index(table_id, column).intersection(values)
+
+    def upsert(self, table_id, key, rows):
+        columns = TABLE_COLUMNS[table_id]
+        updates = [dict(zip(columns, _row_values(columns, row))) for row in rows]
+        replaced = {row[key] for row in updates}
+        with self._lock:
+            kept = [row for row in self._read(table_id)
+                    if row.get(key) not in replaced]
+            self._rewrite(table_id, kept + updates)
+
+    def recent_signatures(self, days):
+        # Local files are small; treat every stored row as recent
+        with self._lock:
+            return list(self._index("events_raw", "signature"))
+
+    def recent_enriched_signatures(self, days):
+        with self._lock:
+            return list(self._index("events_enriched", "events_raw_signature"))
+
+    def compact(self, days):
+        # Local stores are small enough to compact in full
+        with self._lock:
+            rows = self._read("events_raw")
+            seen = set()
+            kept = []
+            for row in rows:
+                if row["signature"] not in seen:
+                    seen.add(row["signature"])
+                    kept.append(row)
+            self._rewrite("events_raw", kept)
+        return len(rows) - len(kept)
+
+
+def _stamped(table_id, rows):
+    # Adds the insertion time to the rows of tables that keep one
+    columns = TABLE_COLUMNS.get(table_id, ())
+    if INSERTED_COLUMN not in columns:
+        return rows
+    now = datetime.utcnow().strftime(CANONICAL_FORMAT)
+    stamped = []
+    for row in rows:
+        if isinstance(row, dict):
+            row = dict(row, **{INSERTED_COLUMN: row.get(INSERTED_COLUMN) or now})
+        elif len(row) < len(columns):
+            row = tuple(row) + (now,)
+        stamped.append(row)
+    return stamped
+
+
+def _row_values(columns, row):
+    if isinstance(row, dict):
+        return tuple(row.get(column) for column in columns)
+    return tuple(row)
+
+
+SINKS = {
+    BigQuerySink.name: BigQuerySink,
+    SQLiteSink.name: SQLiteSink,
+    NDJSONSink.name: NDJSONSink,
+}
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_sink():
+    """
+    Returns the process-wide sink selected by EVENTS_SINK
+    """
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                if EVENTS_SINK not in SINKS:
+                    raise Exception("Unknown events sink: '%s'" % EVENTS_SINK)
+                _sink = SINKS[EVENTS_SINK]()
+    return _sink
+
+
+def set_sink(sink):
+    """
+    Replaces the process-wide sink, e.g. in tests or benchmarks
+    """
+    global _sink
+    _sink = sink
+
+
+def _reset_sink():
+    global _sink, _sink_lock
+    _sink = None
+    _sink_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_sink)
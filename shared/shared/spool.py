@@ -0,0 +1,338 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Enables the spool when set; rows are then acknowledged once on disk
+BQ_SPOOL_DIR = os.environ.get("BQ_SPOOL_DIR")
+SPOOL_SEGMENT_BYTES = int(os.environ.get("SPOOL_SEGMENT_BYTES", 4 * 1024 * 1024))
+# Seconds an open segment may collect rows before it is sealed and drained
+SPOOL_MAX_AGE = float(os.environ.get("SPOOL_MAX_AGE", 2.0))
+SPOOL_DRAIN_BATCH = int(os.environ.get("SPOOL_DRAIN_BATCH", 5000))
+SPOOL_FSYNC = os.environ.get("SPOOL_FSYNC", "true").lower() in ("1", "true")
+SPOOL_MAX_BACKOFF = float(os.environ.get("SPOOL_MAX_BACKOFF", 60))
+
+# Every record is a little-endian (payload length, crc32) header + payload
+HEADER = struct.Struct("<II")
+SEGMENT_PREFIX = "segment-"
+
+# Held while a spool opens its slot, so concurrent first appends in a
+# process open one slot between them
+_open_lock = threading.Lock()
+
+
+def _reset_open_lock():
+    global _open_lock
+    _open_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_open_lock)
+
+
+def read_segment(path):
+    """
+    Returns the records of a segment, stopping at the first torn or
+    corrupt record
+    """
+    records = []
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return records
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = 0
+            while offset + HEADER.size <= size:
+                length, crc = HEADER.unpack_from(data, offset)
+                start = offset + HEADER.size
+                payload = data[start:start + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                records.append(json.loads(payload.decode("utf-8")))
+                offset = start + length
+    return records
+
+
+class Spool(object):
+    """
+    Append-only, segment-based write-ahead log for rows on local disk.
+
+    Rows are appended to the open segment; full or old segments are
+    sealed, uploaded in large batches by a drainer thread, and deleted once
+    every row in them is committed. Appends from concurrent threads share
+    one fsync. Each process locks its own slot directory, and segments left
+    behind by a dead process are picked up by whichever process next locks
+    that slot.
+
+    Subclasses log other records by writing them with `_write` and
+    handing sealed segments on in `_deliver`.
+    """
+
+    thread_name = "bq-spool-drainer"
+    stat_names = ("appended", "fsyncs", "uploaded", "failed", "segments",
+                  "upload_errors")
+    error_stat = "upload_errors"
+    retry_msg = "Spool upload failed, retrying."
+    shutdown_msg = "Spool not drained at shutdown."
+
+    def __init__(self, directory, upload, segment_bytes=SPOOL_SEGMENT_BYTES,
+                 max_age=SPOOL_MAX_AGE, drain_batch=SPOOL_DRAIN_BATCH,
+                 fsync=SPOOL_FSYNC, on_committed=None,
+                 max_backoff=SPOOL_MAX_BACKOFF):
+        self.root = directory
+        self._upload = upload
+        self.segment_bytes = segment_bytes
+        self.max_age = max_age
+        self.drain_batch = drain_batch
+        self.fsync = fsync
+        self.max_backoff = max_backoff
+        self._on_committed = on_committed
+        self._pid = None
+
+    def _open(self):
+        # Runs once per process, on first use
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._backoff = 0
+        self._stats = dict.fromkeys(self.stat_names, 0)
+        os.makedirs(self.root, exist_ok=True)
+        slot = 0
+        while True:
+            directory = os.path.join(self.root, "slot-%d" % slot)
+            os.makedirs(directory, exist_ok=True)
+            lock_file = open(os.path.join(directory, ".lock"), "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                lock_file.close()
+                slot += 1
+        self._lock_file = lock_file
+        self.directory = directory
+        sequences = [int(name[len(SEGMENT_PREFIX):-4])
+                     for name in os.listdir(directory)
+                     if name.startswith(SEGMENT_PREFIX) and name.endswith(".log")]
+        self._sequence = max(sequences) if sequences else 0
+        # Leftover segments are sealed as-is; new rows go to a fresh one
+        self._segment = None
+        self._pid = os.getpid()
+        self._thread = threading.Thread(
+            target=self._run, name=self.thread_name, daemon=True
+        )
+        self._thread.start()
+
+    def _ensure_open(self):
+        if self._pid != os.getpid():
+            with _open_lock:
+                if self._pid != os.getpid():
+                    self._open()
+
+    def _segment_path(self, sequence):
+        return os.path.join(
+            self.directory, "%s%012d.log" % (SEGMENT_PREFIX, sequence)
+        )
+
+    def _sealed(self):
+        with self._lock:
+            active = self._segment["sequence"] if self._segment else None
+        return sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(".log") and
+            int(name[len(SEGMENT_PREFIX):-4]) != active
+        )
+
+    def append(self, table_id, row, row_id=None):
+        """
+        Durably records a row; returns once it is on disk
+        """
+        # Only what the upload needs; the row already holds the event
+        self._write({"table": table_id, "row": row, "row_id": row_id})
+
+    def _write(self, record):
+        # Appends a record to the open segment; returns once it is on disk
+        self._ensure_open()
+        record = json.dumps(record, default=str).encode("utf-8")
+        data = HEADER.pack(len(record), zlib.crc32(record)) + record
+
+        with self._lock:
+            if self._segment is None:
+                self._sequence += 1
+                path = self._segment_path(self._sequence)
+                self._segment = {
+                    "sequence": self._sequence,
+                    "file": open(path, "ab"),
+                    "size": 0,
+                    "synced": 0,
+                    "opened": time.monotonic(),
+                }
+            segment = self._segment
+            segment["file"].write(data)
+            segment["file"].flush()
+            segment["size"] += len(data)
+            written = segment["size"]
+            self._stats["appended"] += 1
+
+        if self.fsync:
+            self._sync(segment, written)
+
+        with self._lock:
+            if self._segment is segment and segment["size"] >= self.segment_bytes:
+                self._seal()
+                self._wake.set()
+
+    def _sync(self, segment, written):
+        # Group commit: whoever gets the lock first fsyncs everything
+        # written so far, and later callers find their bytes already synced
+        with self._sync_lock:
+            if segment["synced"] >= written:
+                return
+            with self._lock:
+                if segment["file"].closed:
+                    # Sealed in the meantime, which synced the file
+                    return
+                size = segment["size"]
+                # A duplicate stays valid even if the segment is sealed
+                # while this fsync runs
+                fileno = os.dup(segment["file"].fileno())
+            try:
+                os.fsync(fileno)
+            finally:
+                os.close(fileno)
+            segment["synced"] = size
+            with self._lock:
+                self._stats["fsyncs"] += 1
+
+    def _seal(self):
+        # Caller holds self._lock
+        if self._segment is not None:
+            if self.fsync:
+                os.fsync(self._segment["file"].fileno())
+            self._segment["file"].close()
+            self._segment = None
+            self._stats["segments"] += 1
+
+    def _seal_if_old(self):
+        with self._lock:
+            segment = self._segment
+            if segment and (self._closed or
+                            time.monotonic() - segment["opened"] >= self.max_age):
+                self._seal()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._backoff or self.max_age)
+            self._wake.clear()
+            self._seal_if_old()
+            try:
+                self.drain()
+                self._backoff = 0
+            except Exception as e:
+                # Keep the segments and retry with exponential backoff
+                self._backoff = min(max(self._backoff * 2, 1), self.max_backoff)
+                with self._lock:
+                    self._stats[self.error_stat] += 1
+                entry = {
+                    "severity": "WARNING",
+                    "msg": self.retry_msg,
+                    "errors": str(e),
+                    "retry_in": self._backoff,
+                }
+                print(json.dumps(entry))
+            if self._closed:
+                return
+
+    def drain(self):
+        """
+        Uploads every sealed segment and deletes it once committed
+        """
+        self._ensure_open()
+        with self._drain_lock:
+            for path in self._sealed():
+                self._deliver(path, read_segment(path))
+                os.remove(path)
+
+    def _deliver(self, path, records):
+        # Raises to keep the segment at `path` for the next drain
+        for start in range(0, len(records), self.drain_batch):
+            self._upload_batch(records[start:start + self.drain_batch])
+
+    def _upload_batch(self, records):
+        by_table = {}
+        for record in records:
+            by_table.setdefault(record["table"], []).append(record)
+
+        for table_id, table_records in by_table.items():
+            # Exceptions propagate so the whole segment is retried; rows are
+            # idempotent through their insert IDs
+            errors = self._upload(
+                table_id,
+                [tuple(r["row"]) for r in table_records],
+                [r["row_id"] for r in table_records],
+            ) or []
+            failed = {error.get("index") for error in errors}
+            for error in errors:
+                # Row-level errors will not succeed on retry; log and move on
+                entry = {
+                    "severity": "WARNING",
+                    "msg": "Row not inserted.",
+                    "errors": error.get("errors"),
+                    "row": table_records[error.get("index")]["row"],
+                    "row_id": table_records[error.get("index")]["row_id"],
+                }
+                print(json.dumps(entry, default=str))
+            with self._lock:
+                self._stats["uploaded"] += len(table_records) - len(failed)
+                self._stats["failed"] += len(failed)
+            if self._on_committed:
+                for i, record in enumerate(table_records):
+                    if i not in failed:
+                        self._on_committed(record)
+
+    def close(self):
+        """
+        Seals the open segment and makes a last attempt to drain
+        """
+        if self._pid != os.getpid():
+            return
+        self._closed = True
+        with self._lock:
+            self._seal()
+        self._wake.set()
+        try:
+            self.drain()
+        except Exception as e:
+            # The segments stay on disk for the next process
+            print(json.dumps({
+                "severity": "WARNING",
+                "msg": self.shutdown_msg,
+                "errors": str(e),
+            }))
+
+    def stats(self):
+        if self._pid != os.getpid():
+            return {}
+        with self._lock:
+            stats = dict(self._stats)
+        stats["pending_segments"] = len(self._sealed())
+        return stats
@@ -0,0 +1,159 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+import re
+import threading
+
+# Every parser writes time_created in UTC in this one format, so readers
+# of events_raw never have to detect formats row by row
+CANONICAL_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+# ISO 8601 and its common variants: a space instead of "T", any number of
+# fraction digits, a "UTC" suffix or an offset with or without a colon,
+# e.g. "2021-04-28 21:50:00 +0200" from GitLab
+_ISO_VARIANT = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:[.,](\d+))?"
+    r" ?(?:(Z|UTC)|([+-])(\d{2}):?(\d{2})?)?$",
+    re.IGNORECASE,
+)
+# Epoch values above this are taken to be in milliseconds
+_EPOCH_MILLIS = 1e11
+
+
+def _iso(value):
+    # The fast path: datetime's own C parser. Before Python 3.11 it takes
+    # neither "Z" nor fractions other than 3 or 6 digits.
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value)
+
+
+def _iso_variant(value):
+    match = _ISO_VARIANT.match(value)
+    if not match:
+        raise ValueError(value)
+    (year, month, day, hour, minute, second, fraction,
+     utc, sign, offset_hours, offset_minutes) = match.groups()
+    tz = None
+    if utc or sign:
+        offset = timedelta(hours=int(offset_hours or 0),
+                           minutes=int(offset_minutes or 0))
+        tz = timezone(-offset if sign == "-" else offset)
+    return datetime(int(year), int(month), int(day), int(hour), int(minute),
+                    int(second), int((fraction or "0")[:6].ljust(6, "0")),
+                    tzinfo=tz)
+
+
+def _epoch(value):
+    if isinstance(value, str):
+        value = float(value)
+    if abs(value) > _EPOCH_MILLIS:
+        value /= 1000.0
+    return datetime.fromtimestamp(value, timezone.utc)
+
+
+def _email(value):
+    # RFC 2822, e.g. "Tue, 15 Jun 2021 13:12:14 GMT"
+    return parsedate_to_datetime(value)
+
+
+# Tried in order until one parses the value
+PARSERS = (_iso, _iso_variant, _epoch, _email)
+# fromtimestamp raises OSError for epochs out of the platform's range
+_UNPARSED = (AttributeError, TypeError, ValueError, OverflowError, OSError)
+
+
+class FormatCache(object):
+    """
+    The parser that last worked for each source, which is tried first for
+    that source's next timestamp. Sources send their timestamps in one or
+    two formats, so a miss, and a new detection, is rare.
+    """
+
+    def __init__(self, parsers=PARSERS):
+        self.parsers = parsers
+        self._lock = threading.Lock()
+        self._detected = {}
+        self._stats = {"hits": 0, "misses": 0, "unparsed": 0}
+
+    def parse(self, value, source=None):
+        """
+        Returns `value`, a timestamp string or epoch seconds or
+        milliseconds, as an aware datetime. Timestamps without an offset
+        are taken to be in UTC. Raises ValueError if no parser takes it.
+        """
+        if isinstance(value, bool):
+            raise ValueError("Unrecognized timestamp: %r" % (value,))
+        cached = self._detected.get(source)
+        if cached is not None:
+            try:
+                parsed = cached(value)
+            except _UNPARSED:
+                pass
+            else:
+                self._count("hits")
+                return parsed
+        for parser in self.parsers:
+            if parser is cached:
+                continue
+            try:
+                parsed = parser(value)
+            except _UNPARSED:
+                continue
+            with self._lock:
+                self._detected[source] = parser
+                self._stats["misses"] += 1
+            return parsed
+        self._count("unparsed")
+        raise ValueError("Unrecognized timestamp: %r" % (value,))
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sources"] = len(self._detected)
+        return stats
+
+
+formats = FormatCache()
+
+
+def parse(value, source=None):
+    """
+    Returns `value` as an aware datetime in UTC; see FormatCache.parse
+    """
+    parsed = formats.parse(value, source)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def normalize(value, source=None):
+    """
+    Returns `value` in CANONICAL_FORMAT, or None if it is None or empty so
+    callers can fall back to another timestamp. Raises ValueError if the
+    value is not a timestamp.
+    """
+    if value is None or value == "":
+        return None
+    parsed = parse(value, source)
+    # Formatted by hand: strftime is several times slower
+    return "%04d-%02d-%02dT%02d:%02d:%02d.%06dZ" % (
+        parsed.year, parsed.month, parsed.day, parsed.hour,
+        parsed.minute, parsed.second, parsed.microsecond,
+    )
@@ -0,0 +1,242 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import atexit
+from concurrent.futures import Future
+import json
+import os
+import signal
+import threading
+import time
+
+# Buffered writes are opt-in: on Cloud Run the service needs CPU allocated
+# outside of requests for the background flush to run on time.
+BQ_BATCH_WRITES = os.environ.get("BQ_BATCH_WRITES", "").lower() in ("1", "true")
+BQ_BATCH_MAX_ROWS = int(os.environ.get("BQ_BATCH_MAX_ROWS", 500))
+BQ_BATCH_MAX_BYTES = int(os.environ.get("BQ_BATCH_MAX_BYTES", 5 * 1024 * 1024))
+BQ_BATCH_MAX_LATENCY = float(os.environ.get("BQ_BATCH_MAX_LATENCY", 1.0))
+
+
+def _row_size(row):
+    return len(json.dumps(row, default=str))
+
+
+class _Pending(object):
+    def __init__(self, row, context, key, size):
+        self.row = row
+        self.context = context
+        self.key = key
+        self.size = size
+        self.future = Future()
+
+
+class BatchWriter(object):
+    """
+    Collects rows from concurrent requests and writes them in batches.
+
+    `insert(rows, row_ids=...)` performs the actual write, with each row's
+    `key` as its insert ID, and returns per-row errors in the
+    `client.insert_rows` format, `[{"index": i, "errors": [...]}]`.
+    A batch is flushed once it holds `max_rows` rows or `max_bytes` bytes,
+    or once its oldest row has waited `max_latency` seconds.
+    """
+
+    def __init__(self, insert, max_rows=BQ_BATCH_MAX_ROWS,
+                 max_bytes=BQ_BATCH_MAX_BYTES, max_latency=BQ_BATCH_MAX_LATENCY,
+                 on_success=None, clock=None):
+        self._insert = insert
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self._on_success = on_success
+        self._clock = clock or time.monotonic
+        self.reset()
+
+    def reset(self):
+        """
+        Drops buffered rows and the flush thread, e.g. in a forked child
+        """
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._buffer = []
+        self._keys = set()
+        self._bytes = 0
+        self._oldest = None
+        self._thread = None
+        self._closed = False
+        self._stats = {"rows": 0, "batches": 0, "errors": 0, "skipped": 0}
+
+    def _start(self):
+        # Caller holds self._cond
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="bq-batch-writer", daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, row, context=None, key=None):
+        """
+        Buffers a row and returns a Future resolved once it is written.
+
+        `context` is logged alongside the row if it fails. Rows sharing a
+        `key` with a row still in the buffer are skipped.
+        """
+        if self._pid != os.getpid():
+            self.reset()
+
+        with self._cond:
+            self._start()
+            if key is not None and key in self._keys:
+                self._stats["skipped"] += 1
+                future = Future()
+                future.set_result([])
+                return future
+
+            pending = _Pending(row, context, key, _row_size(row))
+            self._buffer.append(pending)
+            self._bytes += pending.size
+            if key is not None:
+                self._keys.add(key)
+            if self._oldest is None:
+                self._oldest = self._clock()
+            if self._full():
+                self._cond.notify()
+            closed = self._closed
+
+        # Nothing flushes in the background any more after close()
+        if closed:
+            self.flush()
+        return pending.future
+
+    def _full(self):
+        return (len(self._buffer) >= self.max_rows or
+                self._bytes >= self.max_bytes)
+
+    def _due(self):
+        if not self._buffer:
+            return False
+        return (self._full() or self._closed or
+                self._clock() - self._oldest >= self.max_latency)
+
+    def _take(self):
+        # Caller holds self._cond
+        batch = self._buffer[:self.max_rows]
+        self._buffer = self._buffer[self.max_rows:]
+        self._bytes -= sum(p.size for p in batch)
+        for pending in batch:
+            self._keys.discard(pending.key)
+        self._oldest = self._clock() if self._buffer else None
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._due():
+                    if self._closed:
+                        return
+                    timeout = self.max_latency
+                    if self._oldest is not None:
+                        timeout -= self._clock() - self._oldest
+                    self._cond.wait(max(timeout, 0.001))
+                batch = self._take()
+            self._write(batch)
+
+    def flush(self):
+        """
+        Writes everything buffered so far, blocking until done
+        """
+        while True:
+            with self._cond:
+                if not self._buffer:
+                    break
+                batch = self._take()
+            self._write(batch)
+        # Wait for a batch the flush thread may still be writing
+        with self._flush_lock:
+            pass
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    def _write(self, batch):
+        with self._flush_lock:
+            try:
+                errors = self._insert(
+                    [p.row for p in batch], row_ids=[p.key for p in batch]
+                ) or []
+            except Exception as e:
+                errors = [{"index": i, "errors": [str(e)]}
+                          for i in range(len(batch))]
+
+            failed = {}
+            for error in errors:
+                failed.setdefault(error.get("index"), []).append(error)
+
+            with self._cond:
+                self._stats["batches"] += 1
+                self._stats["rows"] += len(batch)
+                self._stats["errors"] += len(failed)
+
+            for i, pending in enumerate(batch):
+                row_errors = failed.get(i)
+                if row_errors:
+                    # If errors, log to Stackdriver per originating event
+                    entry = {
+                        "severity": "WARNING",
+                        "msg": "Row not inserted.",
+                        "errors": row_errors,
+                        "row": pending.row,
+                        "event": pending.context,
+                    }
+                    print(json.dumps(entry, default=str))
+                elif self._on_success:
+                    self._on_success(pending)
+                pending.future.set_result(row_errors or [])
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["buffered"] = len(self._buffer)
+        return stats
+
+
+def install_shutdown_hooks(writer):
+    """
+    Flushes the writer, or closes anything else with a `close()` method
+    such as a spool, at interpreter exit and on SIGTERM.
+
+    The previous SIGTERM handler (e.g. gunicorn's graceful shutdown) is
+    still called afterwards.
+    """
+    atexit.register(writer.close)
+
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def handle_sigterm(signum, frame):
+            writer.close()
+            if callable(previous):
+                previous(signum, frame)
+            elif previous == signal.SIG_DFL:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                os.kill(os.getpid(), signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except ValueError:
+        # Signal handlers can only be set from the main thread;
+        # rely on atexit in that case.
+        pass
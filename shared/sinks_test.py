@@ -0,0 +1,321 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import datetime
+import json
+import os
+import sqlite3
+
+import shared
+from shared import sinks
+
+import mock
+import pytest
+
+
+ROW = (
+    "push",
+    "bar",
+    json.dumps({"head_commit": {"id": "bar"}, "ref": "refs/heads/main"}),
+    "2021-06-15T13:12:14Z",
+    "foo",
+    "foobar",
+    "github",
+)
+
+
+def _recent(signature):
+    # ROW, created now under another signature
+    now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    return ROW[:3] + (now, signature) + ROW[5:]
+
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+SETUP_DIR = os.path.join(REPO_DIR, "setup")
+
+
+@pytest.fixture(params=["sqlite", "ndjson"])
+def sink(request, tmp_path):
+    if request.param == "sqlite":
+        return sinks.SQLiteSink(str(tmp_path / "four_keys.db"))
+    return sinks.NDJSONSink(str(tmp_path / "events"))
+
+
+def test_insert_and_exists(sink):
+    assert sink.insert_rows("events_raw", [ROW]) == []
+
+    assert sink.exists("events_raw", "signature", "foo")
+    assert not sink.exists("events_raw", "signature", "other")
+
+
+def test_rows_record_insertion_time(sink):
+    sink.insert_rows("events_raw", [ROW])
+
+    if isinstance(sink, sinks.SQLiteSink):
+        [(inserted,)] = sink.query(
+            "SELECT time_inserted FROM four_keys.events_raw"
+        )
+    else:
+        with open(sink._path("events_raw")) as f:
+            inserted = json.loads(f.read())["time_inserted"]
+    assert inserted > ROW[3]
+
+
+def test_sqlite_adds_new_columns_to_old_stores(tmp_path):
+    path = str(tmp_path / "four_keys.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE events_raw (%s)"
+                 % ", ".join(sinks.TABLE_COLUMNS["events_raw"][:-1]))
+    conn.close()
+
+    sink = sinks.SQLiteSink(path)
+
+    assert sink.insert_rows("events_raw", [ROW]) == []
+
+
+def test_compaction_settles_on_insertion_time():
+    sql = sinks.COMPACTION_SQL.format(dataset="four_keys", days=3, settle=90)
+
+    assert "time_created < " not in sql
+    assert sql.count("time_inserted < TIMESTAMP_SUB") == 2
+
+
+def test_sqlite_runs_bigquery_json_functions(tmp_path):
+    sink = sinks.SQLiteSink(str(tmp_path / "four_keys.db"))
+    sink.insert_rows("events_raw", [ROW])
+
+    rows = sink.query(
+        "SELECT JSON_EXTRACT_SCALAR(metadata, '$.head_commit.id') "
+        "FROM four_keys.events_raw WHERE event_type = 'push'"
+    )
+
+    assert rows == [("bar",)]
+
+
+def test_ndjson_rows_are_named(tmp_path):
+    sink = sinks.NDJSONSink(str(tmp_path))
+    sink.insert_rows("events_enriched", [("foo", "{}")])
+
+    with open(str(tmp_path / "events_enriched.ndjson")) as f:
+        assert json.loads(f.read()) == {
+            "events_raw_signature": "foo",
+            "enriched_metadata": "{}",
+        }
+
+
+def test_ndjson_lookups_read_the_file_once(tmp_path):
+    sink = sinks.NDJSONSink(str(tmp_path))
+    sink.insert_rows("events_raw", [ROW])
+
+    with mock.patch.object(sink, "_read", wraps=sink._read) as read:
+        assert sink.exists("events_raw", "signature", "foo")
+        sink.insert_rows("events_raw", [ROW[:4] + ("new",) + ROW[5:]])
+        assert sink.existing("events_raw", "signature", ["new", "x"]) == {"new"}
+
+    assert read.call_count == 1
+
+
+def test_insert_row_into_bigquery_uses_sink(tmp_path):
+    sink = sinks.SQLiteSink(str(tmp_path / "four_keys.db"))
+    shared.set_sink(sink)
+    shared.signatures.reset()
+    event = dict(zip(sinks.TABLE_COLUMNS["events_raw"], ROW))
+
+    try:
+        shared.insert_row_into_bigquery(event)
+        shared.insert_row_into_bigquery(event)
+    finally:
+        shared.set_sink(None)
+
+    assert sink.query("SELECT COUNT(*) FROM four_keys.events_raw") == [(1,)]
+
+
+def test_insert_rows_into_bigquery_writes_batch_once(tmp_path):
+    sink = sinks.SQLiteSink(str(tmp_path / "four_keys.db"))
+    shared.set_sink(sink)
+    shared.signatures.reset()
+    event = dict(zip(sinks.TABLE_COLUMNS["events_raw"], ROW))
+    other = dict(event, signature="bar")
+
+    try:
+        assert shared.insert_rows_into_bigquery([event, other, event]) == []
+        assert shared.insert_rows_into_bigquery([event]) == []
+    finally:
+        shared.set_sink(None)
+
+    assert sink.query("SELECT COUNT(*) FROM four_keys.events_raw") == [(2,)]
+
+
+@pytest.mark.parametrize("reason,error", [
+    ("backendError", shared.TransientError),
+    ("internalError", shared.TransientError),
+    ("invalid", shared.PermanentError),
+])
+def test_insert_row_into_bigquery_raises_row_errors(monkeypatch, reason, error):
+    sink = mock.MagicMock()
+    sink.insert_rows.return_value = [
+        {"index": 0, "errors": [{"reason": reason, "message": "rejected"}]}
+    ]
+    monkeypatch.setattr(shared, "BQ_WRITE_MODE", "insert_id")
+    shared.set_sink(sink)
+    shared.signatures.reset()
+    event = dict(zip(sinks.TABLE_COLUMNS["events_raw"], ROW))
+
+    try:
+        with pytest.raises(error, match=reason):
+            shared.insert_row_into_bigquery(event)
+    finally:
+        shared.set_sink(None)
+
+    assert "foo" not in shared.signatures._recent
+
+
+def test_compact_keeps_one_row_per_signature(sink):
+    sink.insert_rows("events_raw", [ROW, ROW, ROW], row_ids=["foo"] * 3)
+
+    assert sink.compact(3) == 2
+    assert sink.exists("events_raw", "signature", "foo")
+    assert sink.compact(3) == 0
+
+
+def test_insert_id_mode_skips_signature_check(monkeypatch):
+    sink = mock.MagicMock()
+    sink.insert_rows.return_value = []
+    monkeypatch.setattr(shared, "BQ_WRITE_MODE", "insert_id")
+    shared.set_sink(sink)
+    event = dict(zip(sinks.TABLE_COLUMNS["events_raw"], ROW))
+
+    try:
+        shared.insert_row_into_bigquery(event)
+    finally:
+        shared.set_sink(None)
+
+    sink.exists.assert_not_called()
+    sink.recent_signatures.assert_not_called()
+    sink.insert_rows.assert_called_once_with(
+        "events_raw", [ROW], row_ids=["foo"]
+    )
+
+
+def test_existing_returns_stored_subset(sink):
+    sink.insert_rows("events_enriched", [("foo", "{}"), ("bar", "{}")])
+
+    assert sink.existing(
+        "events_enriched", "events_raw_signature", ["foo", "baz"]
+    ) == {"foo"}
+    assert sink.existing("events_enriched", "events_raw_signature", []) == set()
+
+
+def test_sqlite_existing_checks_more_values_than_variables(tmp_path):
+    sink = sinks.SQLiteSink(str(tmp_path / "four_keys.db"))
+    sink.insert_rows("events_enriched", [("foo", "{}")])
+    values = ["sig-%d" % i for i in range(sinks.SQLITE_MAX_VARIABLES * 2)]
+
+    assert sink.existing("events_enriched", "events_raw_signature",
+                         values + ["foo"]) == {"foo"}
+
+
+def test_enriched_warm_up_is_bounded_by_events_raw(sink):
+    sink.insert_rows("events_raw", [ROW, _recent("recent")])
+    sink.insert_rows("events_enriched", [("foo", "{}"), ("recent", "{}")])
+
+    signatures = sink.recent_enriched_signatures(7)
+
+    if isinstance(sink, sinks.SQLiteSink):
+        assert signatures == ["recent"]
+    else:
+        # Local files are small; treat every stored row as recent
+        assert sorted(signatures) == ["foo", "recent"]
+
+
+def test_bigquery_streams_enriched_rows_and_merges_upserts(monkeypatch):
+    client = mock.MagicMock()
+    client.insert_rows.return_value = []
+    monkeypatch.setattr(sinks, "get_client", lambda: client)
+    monkeypatch.setattr(sinks, "get_table", mock.MagicMock())
+    sink = sinks.BigQuerySink()
+
+    assert sink.insert_rows(
+        "events_enriched", [("foo", "{}")], row_ids=["foo"]
+    ) == []
+    client.query.assert_not_called()
+    assert client.insert_rows.call_args[1] == {"row_ids": ["foo"]}
+
+    sink.upsert("events_enriched", "events_raw_signature",
+                [("foo", "{}"), ("bar", "{}")])
+    client.query.assert_called_once()
+    sql = client.query.call_args[0][0]
+    assert sql.startswith("MERGE four_keys.events_enriched")
+    assert "WHEN MATCHED THEN UPDATE SET enriched_metadata" in sql
+
+
+def test_upsert_replaces_rows_by_key(sink):
+    sink.insert_rows("events_enriched", [("foo", "{}")])
+
+    sink.upsert("events_enriched", "events_raw_signature",
+                [("foo", '{"a": 1}'), ("bar", "{}")])
+
+    assert sink.existing("events_enriched", "events_raw_signature",
+                         ["foo", "bar"]) == {"foo", "bar"}
+    if isinstance(sink, sinks.SQLiteSink):
+        assert sink.query(
+            "SELECT enriched_metadata FROM four_keys.events_enriched "
+            "WHERE events_raw_signature = 'foo'"
+        ) == [('{"a": 1}',)]
+
+
+def test_events_enriched_dedups_against_its_own_table(tmp_path):
+    sink = sinks.SQLiteSink(str(tmp_path / "four_keys.db"))
+    sink.insert_rows("events_raw", [_recent("foo"), _recent("bar")])
+    shared.set_sink(sink)
+    shared.enriched_signatures.reset()
+    events = [
+        {"events_raw_signature": "foo", "enriched_metadata": "{}"},
+        {"events_raw_signature": "bar", "enriched_metadata": "{}"},
+        {"events_raw_signature": "bar", "enriched_metadata": "{}"},
+    ]
+
+    try:
+        # "foo" is in events_raw, which must not block the enriched row
+        shared.insert_rows_into_events_enriched(events)
+        shared.enriched_signatures.reset()
+        shared.insert_rows_into_events_enriched(events)
+    finally:
+        shared.set_sink(None)
+
+    assert sink.query(
+        "SELECT events_raw_signature FROM four_keys.events_enriched "
+        "ORDER BY 1"
+    ) == [("bar",), ("foo",)]
+
+
+@pytest.mark.parametrize("table_id", sorted(sinks.TABLE_COLUMNS))
+def test_table_schemas_match_the_sinks(table_id):
+    with open(os.path.join(SETUP_DIR, "%s_schema.json" % table_id)) as f:
+        names = [field["name"] for field in json.load(f)]
+
+    # BigQuery rejects a schema that names a column twice
+    assert len(names) == len(set(names))
+    assert tuple(names) == sinks.TABLE_COLUMNS[table_id]
+
+
+def test_scheduled_compaction_query_matches_the_sink():
+    # terraform schedules this file; it must not drift from compact()
+    with open(os.path.join(REPO_DIR, "queries", "compact_events_raw.sql")) as f:
+        lines = f.read().splitlines(True)
+    sql = "".join(line for line in lines if not line.startswith("--"))
+
+    assert sql == sinks.COMPACTION_SQL.format(
+        dataset="four_keys", days=3, settle=sinks.COMPACTION_SETTLE_MINUTES
+    )
@@ -0,0 +1,121 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+
+from shared import spool
+
+import mock
+
+
+def _spool(tmp_path, upload, **kwargs):
+    kwargs.setdefault("max_age", 60)
+    kwargs.setdefault("fsync", False)
+    return spool.Spool(str(tmp_path), upload, **kwargs)
+
+
+def _segments(directory):
+    return [name for name in os.listdir(directory)
+            if name.startswith(spool.SEGMENT_PREFIX)]
+
+
+def test_rows_uploaded_in_one_batch(tmp_path):
+    upload = mock.MagicMock(return_value=[])
+    row_spool = _spool(tmp_path, upload)
+
+    for i in range(3):
+        row_spool.append("events_raw", ["push", i], row_id="sig-%d" % i)
+    row_spool.close()
+
+    upload.assert_called_once_with(
+        "events_raw",
+        [("push", 0), ("push", 1), ("push", 2)],
+        ["sig-0", "sig-1", "sig-2"],
+    )
+    assert _segments(row_spool.directory) == []
+
+
+def test_segments_kept_when_upload_fails(tmp_path):
+    upload = mock.MagicMock(side_effect=Exception("BigQuery unavailable"))
+    row_spool = _spool(tmp_path, upload)
+
+    row_spool.append("events_raw", ["push", 0], row_id="sig-0")
+    row_spool.close()
+
+    assert len(_segments(row_spool.directory)) == 1
+
+
+def test_leftover_segments_drained_by_next_process(tmp_path):
+    failing = _spool(tmp_path, mock.MagicMock(side_effect=Exception("down")))
+    failing.append("events_raw", ["push", 0], row_id="sig-0")
+    failing.close()
+    failing._lock_file.close()
+
+    upload = mock.MagicMock(return_value=[])
+    recovered = _spool(tmp_path, upload)
+    recovered.drain()
+
+    upload.assert_called_once_with("events_raw", [("push", 0)], ["sig-0"])
+
+
+def test_torn_record_ignored(tmp_path):
+    row_spool = _spool(tmp_path, mock.MagicMock(return_value=[]))
+    row_spool.append("events_raw", ["push", 0], row_id="sig-0")
+    path = os.path.join(row_spool.directory, _segments(row_spool.directory)[0])
+
+    with open(path, "ab") as f:
+        f.write(spool.HEADER.pack(100, 0) + b"partial")
+
+    assert [r["row_id"] for r in spool.read_segment(path)] == ["sig-0"]
+
+
+def test_row_errors_not_retried(tmp_path):
+    upload = mock.MagicMock(return_value=[{"index": 0, "errors": ["bad"]}])
+    row_spool = _spool(tmp_path, upload)
+
+    row_spool.append("events_raw", ["push", 0], row_id="sig-0")
+    row_spool.close()
+
+    assert row_spool.stats()["failed"] == 1
+    assert _segments(row_spool.directory) == []
+
+
+def test_concurrent_first_appends_open_one_slot(tmp_path):
+    row_spool = _spool(tmp_path, mock.MagicMock(return_value=[]))
+    barrier = threading.Barrier(8)
+
+    def append(i):
+        barrier.wait()
+        row_spool.append("events_raw", ["push", i], row_id="sig-%d" % i)
+
+    threads = [threading.Thread(target=append, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    row_spool.close()
+
+    assert sorted(os.listdir(str(tmp_path))) == ["slot-0"]
+    assert row_spool.stats()["uploaded"] == 8
+
+
+def test_records_hold_only_what_the_upload_needs(tmp_path):
+    row_spool = _spool(tmp_path, mock.MagicMock(return_value=[]))
+    row_spool.append("events_raw", ["push", 0], row_id="sig-0")
+    path = os.path.join(row_spool.directory, _segments(row_spool.directory)[0])
+
+    assert spool.read_segment(path) == [
+        {"table": "events_raw", "row": ["push", 0], "row_id": "sig-0"}
+    ]
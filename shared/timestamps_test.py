@@ -0,0 +1,65 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import datetime
+
+from shared import timestamps
+
+import pytest
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("2021-06-15T13:12:14Z", "2021-06-15T13:12:14.000000Z"),
+    ("2021-06-15T13:12:14.123456789Z", "2021-06-15T13:12:14.123456Z"),
+    ("2022-01-12T09:47:26.948+01:00", "2022-01-12T08:47:26.948000Z"),
+    ("2021-04-28 21:50:00 +0200", "2021-04-28T19:50:00.000000Z"),
+    ("2021-04-28 21:50:00 UTC", "2021-04-28T21:50:00.000000Z"),
+    ("2022-01-18 05:35:35.320020", "2022-01-18T05:35:35.320020Z"),
+    ("Tue, 15 Jun 2021 13:12:14 GMT", "2021-06-15T13:12:14.000000Z"),
+    (1623762734, "2021-06-15T13:12:14.000000Z"),
+    (1623762734500, "2021-06-15T13:12:14.500000Z"),
+    ("1623762734", "2021-06-15T13:12:14.000000Z"),
+])
+def test_normalize(value, expected):
+    assert timestamps.normalize(value, "test") == expected
+    datetime.strptime(expected, timestamps.CANONICAL_FORMAT)
+
+
+def test_normalize_missing_and_invalid():
+    assert timestamps.normalize(None) is None
+    assert timestamps.normalize("") is None
+    with pytest.raises(ValueError):
+        timestamps.normalize("yesterday")
+    with pytest.raises(ValueError):
+        timestamps.normalize(True)
+    # Out of range for the platform's fromtimestamp
+    with pytest.raises(ValueError):
+        timestamps.normalize(10 ** 20)
+    with pytest.raises(ValueError):
+        timestamps.normalize("1e300")
+
+
+def test_format_detected_per_source():
+    formats = timestamps.FormatCache()
+
+    formats.parse("2021-04-28 21:50:00 UTC", "gitlab")
+    formats.parse("2021-04-29 21:50:00 UTC", "gitlab")
+    formats.parse("2021-06-15T13:12:14Z", "github")
+    assert formats.stats() == {
+        "hits": 1, "misses": 2, "unparsed": 0, "sources": 2
+    }
+
+    # A source changing format is detected again
+    formats.parse(1623762734, "gitlab")
+    assert formats.stats()["misses"] == 3
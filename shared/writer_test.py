@@ -0,0 +1,84 @@
+# Copyright 2020 Google, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from shared import writer
+
+import mock
+
+
+def test_flush_on_max_rows():
+    insert = mock.MagicMock(return_value=[])
+    batch_writer = writer.BatchWriter(insert, max_rows=3, max_latency=60)
+
+    futures = [batch_writer.submit(("row", i)) for i in range(3)]
+
+    for future in futures:
+        assert future.result(timeout=5) == []
+    insert.assert_called_once_with(
+        [("row", 0), ("row", 1), ("row", 2)], row_ids=[None, None, None]
+    )
+    batch_writer.close()
+
+
+def test_flush_on_max_latency():
+    insert = mock.MagicMock(return_value=[])
+    batch_writer = writer.BatchWriter(insert, max_rows=100, max_latency=0.05)
+
+    future = batch_writer.submit(("row", 0))
+
+    assert future.result(timeout=5) == []
+    insert.assert_called_once_with([("row", 0)], row_ids=[None])
+    batch_writer.close()
+
+
+def test_close_flushes_buffer():
+    insert = mock.MagicMock(return_value=[])
+    batch_writer = writer.BatchWriter(insert, max_rows=100, max_latency=60)
+
+    batch_writer.submit(("row", 0))
+    batch_writer.submit(("row", 1))
+    batch_writer.close()
+
+    insert.assert_called_once_with([("row", 0), ("row", 1)], row_ids=[None, None])
+    assert batch_writer.stats()["batches"] == 1
+
+
+def test_row_errors_map_to_events(capsys):
+    insert = mock.MagicMock(return_value=[{"index": 1, "errors": ["bad"]}])
+    written = []
+    batch_writer = writer.BatchWriter(
+        insert, max_rows=100, max_latency=60,
+        on_success=lambda pending: written.append(pending.context),
+    )
+
+    ok = batch_writer.submit(("row", 0), context={"msg_id": "a"}, key="a")
+    failed = batch_writer.submit(("row", 1), context={"msg_id": "b"}, key="b")
+    batch_writer.close()
+
+    assert ok.result() == []
+    assert failed.result() == [{"index": 1, "errors": ["bad"]}]
+    assert written == [{"msg_id": "a"}]
+    assert '"msg_id": "b"' in capsys.readouterr().out
+
+
+def test_duplicate_keys_skipped():
+    insert = mock.MagicMock(return_value=[])
+    batch_writer = writer.BatchWriter(insert, max_rows=100, max_latency=60)
+
+    batch_writer.submit(("row", 0), key="foo")
+    batch_writer.submit(("row", 0), key="foo")
+    batch_writer.close()
+
+    insert.assert_called_once_with([("row", 0)], row_ids=["foo"])
+    assert batch_writer.stats()["skipped"] == 1
@@ -68,6 +68,12 @@ resource "google_pubsub_subscription" "pagerduty" {
       service_account_email = var.fourkeys_service_account_email
     }
   }
+
+  # Parsers answer transient failures with a 503; back off redeliveries
+  retry_policy {
+    minimum_backoff = "10s"
+    maximum_backoff = "600s"
+  }
 }
 # This IAM role grant is for projects created before April 8, 2021. See: https://cloud.google.com/pubsub/docs/push
 resource "google_project_iam_member" "pubsub_service_account_token_creator" {
@@ -25,6 +25,17 @@ resource "google_bigquery_table" "events_raw" {
   ]
 }
 
+resource "google_bigquery_table" "events_dead_letter" {
+  project             = var.project_id
+  dataset_id          = google_bigquery_dataset.four_keys.dataset_id
+  table_id            = "events_dead_letter"
+  schema              = file("${path.module}/files/events_dead_letter_schema.json")
+  deletion_protection = false
+  depends_on = [
+    google_project_service.fourkeys_services
+  ]
+}
+
 resource "google_bigquery_table" "view_changes" {
   project    = var.project_id
   dataset_id = google_bigquery_dataset.four_keys.dataset_id
@@ -0,0 +1,24 @@
+resource "google_bigquery_data_transfer_config" "compact_events_raw" {
+  project              = var.project_id
+  display_name         = "compact_events_raw"
+  location             = var.bigquery_region
+  data_source_id       = "scheduled_query"
+  schedule             = var.compaction_schedule
+  service_account_name = google_service_account.fourkeys.email
+  params = {
+    query = file("${path.module}/queries/compact_events_raw.sql")
+  }
+  depends_on = [
+    google_project_service.fourkeys_services,
+    google_bigquery_table.events_raw,
+    google_service_account_iam_member.data_transfer_token_creator
+  ]
+}
+
+# Lets the BigQuery Data Transfer service run the query as the fourkeys
+# service account
+resource "google_service_account_iam_member" "data_transfer_token_creator" {
+  service_account_id = google_service_account.fourkeys.name
+  role               = "roles/iam.serviceAccountTokenCreator"
+  member             = "serviceAccount:service-${data.google_project.project.number}@gcp-sa-bigquerydatatransfer.iam.gserviceaccount.com"
+}
@@ -14,6 +14,7 @@ locals {
   pagerduty_parser_url = var.pagerduty_parser_url == "" ? format("gcr.io/%s/pagerduty-parser", var.project_id) : var.pagerduty_parser_url
   services = var.enable_apis ? [
     "bigquery.googleapis.com",
+    "bigquerydatatransfer.googleapis.com",
     "cloudbuild.googleapis.com",
     "run.googleapis.com",
     "secretmanager.googleapis.com",
@@ -0,0 +1 @@
+../../../../queries/compact_events_raw.sql
\ No newline at end of file
@@ -24,6 +24,12 @@ variable "parsers" {
   description = "List of data parsers to configure. Acceptable values are: 'github', 'gitlab', 'cloud-build', 'tekton', 'circleci', 'pagerduty'"
 }
 
+variable "compaction_schedule" {
+  type        = string
+  default     = "every 6 hours"
+  description = "How often duplicate events_raw rows are compacted, in the BigQuery scheduled query format."
+}
+
 variable "enable_apis" {
   type        = bool
   description = "Toggle to include required APIs."